@@ -1,15 +1,19 @@
 """Implementation of client class"""
+from collections import deque
 from typing import TypeVar, Type
 
-from nacl.public import PublicKey
+from nacl.public import PrivateKey, PublicKey
 from tornado.ioloop import IOLoop
 
 from bogascore.log import get_logger
+from bogascore.communication.client import ClientException
 from bogascore.communication.connection import Connection
-from bogascore.communication.message import Message, ChoiceMessage, ChoiceResponseMessage
-from bogascore.serialization.codec import JsonCodec
-from bogasserver.security import Crypto
-from bogasserver.utilsmessages import IntroductionMessage, ServerKeysMessage, ClientKeyMessage
+from bogascore.communication.message import Message, ChoiceMessage, ChoiceResponseMessage, MultiMessage
+from bogascore.serialization.codec import JsonCodec, AvailableCodecs
+from bogascore.serialization.compression import compressed
+from bogascore.serialization.schema import Schema, negotiate_schema
+from bogasserver.security import Crypto, load_key_file, session_random
+from bogasserver.utilsmessages import IntroductionMessage, ServerKeysMessage, ClientKeyMessage, TicketMessage
 
 __author__ = "Marco Capitani"
 __copyright__ = "Copyright 2017, Marco Capitani"
@@ -27,25 +31,59 @@ logger = get_logger(__name__)
 
 class LogIn(object):
 
-    def __init__(self, connection: Connection):
+    def __init__(self, connection: Connection, codec: AvailableCodecs = AvailableCodecs.JSON, compression: str = '',
+                 session: bool = True, ticket: bytes = b'', private_key: PrivateKey = None):
+        """
+        compression is the ID of a registered compression dictionary, or '' not to compress,
+        session whether to ask for session mode encryption (see security.Crypto),
+        ticket the resumption ticket to present, if any (see tickets),
+        private_key the client key, the process wide one of Crypto by default.
+        """
         self.connection = connection
         self.codec = JsonCodec
+        self.requested_codec = codec
+        self.requested_compression = compression
+        self.requested_session = session
+        self.ticket = ticket
+        self.private_key = private_key
         self.crypto = None
+        self.schema = None
+        self.compression = ''
 
     async def do_login(self) -> None:
         logger.debug('Sending introduction')
-        await self.send(IntroductionMessage('test_user', 'JSON'))
+        client_random = session_random() if self.requested_session else b''
+        await self.send(IntroductionMessage('test_user', self.requested_codec.name, Schema.current().fingerprint,
+                                            self.requested_compression, client_random, self.ticket))
+        # The server answers with the codec we asked for.
+        self.codec = self.requested_codec.get_codec()
         skm = await self.receive(ServerKeysMessage)
+        if skm.schema:
+            # Records are used once the key exchange is over.
+            self.schema = negotiate_schema(skm.schema)
+        self.compression = skm.compression
         server_key = PublicKey(skm.server_key)
-        self.crypto = Crypto(server_key)
-        await self.send(ClientKeyMessage(self.crypto.get_public_key().encode()))
+        self.crypto = Crypto(server_key, self.private_key)
+        public_key = self.crypto.public_key.encode()
+        if skm.is_client_key_missing():
+            await self.send(ClientKeyMessage(public_key))
+        elif skm.client_key != public_key:
+            # The server knows the user by another key, and would not understand us
+            raise ClientException('Server expects another key for user test_user: see Client key_file.')
+        if skm.session:
+            self.crypto.start_session(client_random, skm.session, is_client=True)
 
     async def receive(self, message_class: Type[S]) -> S:
         msg = await self.connection.receive()
+        if self.connection.carries_objects:
+            return msg
         decoded_msg = self.codec.decode(msg)
         return message_class.deserialize(decoded_msg)
 
     async def send(self, message: Message):
+        if self.connection.carries_objects:
+            await self.connection.send(message)
+            return
         enc_message = self.codec.encode(message.serialize())
         logger.debug("Sending '{}'.", str(message))
         await self.connection.send(enc_message)
@@ -53,17 +91,41 @@ class LogIn(object):
 
 class Client(object):
 
-    def __init__(self, connection: Connection):
+    def __init__(self, connection: Connection, codec: AvailableCodecs = AvailableCodecs.JSON, compression: str = '',
+                 session: bool = True, key_file: str = None):
+        """
+        With a key_file, the client key is kept in it, generated the first time, so that servers
+        storing the keys of their users (see keystore) know the client after a restart too.
+        """
         self.connection = connection
+        # Kept by the client, not made the key of the whole process: servers may run in it too
+        self.private_key = load_key_file(key_file) if key_file is not None else None
         self.crypto = None
         self.codec = JsonCodec
+        self.requested_codec = codec
+        self.requested_compression = compression
+        self.requested_session = session
+        # Resumption ticket last received
+        self.ticket = b''
+        self.schema = None
         self.running = False
+        # Messages received coalesced in a MultiMessage, not yet returned by receive
+        self.pending = deque()
         # TODO: a separate thread for the UI, with some communication method.
 
     async def login(self) -> None:
-        login = LogIn(self.connection)
+        login = LogIn(self.connection, self.requested_codec, self.requested_compression, self.requested_session,
+                      self.ticket, self.private_key)
         await login.do_login()
         self.crypto = login.crypto
+        self.codec = compressed(login.codec, login.compression) if login.compression else login.codec
+        self.schema = login.schema
+
+    async def resume(self, connection: Connection) -> None:
+        """Log in again over a new connection, presenting the resumption ticket if any."""
+        self.connection = connection
+        self.pending.clear()
+        await self.login()
 
     async def stop(self):
         logger.info('Client shutting down.')
@@ -112,16 +174,40 @@ class Client(object):
         return ChoiceResponseMessage(choice)
 
     async def send(self, message: Message):
-        encoded_message = self.codec.encode(message.serialize())
+        if self.connection.carries_objects:
+            await self.connection.send(message)
+            return
+        data = self.schema.encode(message) if self.schema is not None else message.serialize()
+        encoded_message = self.codec.encode(data)
         encrypted_message = self.crypto.encrypt(encoded_message)
         await self.connection.send(encrypted_message)
 
     async def receive(self, message_class: Type[S] = None) -> S:
+        """
+        Receive a message. MultiMessages are unpacked, returning their messages one by one.
+
+        TicketMessages are not returned, their tickets are kept for resume.
+        """
         logger.debug("Waiting for a {}.", message_class.__name__ if message_class is not None else 'Message')
+        while True:
+            while not self.pending:
+                message = await self._receive()
+                if isinstance(message, MultiMessage):
+                    self.pending.extend(message.messages)
+                else:
+                    self.pending.append(message)
+            message = self.pending.popleft()
+            if not isinstance(message, TicketMessage):
+                return message
+            self.ticket = message.ticket
+
+    async def _receive(self) -> Message:
         msg = await self.connection.receive()
+        if self.connection.carries_objects:
+            return msg
         decrypted_message = self.crypto.decrypt(msg)
         decoded_msg = self.codec.decode(decrypted_message)
-        if message_class is not None:
-            return message_class.deserialize(decoded_msg)
-        else:
-            return Message.parse_message(decoded_msg)
+        if self.schema is not None:
+            return self.schema.decode_message(decoded_msg)
+        # The message could be a MultiMessage, whatever the caller expects
+        return Message.parse_message(decoded_msg)
@@ -1,14 +1,21 @@
 """Client class and related"""
-from typing import TypeVar, Type
+import asyncio
+from typing import Callable, Iterable, List, Tuple, TypeVar, Type
 
 from nacl.public import PublicKey
+from tornado.ioloop import IOLoop
 
 from bogascore.communication.connection import Connection
-from bogascore.communication.message import MultiMessage, Message
-from bogascore.serialization.codec import JsonCodec, Codec, AvailableCodecs
-from bogascore.serialization.serialization import Serializable, SerializationException
+from bogascore.communication.lazy import LazyMessage
+from bogascore.communication.message import MultiMessage, Message, Priority
+from bogascore.communication.outbound import OutboundQueue, OutboundQueueException
+from bogascore.serialization.codec import JsonCodec, Codec, AvailableCodecs, estimate_size
+from bogascore.serialization.compression import compressed, negotiate_compression
+from bogascore.serialization.schema import Schema, negotiate_schema
+from bogascore.serialization.serialization import Primitive, Serializable, SerializationException
 from bogascore.log import get_logger
-from bogasserver.security import Crypto
+from bogasserver.security import Crypto, session_random
+from bogasserver.tickets import Tickets
 from bogasserver.utilsmessages import IntroductionMessage, ServerKeysMessage, ClientKeyMessage
 
 __author__ = "Marco Capitani"
@@ -43,12 +50,21 @@ class ClientBuilder(object):
 
     DEFAULT_CODEC = JsonCodec
 
-    def __init__(self, connection: Connection, client_details: ClientDetails) -> None:
+    def __init__(self, connection: Connection, client_details: ClientDetails, tickets: Tickets = None) -> None:
+        """tickets, if given, checks the resumption tickets presented by clients."""
+        self.tickets = tickets
         self.codec = None
         self.username = None
         self.details = client_details
         self.connection = connection
         self.crypto = None
+        self.schema = None
+        self.compression = ''
+        # Random bytes of the session keys, if the client asked for session mode
+        self.client_random = b''
+        # Public key of the client, if known from a resumption ticket
+        self.client_key = None  # type: PublicKey
+        self.resumed = False
 
     async def do_handshake(self) -> None:
         log.debug("Starting handshake with client {}.", self.details)
@@ -63,89 +79,310 @@ class ClientBuilder(object):
         else:  # Executes only if the loop did not encounter a 'break'
             raise ClientException('Client {} did not complete handshake'.format(self.details))
         self.username = msg.username
+        if msg.ticket and self.tickets is not None:
+            ticket = self.tickets.open(msg.ticket)
+            if ticket is not None:
+                self.username = ticket.username
+                self.client_key = PublicKey(ticket.client_key)
+                self.resumed = True
+                log.debug("Client {} resuming as '{}'.", self.details, self.username)
         try:
             self.codec = AvailableCodecs[msg.codec].get_codec()
             log.debug(str(self.codec))
             log.debug("Client {} assigned username '{}' and codec {}.", self.details, self.username, str(self.codec))
         except (KeyError, ValueError):
             raise ClientException('Client {} requested unavailable codec {}'.format(self.details, msg.codec))
+        if msg.schema:
+            self.schema = negotiate_schema(msg.schema)
+            log.debug("Client {} schema {} {}.", self.details, msg.schema,
+                      'accepted' if self.schema is not None else 'refused')
+        if msg.compression:
+            self.compression = negotiate_compression(msg.compression)
+        self.client_random = msg.session
 
     async def exchange_keys(self, client_key: PublicKey) -> None:
         log.debug("Exchanging keys with client {}.", self.username)
         server_key = Crypto.get_public_key()
         actual_server = server_key.encode()
         actual_client = client_key.encode() if client_key is not None else b''
-        await self.send(ServerKeysMessage(actual_server, actual_client))
+        schema = self.schema.fingerprint if self.schema is not None else ''
+        server_random = session_random() if self.client_random else b''
+        await self.send(ServerKeysMessage(actual_server, actual_client, schema, self.compression, server_random))
         if client_key is None:  # If the user is unknown, wait for his public key
             ckm = await self.receive(ClientKeyMessage)
             client_key = PublicKey(ckm.client_key)
         self.crypto = Crypto(client_key)
+        if server_random:
+            self.crypto.start_session(self.client_random, server_random, is_client=False)
         log.debug("Successfully exchanged keys with client '{}'.", self.username)
 
-    def build(self) -> 'Client':
+    def build(self, **settings) -> 'Client':
+        """settings are passed on to Client: see it for coalescing and outbound queueing."""
         if self.username is None or self.codec is None:
             raise ValueError('Handshake not yet completed')
         if self.crypto is None:
             raise ValueError('Key exchange not yet completed')
         log.debug("Client '{}' now active.", self.username)
-        return Client(self.connection, self.details, self.codec, self.username, self.crypto)
+        return Client(self.connection, self.details, self._session_codec(), self.username, self.crypto, self.schema,
+                      **settings)
 
-    async def receive(self, message_class: Type(S)) -> S:
+    def resume(self, client: 'Client') -> 'Client':
+        """Move a client of the same user, e.g. resuming with a ticket, to the new connection."""
+        if self.crypto is None:
+            raise ValueError('Key exchange not yet completed')
+        if client.username != self.username:
+            raise ValueError('Client {} is not {}'.format(client.username, self.username))
+        log.debug("Client '{}' resumed.", self.username)
+        client.reconnect(self.connection, self.details, self._session_codec(), self.crypto, self.schema)
+        return client
+
+    def _session_codec(self) -> Codec:
+        # Like records, compression is used once the key exchange is over.
+        return compressed(self.codec, self.compression) if self.compression else self.codec
+
+    async def receive(self, message_class: Type[S]) -> S:
         msg = await self.connection.receive()
+        if self.connection.carries_objects:
+            return _expect(message_class, msg)
         codec = self.codec if self.codec is not None else self.DEFAULT_CODEC
         decoded_msg = codec.decode(msg)
 
         return message_class.deserialize(decoded_msg)
 
     async def send(self, message: Message):
+        if self.connection.carries_objects:
+            await self.connection.send(message)
+            return
         codec = self.codec if self.codec is not None else self.DEFAULT_CODEC
         enc_message = codec.encode(message.serialize())
         await self.connection.send(enc_message)
 
 
+# Default size of the coalesced messages, in encoded bytes
+COALESCE_BYTES = 16 * 1024
+
+
 class Client(object):
+    """
+    Server side end of the communication with a client.
+
+    With coalesce_us > 0, sent messages are buffered and sent together, in a MultiMessage,
+    coalesce_us microseconds after the first one, or before they would amount to more than
+    coalesce_bytes encoded bytes, or when waiting to receive a message. Messages are serialized
+    as they are buffered, their encoded size estimated from their serialized data (see
+    estimate_size), so that each flush encodes once, and a message larger than coalesce_bytes
+    is sent by itself.
+
+    With a high_watermark, messages go through an OutboundQueue (see outbound), bounded by
+    high_watermark and low_watermark, and calling overflow_policy on overflow.
+    """
 
     def __init__(self,
                  connection: Connection,
                  client_details: ClientDetails,
                  codec: Codec,
                  username: str,
-                 crypto: Crypto):
+                 crypto: Crypto,
+                 schema: Schema = None,
+                 coalesce_us: int = 0,
+                 coalesce_bytes: int = None,
+                 high_watermark: int = None,
+                 low_watermark: int = None,
+                 overflow_policy: Callable[[OutboundQueue], None] = None):
         self.codec = codec
         self.username = username
         self.details = client_details
         self.connection = connection
         self.crypto = crypto
+        self.schema = schema
         self.buffer = []
+        # Serialized buffered messages, and their estimated encoded size
+        self._serialized_buffer = []
+        self._buffered_bytes = 0
+        self.coalesce_us = coalesce_us
+        self.coalesce_bytes = coalesce_bytes if coalesce_bytes is not None else COALESCE_BYTES
+        self._flush_timeout = None
+        # Task waiting to read from the connection, woken if the client moves: see reconnect
+        self._reader = None  # type: asyncio.Task
+        self.queue = None
+        if high_watermark is not None:
+            self.queue = OutboundQueue(self._encode, self._write, high_watermark, low_watermark, overflow_policy)
+
+    def reconnect(self, connection: Connection, client_details: ClientDetails, codec: Codec, crypto: Crypto,
+                  schema: Schema = None) -> None:
+        """
+        Go on over a new connection: see ClientBuilder.resume.
+
+        Messages being received are then read from the new connection.
+        """
+        self.connection = connection
+        self.details = client_details
+        self.codec = codec
+        self.crypto = crypto
+        self.schema = schema
+        if self._reader is not None:
+            self._reader.cancel()
 
     async def send(self, message: Message):
-        # self.buffer.append(message)
-        await self._send(message)
+        """Send a message. LazyMessages are relayed encoded as they were, if possible."""
+        if isinstance(message, LazyMessage):
+            # Not coalesced, as MultiMessages are encoded anew
+            await self.flush_buffer()
+            await self._send(message)
+            return
+        if self.coalesce_us <= 0:
+            await self._send(message)
+            return
+        data = None if self.connection.carries_objects else self._serialize(message)
+        size = estimate_size(data) if data is not None else 0
+        if self.buffer and self._buffered_bytes + size > self.coalesce_bytes:
+            await self.flush_buffer()
+        self.buffer.append(message)
+        self._serialized_buffer.append(data)
+        self._buffered_bytes += size
+        if self._buffered_bytes >= self.coalesce_bytes:
+            await self.flush_buffer()
+        elif self._flush_timeout is None:
+            io_loop = IOLoop.current()
+            self._flush_timeout = io_loop.call_later(
+                self.coalesce_us / 1e6, lambda: io_loop.spawn_callback(self.flush_buffer))
 
     async def flush_buffer(self):
-        multi_message = MultiMessage(self.buffer)
-        self.buffer.clear()
-        await self._send(multi_message)
+        if self._flush_timeout is not None:
+            IOLoop.current().remove_timeout(self._flush_timeout)
+            self._flush_timeout = None
+        if not self.buffer:
+            return
+        messages, self.buffer = self.buffer, []
+        serialized_messages, self._serialized_buffer = self._serialized_buffer, []
+        self._buffered_bytes = 0
+        if len(messages) == 1:
+            data = serialized_messages[0]
+            await self._send(messages[0], encoded_message=None if data is None else self._encode_data(data))
+        else:
+            await self._send(MultiMessage(messages), min(m.priority for m in messages))
+
+    async def send_encoded(self, message: Message, encoded_message: bytes) -> None:
+        """Send a message already encoded with the codec and schema of the client: see broadcast."""
+        await self.flush_buffer()
+        await self._send(message, encoded_message=encoded_message)
 
-    async def _send(self, message: Message):
-        encoded_message = self.codec.encode(message.serialize())
-        log.debug("Sending: {}.", repr(encoded_message.decode()))
+    async def _send(self, message: Message, priority: Priority = None, encoded_message: bytes = None) -> int:
+        """Send a message, returning its encoded size."""
+        if self.connection.carries_objects:
+            await self.connection.send(message.materialize() if isinstance(message, LazyMessage) else message)
+            return 0
+        if self.queue is None:
+            if encoded_message is None:
+                encoded_message = self._encode(message)
+            await self._write(encoded_message)
+            return len(encoded_message)
+        try:
+            return await self.queue.put(message, priority, encoded_message)
+        except OutboundQueueException as e:
+            raise ClientException('Could not send to client {}: {}'.format(self.username, e)) from e
+
+    def _encode(self, message: Message) -> bytes:
+        if isinstance(message, LazyMessage):
+            if message.codec is self.codec and message.schema is self.schema:
+                return message.data
+            message = message.materialize()
+        return self._encode_data(self._serialize(message))
+
+    def _serialize(self, message: Message) -> Primitive:
+        return self.schema.encode(message) if self.schema is not None else message.serialize()
+
+    def _encode_data(self, data: Primitive) -> bytes:
+        encoded_message = self.codec.encode(data)
+        log.debug("Sending: {}.", encoded_message)
+        return encoded_message
+
+    async def _write(self, encoded_message: bytes) -> None:
         encrypted_message = self.crypto.encrypt(encoded_message)
         await self.connection.send(encrypted_message)
 
-    async def receive(self, message_class: Type[S]) -> S:
-        # await self.flush_buffer()
+    async def receive(self, message_class: Type[S] = Message) -> S:
+        """Receive a message of class message_class, or of any class by default."""
+        await self.flush_buffer()
         log.debug("Waiting for a '{}'.", message_class.__name__)
-        msg = await self.connection.receive()
+        msg = await self._read()
+        if self.connection.carries_objects:
+            return _expect(message_class, msg)
         decrypted_message = self.crypto.decrypt(msg)
         decoded_msg = self.codec.decode(decrypted_message)
+        if self.schema is not None:
+            return _expect(message_class, self.schema.decode_message(decoded_msg))
+        try:
+            message = Message.parse_message(decoded_msg)
+        except KeyError as e:
+            raise SerializationException('Unknown message type.') from e
+        return _expect(message_class, message)
 
-        # Below is due to type hinting limitation. Receive actually asks
-        # for a subclass of Serializable, but it had to be declared as
-        # above in order for the return value to be detected as the correct type.
+    async def receive_lazy(self) -> LazyMessage:
+        """
+        Receive a message of any class, deserializing its members only when accessed.
 
-        # noinspection PyUnresolvedReferences
-        return message_class.deserialize(decoded_msg)
+        Meant for messages to be routed or relayed: see LazyMessage.
+        """
+        await self.flush_buffer()
+        msg = await self._read()
+        if self.connection.carries_objects:
+            # Already deserialized, members are attributes as with LazyMessages
+            return msg
+        return LazyMessage(self.crypto.decrypt(msg), self.codec, self.schema)
+
+    async def _read(self):
+        """Read from the connection, or from the one the client moves to in the meantime."""
+        while True:
+            connection = self.connection
+            self._reader = asyncio.current_task()
+            try:
+                return await connection.receive()
+            except asyncio.CancelledError:
+                if self.connection is connection:
+                    raise
+                # Cancelled by reconnect, not by the caller
+                if hasattr(self._reader, 'uncancel'):
+                    self._reader.uncancel()
+            finally:
+                self._reader = None
+
+
+async def broadcast(clients: Iterable[Client], message: Message) -> List[Tuple[Client, Exception]]:
+    """
+    Send a message to many clients, returning those it could not be sent to, with the errors.
+
+    The message is serialized once per schema and encoded once per codec, then encrypted
+    for each client, and written to all of them concurrently. Clients coalescing messages
+    buffer it as any other, to encode it with the rest, and LazyMessages are encoded by
+    each client, as they can be relayed as they are.
+    """
+    clients = list(clients)
+    serialized = {}
+    encoded = {}
+    sends = []
+    for client in clients:
+        if client.connection.carries_objects or client.coalesce_us > 0 or isinstance(message, LazyMessage):
+            sends.append(client.send(message))
+            continue
+        key = (client.codec, client.schema)
+        encoded_message = encoded.get(key)
+        if encoded_message is None:
+            data = serialized.get(client.schema)
+            if data is None:
+                data = serialized[client.schema] = \
+                    client.schema.encode(message) if client.schema is not None else message.serialize()
+            encoded_message = encoded[key] = client.codec.encode(data)
+        sends.append(client.send_encoded(message, encoded_message))
+    results = await asyncio.gather(*sends, return_exceptions=True)
+    return [(client, result) for client, result in zip(clients, results) if isinstance(result, Exception)]
+
+
+def _expect(message_class: Type[S], message: Message) -> S:
+    if not isinstance(message, message_class):
+        raise SerializationException('Expected a {}, got a {}.'.format(
+            message_class.__name__, type(message).__name__))
+    return message
 
 
 class ClientException(Exception):
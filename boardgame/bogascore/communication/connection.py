@@ -1,9 +1,20 @@
-"""Connections established between server and client"""
+"""
+Connections established between server and client
 
+Socket connections send every message in a frame, prefixed by its length. The length
+is written on two bytes by default (Framing.LEGACY), which limits messages to 64 KiB:
+the connecting side can ask for another framing by sending, before any message,
+an empty legacy frame followed by the framing byte. The other side answers the same way,
+with the framing it agreed to, and both switch to it.
+"""
+
+import socket
 from abc import ABCMeta, abstractmethod
-from typing import List
+from asyncio import Queue, gather
+from enum import Enum
+from typing import AsyncIterator, List, Optional, Tuple
 
-from tornado.iostream import IOStream
+from tornado.iostream import IOStream, StreamClosedError
 
 from bogascore.log import get_logger
 
@@ -21,6 +32,9 @@ logger = get_logger(__name__)
 
 class Connection(metaclass=ABCMeta):
 
+    # Whether messages are sent and received as objects, rather than encrypted bytes
+    carries_objects = False
+
     @abstractmethod
     async def send(self, message: bytes) -> None:
         pass
@@ -30,18 +44,30 @@ class Connection(metaclass=ABCMeta):
         pass
 
 
-# class DirectConnection(Connection):
-#
-#     def __init__(self, client: Client):
-#         self.client = client
-#         self.buffer = None
-#
-#     async def receive(self) -> str:
-#         res = await self.client.get_input()
-#         return res
-#
-#     async def send(self, message: str) -> None:
-#         self.client.accept_message(message)
+class DirectConnection(Connection):
+    """
+    One end of an in-process connection, see direct_connection_pair.
+
+    If carries_objects is set, the messages are passed as they are, without encoding
+    or encryption: both ends share the message objects, which must not be modified.
+    """
+
+    def __init__(self, inbox: Queue, outbox: Queue, carries_objects: bool = False) -> None:
+        self.inbox = inbox
+        self.outbox = outbox
+        self.carries_objects = carries_objects
+
+    async def receive(self):
+        return await self.inbox.get()
+
+    async def send(self, message) -> None:
+        await self.outbox.put(message)
+
+
+def direct_connection_pair(carries_objects: bool = False, maxsize: int = 0) -> Tuple[DirectConnection, DirectConnection]:
+    """Return the two ends of an in-process connection, each holding up to maxsize unread messages."""
+    a, b = Queue(maxsize), Queue(maxsize)
+    return DirectConnection(a, b, carries_objects), DirectConnection(b, a, carries_objects)
 
 
 class FakeConnection(Connection):
@@ -59,33 +85,224 @@ class FakeConnection(Connection):
         print('FakeConnection sending "{}".'.format(message))
 
 
+# Longest varint header, enough for 64 bit lengths
+MAX_VARINT_SIZE = 10
+
+
+class Framing(Enum):
+    LEGACY = 0  # 2 bytes big-endian length
+    VARINT = 1  # LEB128 varint length
+    LONG = 2  # 4 bytes big-endian length
+
+    def header(self, length: int) -> bytes:
+        if self == Framing.VARINT:
+            header = bytearray()
+            while length > 0x7f:
+                header.append((length & 0x7f) | 0x80)
+                length >>= 7
+            header.append(length)
+            return bytes(header)
+        size = 2 if self == Framing.LEGACY else 4
+        try:
+            return length.to_bytes(size, 'big')
+        except OverflowError:
+            raise FramingException('Message of {} bytes too large for {} framing.'.format(length, self.name))
+
+    def parse_header(self, buffer: bytearray, start: int, end: int) -> Optional[Tuple[int, int]]:
+        """
+        Return the length of the message and the size of the header at start, None if incomplete.
+
+        :raises FramingException: if a varint header goes on for more than MAX_VARINT_SIZE bytes.
+        """
+        if self == Framing.VARINT:
+            length = 0
+            shift = 0
+            for i in range(start, min(end, start + MAX_VARINT_SIZE)):
+                b = buffer[i]
+                length |= (b & 0x7f) << shift
+                if b < 0x80:
+                    return length, i + 1 - start
+                shift += 7
+            if end - start >= MAX_VARINT_SIZE:
+                raise FramingException('Varint header longer than {} bytes.'.format(MAX_VARINT_SIZE))
+            return None
+        size = 2 if self == Framing.LEGACY else 4
+        if end - start < size:
+            return None
+        return int.from_bytes(buffer[start:start + size], 'big'), size
+
+
+# Largest message accepted by receive, to be safe from corrupted or malicious lengths
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+
+class FrameReader(object):
+    """
+    Reader of the frames coming from a stream.
+
+    Reads whatever is available into a reusable buffer, and slices out the complete
+    frames as memoryviews, which are only valid until the next frame is requested.
+    Frames too large for the buffer are read in place, in a buffer of their own.
+    """
+
+    BUFFER_SIZE = 16 * 1024
+
+    # Incomplete frames are moved to the beginning of the buffer when less space is left
+    _MIN_READ = 4 * 1024
+
+    def __init__(self, stream: IOStream, framing: Framing = Framing.LEGACY) -> None:
+        self.stream = stream
+        self.framing = framing
+        self.buffer = bytearray(self.BUFFER_SIZE)
+        self._start = 0
+        self._end = 0
+
+    async def _fill(self) -> None:
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif self._start > 0 and len(self.buffer) - self._end < self._MIN_READ:
+            # Move the incomplete frame at the beginning: this does not resize the buffer,
+            # so frames already returned are only overwritten, as documented.
+            pending = self._end - self._start
+            self.buffer[:pending] = self.buffer[self._start:self._end]
+            self._start, self._end = 0, pending
+        if self._end == len(self.buffer):
+            # Reading into no space would return at once, forever
+            raise FramingException('Incomplete frame filling the whole buffer.')
+        self._end += await self.stream.read_into(memoryview(self.buffer)[self._end:], partial=True)
+
+    async def read(self, n: int) -> bytes:
+        """Read n bytes, outside of any frame."""
+        while self._end - self._start < n:
+            await self._fill()
+        data = bytes(self.buffer[self._start:self._start + n])
+        self._start += n
+        return data
+
+    async def next_frame(self) -> memoryview:
+        while True:
+            header = self.framing.parse_header(self.buffer, self._start, self._end)
+            if header is not None:
+                length, header_size = header
+                if length > MAX_FRAME_SIZE:
+                    raise FramingException('Incoming message of {} bytes exceeds the maximum size.'.format(length))
+                start = self._start + header_size
+                if self._end - start >= length:
+                    self._start = start + length
+                    return memoryview(self.buffer)[start:self._start]
+                if start + length > len(self.buffer) and length > len(self.buffer) - self._MIN_READ:
+                    return await self._read_large(start, length)
+            await self._fill()
+
+    async def _read_large(self, start: int, length: int) -> memoryview:
+        frame = bytearray(length)
+        buffered = self._end - start
+        frame[:buffered] = self.buffer[start:self._end]
+        self._start = self._end = 0
+        await self.stream.read_into(memoryview(frame)[buffered:])
+        return memoryview(frame)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> memoryview:
+        try:
+            return await self.next_frame()
+        except StreamClosedError:
+            raise StopAsyncIteration
+
+
 class SocketConnection(Connection):
 
-    def __init__(self, stream: IOStream) -> None:
+    def __init__(self, stream: IOStream, framing: Framing = Framing.LEGACY) -> None:
         self.stream = stream
+        self.reader = FrameReader(stream, framing)
+        # Framing can be negotiated before the first message only
+        self._negotiable = framing == Framing.LEGACY
+
+    @property
+    def framing(self) -> Framing:
+        return self.reader.framing
+
+    @framing.setter
+    def framing(self, framing: Framing) -> None:
+        self.reader.framing = framing
+
+    async def negotiate_framing(self, framing: Framing) -> Framing:
+        """Ask the other side for a framing, returning the one agreed upon."""
+        if not self._negotiable:
+            raise FramingException('Framing can only be negotiated before any message is sent.')
+        self._negotiable = False
+        if framing != Framing.LEGACY:
+            await self.stream.write(bytes((0, 0, framing.value)))
+            answer = await self.reader.read(3)
+            self.framing = Framing(answer[2])
+            logger.debug('Framing {} requested, {} agreed.', framing.name, self.framing.name)
+        return self.framing
+
+    async def _accept_framing(self) -> None:
+        value = (await self.reader.read(1))[0]
+        try:
+            framing = Framing(value)
+        except ValueError:
+            framing = Framing.LEGACY
+        await self.stream.write(bytes((0, 0, framing.value)))
+        self.framing = framing
+        logger.debug('Framing {} requested, {} agreed.', value, framing.name)
+
+    async def next_frame(self) -> memoryview:
+        """Receive a message as a memoryview, only valid until the next one is received."""
+        frame = await self.reader.next_frame()
+        if self._negotiable:
+            self._negotiable = False
+            if len(frame) == 0:
+                await self._accept_framing()
+                frame = await self.reader.next_frame()
+        return frame
+
+    async def frames(self) -> AsyncIterator[memoryview]:
+        """Iterate over the incoming messages, as next_frame returns them, until the stream is closed."""
+        try:
+            while True:
+                yield await self.next_frame()
+        except StreamClosedError:
+            return
 
     async def receive(self) -> bytes:
         await super(SocketConnection, self).receive()
-        l_bytes = await self.stream.read_bytes(2)
-        l = int.from_bytes(l_bytes, 'big')
-        return await self.stream.read_bytes(l)
+        frame = await self.next_frame()
+        # Large frames have a buffer of their own, which can be handed out as it is: decrypting
+        # copies it once (see Crypto.decrypt).
+        return bytes(frame) if frame.obj is self.reader.buffer else frame.obj
 
     async def send(self, message: bytes) -> None:
         await super(SocketConnection, self).send(message)
-        l = len(message)
-        l_bytes = bytes([l // 256, l % 256])
-        return await self.stream.write(l_bytes + message)
+        self._negotiable = False
+        # Queued one after the other: no need to copy the message after the header.
+        # Both are awaited, so that errors writing the header are not lost.
+        await gather(self.stream.write(self.framing.header(len(message))), self.stream.write(message))
 
 
 class SelfOpeningSocketConnection(SocketConnection):
+    """
+    Connection opening itself on first use, either to a TCP address and port,
+    or to the Unix domain socket at unix_socket, if given.
+
+    Without a stream, a socket of the right family is created.
+    """
 
-    def __init__(self, stream: IOStream, address: str = "127.0.0.1", port: int = 30645) -> None:
+    def __init__(self, stream: IOStream = None, address: str = "127.0.0.1", port: int = 30645,
+                 framing: Framing = Framing.LEGACY, unix_socket: str = None) -> None:
+        if stream is None:
+            stream = IOStream(socket.socket(socket.AF_UNIX if unix_socket is not None else socket.AF_INET))
         super().__init__(stream)
         self.address = address
         self.port = port
+        self.unix_socket = unix_socket
 
         async def connect():
-            await self.stream.connect((self.address, self.port))
+            await self.stream.connect(self.unix_socket if self.unix_socket is not None else (self.address, self.port))
+            await self.negotiate_framing(framing)
 
             async def null_connect():
                 pass
@@ -99,3 +316,7 @@ class SelfOpeningSocketConnection(SocketConnection):
     async def receive(self) -> bytes:
         await self.connect()
         return await super().receive()
+
+
+class FramingException(Exception):
+    pass
@@ -0,0 +1,255 @@
+"""
+Multiplexing of the messages of a client
+
+Client.receive returns the next message on the wire, so a client can only take part in
+one conversation at a time. A Dispatcher reads the messages of a client continuously
+instead, and routes them by channel and class to whoever is waiting for them: callers
+of receive, subscriptions, or requests waiting for their response. Several game sessions
+can thus share one client, each on its own channel, and requests can be pipelined.
+
+Messages on channels other than DEFAULT_CHANNEL, requests and responses travel wrapped
+in a ChannelMessage. Plain messages belong to DEFAULT_CHANNEL, so peers without a
+dispatcher can still talk to one on that channel.
+"""
+import asyncio
+from collections import defaultdict, deque
+from itertools import count
+from typing import Dict, List, Optional, Tuple, Type, TypeVar
+
+from bogascore.communication.message import Message, MultiMessage, ChannelMessage
+from bogascore.log import get_logger
+from bogascore.serialization.serialization import SerializationException
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+log = get_logger(__name__)
+
+S = TypeVar('S', bound=Message)
+
+DEFAULT_CHANNEL = 0
+
+# Messages nobody is waiting for are kept for later receive calls, up to this many
+BACKLOG_SIZE = 1024
+
+
+class DispatcherException(Exception):
+    pass
+
+
+class Subscription(object):
+    """
+    Asynchronous iterator over the messages of a class received on a channel.
+
+    Messages come in their ChannelMessage envelope, so that requests can be responded to.
+    """
+
+    def __init__(self, dispatcher: 'Dispatcher', channel: int, message_class: Type[Message]) -> None:
+        self.dispatcher = dispatcher
+        self.channel = channel
+        self.message_class = message_class
+        self.queue = asyncio.Queue()
+
+    def __aiter__(self) -> 'Subscription':
+        return self
+
+    async def __anext__(self) -> ChannelMessage:
+        envelope = await self.queue.get()
+        if envelope is None:
+            raise StopAsyncIteration
+        return envelope
+
+    def close(self) -> None:
+        subscriptions = self.dispatcher.subscriptions[self.channel]
+        if self in subscriptions:
+            subscriptions.remove(self)
+        self.queue.put_nowait(None)
+
+
+class Channel(object):
+    """Dispatcher view restricted to a channel."""
+
+    def __init__(self, dispatcher: 'Dispatcher', channel: int) -> None:
+        self.dispatcher = dispatcher
+        self.channel = channel
+
+    async def send(self, message: Message) -> None:
+        await self.dispatcher.send(message, self.channel)
+
+    async def receive(self, message_class: Type[S] = Message) -> S:
+        return await self.dispatcher.receive(message_class, self.channel)
+
+    async def receive_envelope(self, message_class: Type[Message] = Message) -> ChannelMessage:
+        return await self.dispatcher.receive_envelope(message_class, self.channel)
+
+    async def request(self, message: Message, response_class: Type[S] = Message) -> S:
+        return await self.dispatcher.request(message, response_class, self.channel)
+
+    async def respond(self, request: ChannelMessage, message: Message) -> None:
+        await self.dispatcher.respond(request, message)
+
+    def subscribe(self, message_class: Type[Message] = Message) -> Subscription:
+        return self.dispatcher.subscribe(message_class, self.channel)
+
+
+class Dispatcher(object):
+    """
+    Reader of the messages of client, routing them by channel and class.
+
+    client is anything with coroutines send(message) and receive(message_class), like the
+    clients of bogascore.communication.client and bogasclient.client. Once the
+    dispatcher is started, nobody else should receive from it.
+
+    A received message goes to the earliest receive call waiting for its channel and
+    class, or else to all the matching subscriptions, or else to the backlog, where
+    later receive calls find it. Responses go to the request with their correlation ID.
+    """
+
+    def __init__(self, client) -> None:
+        self.client = client
+        self.waiters = defaultdict(list)  # type: Dict[int, List[Tuple[Type[Message], asyncio.Future]]]
+        self.subscriptions = defaultdict(list)  # type: Dict[int, List[Subscription]]
+        self.requests = {}  # type: Dict[int, asyncio.Future]
+        self.backlog = deque()
+        self._correlations = count(1)
+        self._reader = None  # type: Optional[asyncio.Future]
+        self._error = None  # type: Optional[Exception]
+
+    def start(self) -> None:
+        if self._reader is None:
+            self._reader = asyncio.ensure_future(self._read_loop())
+
+    def stop(self) -> None:
+        if self._reader is not None:
+            self._reader.cancel()
+        self._fail(DispatcherException('Dispatcher stopped.'))
+
+    def channel(self, channel: int) -> Channel:
+        return Channel(self, channel)
+
+    async def send(self, message: Message, channel: int = DEFAULT_CHANNEL) -> None:
+        if channel != DEFAULT_CHANNEL:
+            message = ChannelMessage(channel, 0, message)
+        await self.client.send(message)
+
+    async def receive(self, message_class: Type[S] = Message, channel: int = DEFAULT_CHANNEL) -> S:
+        """Receive the next message of class message_class on channel."""
+        return (await self.receive_envelope(message_class, channel)).message
+
+    async def receive_envelope(self, message_class: Type[Message] = Message,
+                               channel: int = DEFAULT_CHANNEL) -> ChannelMessage:
+        """As receive, returning the message in its envelope: see respond."""
+        self._check()
+        for i, envelope in enumerate(self.backlog):
+            if envelope.channel == channel and isinstance(envelope.message, message_class):
+                del self.backlog[i]
+                return envelope
+        future = asyncio.get_event_loop().create_future()
+        self.waiters[channel].append((message_class, future))
+        return await future
+
+    def subscribe(self, message_class: Type[Message] = Message, channel: int = DEFAULT_CHANNEL) -> Subscription:
+        """Subscribe to the messages of class message_class on channel, until the subscription is closed."""
+        self._check()
+        subscription = Subscription(self, channel, message_class)
+        self.subscriptions[channel].append(subscription)
+        for envelope in [e for e in self.backlog if e.channel == channel and isinstance(e.message, message_class)]:
+            self.backlog.remove(envelope)
+            subscription.queue.put_nowait(envelope)
+        return subscription
+
+    async def request(self, message: Message, response_class: Type[S] = Message,
+                      channel: int = DEFAULT_CHANNEL) -> S:
+        """Send a request, returning the response. Any number of requests can be pending."""
+        self._check()
+        correlation = next(self._correlations)
+        future = asyncio.get_event_loop().create_future()
+        self.requests[correlation] = future
+        try:
+            await self.client.send(ChannelMessage(channel, correlation, message))
+            response = await future
+        finally:
+            self.requests.pop(correlation, None)
+        if not isinstance(response, response_class):
+            raise SerializationException('Expected a {}, got a {}.'.format(
+                response_class.__name__, type(response).__name__))
+        return response
+
+    async def respond(self, request: ChannelMessage, message: Message) -> None:
+        """Send the response to a request, as received by receive_envelope or a subscription."""
+        if not request.correlation:
+            raise DispatcherException('{} is not a request.'.format(request.message))
+        await self.client.send(ChannelMessage(request.channel, request.correlation, message, True))
+
+    async def _read_loop(self) -> None:
+        try:
+            while True:
+                message = await self.client.receive(Message)
+                if isinstance(message, MultiMessage):
+                    for m in message.messages:
+                        self._dispatch(m)
+                else:
+                    self._dispatch(message)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.debug('Dispatcher stopped reading: {}', e)
+            self._fail(e)
+
+    def _dispatch(self, message: Message) -> None:
+        envelope = message if isinstance(message, ChannelMessage) else ChannelMessage(DEFAULT_CHANNEL, 0, message)
+        if envelope.response:
+            future = self.requests.pop(envelope.correlation, None)
+            if future is None:
+                log.warning('Dropping response {} to no pending request.', envelope.correlation)
+            elif not future.done():
+                future.set_result(envelope.message)
+            return
+        waiters = self.waiters.get(envelope.channel)
+        if waiters:
+            for i, (message_class, future) in enumerate(waiters):
+                if isinstance(envelope.message, message_class) and not future.done():
+                    del waiters[i]
+                    future.set_result(envelope)
+                    return
+            # Drop the waiters cancelled meanwhile
+            waiters[:] = [w for w in waiters if not w[1].done()]
+        delivered = False
+        for subscription in self.subscriptions.get(envelope.channel, ()):
+            if isinstance(envelope.message, subscription.message_class):
+                subscription.queue.put_nowait(envelope)
+                delivered = True
+        if delivered:
+            return
+        if len(self.backlog) == BACKLOG_SIZE:
+            log.warning('Backlog full, dropping {}.', self.backlog.popleft().message)
+        self.backlog.append(envelope)
+
+    def _fail(self, error: Exception) -> None:
+        if self._error is not None:
+            return
+        if not isinstance(error, DispatcherException):
+            cause, error = error, DispatcherException('Connection lost.')
+            error.__cause__ = cause
+        self._error = error
+        futures = list(self.requests.values())
+        for waiters in self.waiters.values():
+            futures.extend(future for _, future in waiters)
+        for future in futures:
+            if not future.done():
+                future.set_exception(error)
+        self.requests.clear()
+        self.waiters.clear()
+        for subscriptions in self.subscriptions.values():
+            for subscription in subscriptions:
+                subscription.queue.put_nowait(None)
+        self.subscriptions.clear()
+
+    def _check(self) -> None:
+        if self._error is not None:
+            raise DispatcherException('Dispatcher no longer running.') from self._error
@@ -0,0 +1,89 @@
+"""
+Lazily decoded messages, for the paths only routing or relaying them
+
+A LazyMessage knows the class of the message it holds as soon as it is built, but
+deserializes each member only when first accessed. With BinaryCodec, members are not
+even decoded from bytes until then (see BinaryCodec.decode_lazy). The encoded message
+is kept: clients with the same codec and schema send it as it is, without encoding it
+again (see Client.send).
+"""
+from typing import Type
+
+from bogascore.communication.message import Message, Priority
+from bogascore.serialization.codec import Codec, LazyDict
+from bogascore.serialization.schema import Schema, RECORD_TAG
+from bogascore.serialization.serialization import SerializationException, resolve_class_name, \
+    deserialization_dispatch_table
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+
+class LazyMessage(object):
+    """
+    View of an encoded message, deserializing its members when first accessed.
+
+    Members are read as attributes, as with the message itself, which materialize()
+    builds. Classes deserializing by hand are materialized on first access.
+    """
+
+    def __init__(self, data: bytes, codec: Type[Codec], schema: Schema = None) -> None:
+        self.data = data
+        self.codec = codec
+        self.schema = schema
+        self._message = None
+        try:
+            fields = codec.decode_lazy(data)
+            if schema is not None and RECORD_TAG in fields:
+                self._record = True
+                self._fields = fields.view(RECORD_TAG) if isinstance(fields, LazyDict) else fields[RECORD_TAG]
+                self.msg_type = schema.classes[self._fields[0]]  # type: Type[Message]
+            else:
+                self._record = False
+                self._fields = fields
+                self.msg_type = resolve_class_name(fields['msg_type'])
+        except Exception as e:
+            raise SerializationException("Error during deserialization.") from e
+        self._members = {attr: (i, attr_type) for i, (attr, attr_type) in enumerate(self.msg_type.members)}
+        self._lazy = getattr(self.msg_type.deserialize, 'compilable', False)
+
+    @property
+    def priority(self) -> Priority:
+        return self.msg_type.priority
+
+    def __getattr__(self, name: str):
+        # Only called for the attributes not set yet: members not accessed before
+        if name.startswith('_') or name not in self._members:
+            raise AttributeError("'{}' has no member '{}'.".format(self.msg_type.__name__, name))
+        if not self._lazy:
+            return getattr(self.materialize(), name)
+        i, attr_type = self._members[name]
+        try:
+            if self._record:
+                value = self.schema.member_decoders(self.msg_type)[i](self._fields[i + 1])
+            else:
+                value = deserialization_dispatch_table[attr_type](self._fields[name])
+        except Exception as e:
+            raise SerializationException("Error during deserialization.") from e
+        setattr(self, name, value)
+        return value
+
+    def materialize(self) -> Message:
+        """Return the message, deserializing it entirely."""
+        if self._message is None:
+            if self._record:
+                self._message = self.schema.decode_message({RECORD_TAG: self._fields})
+            else:
+                try:
+                    self._message = Message.parse_message(self._fields)
+                except KeyError as e:
+                    raise SerializationException('Unknown message type.') from e
+        return self._message
+
+    def __str__(self) -> str:
+        return 'Lazy{}'.format(self.msg_type.__name__)
@@ -1,5 +1,5 @@
 """Messages exchanged between client and server"""
-
+from enum import IntEnum
 from typing import Dict, TypeVar, Iterable
 from typing import Type
 
@@ -16,8 +16,16 @@ __status__ = "Pre-Alpha"
 S = TypeVar('S', bound='Message')
 
 
+class Priority(IntEnum):
+    """Lanes of the outbound queues: messages of higher priority (lower value) are sent first."""
+    HIGH = 0
+    LOW = 1
+
+
 class Message(Serializable):
 
+    priority = Priority.HIGH
+
     @staticmethod
     def parse_message(v: Dict[str, Primitive]) -> S:
         t_name = v['msg_type']
@@ -51,6 +59,8 @@ class Message(Serializable):
 
 class InfoMessage(Message):
 
+    priority = Priority.LOW
+
     members = Message.members + (
         ('text', str),
     )
@@ -63,7 +73,7 @@ class InfoMessage(Message):
 class MultiMessage(Message):
 
     members = Message.members + (
-        ('messages', list),
+        ('messages', 'batch'),
     )
 
     def __init__(self, messages: list, msg_type: type = None):
@@ -93,3 +103,30 @@ class ChoiceResponseMessage(Message):
     def __init__(self, choice: str, msg_type: type = None):
         super(ChoiceResponseMessage, self).__init__(msg_type)
         self.choice = choice
+
+
+class ChannelMessage(Message):
+    """
+    Envelope of a message sent on a channel, or as a request or response (see dispatcher).
+
+    correlation ties a response to its request, and is 0 for other messages.
+    """
+
+    members = Message.members + (
+        ('channel', int),
+        ('correlation', int),
+        ('response', bool),
+        ('message', 'any')
+    )
+
+    def __init__(self, channel: int, correlation: int, message: Message, response: bool = False,
+                 msg_type: type = None):
+        super(ChannelMessage, self).__init__(msg_type)
+        self.channel = channel
+        self.correlation = correlation
+        self.message = message
+        self.response = response
+
+    @property
+    def priority(self) -> Priority:
+        return self.message.priority
@@ -0,0 +1,214 @@
+"""
+Bounded queues of outbound messages
+
+Every client can have an OutboundQueue, holding its encoded messages until they are
+written, one at a time, to its connection. Messages wait in the lane of their priority,
+higher priority lanes being emptied first, so that game modifications overtake chatter.
+
+When the queued bytes exceed the high watermark, the overflow policy of the queue is
+called: it can drop or merge queued messages, or close the queue, disconnecting the
+client. If the queue is still above the high watermark, whoever is sending waits until
+it gets back below the low one.
+"""
+from collections import deque
+from typing import Awaitable, Callable, List, Tuple
+
+from tornado.ioloop import IOLoop
+from tornado.locks import Event
+
+from bogascore.communication.message import Message, Priority
+from bogascore.log import get_logger
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+log = get_logger(__name__)
+
+HIGH_WATERMARK = 1024 * 1024
+
+
+class OutboundQueue(object):
+
+    def __init__(self,
+                 encode: Callable[[Message], bytes],
+                 write: Callable[[bytes], Awaitable[None]],
+                 high_watermark: int = HIGH_WATERMARK,
+                 low_watermark: int = None,
+                 policy: Callable[['OutboundQueue'], None] = None) -> None:
+        """
+        encode turns messages into bytes, which write sends. The low watermark defaults to a
+        quarter of the high one. policy is called on overflow, the default one only waits
+        for the queue to drain.
+        """
+        if low_watermark is None:
+            low_watermark = high_watermark // 4
+        if low_watermark > high_watermark:
+            raise ValueError('The low watermark cannot exceed the high one.')
+        self.encode = encode
+        self.write = write
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.policy = policy if policy is not None else wait
+        # Lists of [message, encoded message] entries, by priority
+        self.lanes = [deque() for _ in Priority]  # type: List[deque]
+        self.size = 0
+        self.error = None
+        self._not_empty = Event()
+        self._drained = Event()
+        self._drained.set()
+        self._empty = Event()
+        self._empty.set()
+        self._writing = False
+
+    def __len__(self) -> int:
+        return sum(len(lane) for lane in self.lanes)
+
+    @property
+    def closed(self) -> bool:
+        return self.error is not None
+
+    async def put(self, message: Message, priority: Priority = None, data: bytes = None) -> int:
+        """
+        Queue a message, waiting if the queue is full. Returns the size of the encoded message.
+
+        data is the message already encoded, if it was.
+        """
+        if self.closed:
+            raise self.error
+        if data is None:
+            data = self.encode(message)
+        self.lanes[message.priority if priority is None else priority].append([message, data])
+        self.size += len(data)
+        self._not_empty.set()
+        self._empty.clear()
+        if not self._writing:
+            self._writing = True
+            IOLoop.current().spawn_callback(self._write_loop)
+        if self.size > self.high_watermark:
+            log.debug('Outbound queue over the high watermark: {} bytes in {} messages.', self.size, len(self))
+            self.policy(self)
+            if self.closed:
+                raise self.error
+            if self.size > self.high_watermark:
+                self._drained.clear()
+                await self._drained.wait()
+                if self.closed:
+                    raise self.error
+        return len(data)
+
+    async def join(self) -> None:
+        """Wait until every queued message has been written."""
+        await self._empty.wait()
+        if self.closed:
+            raise self.error
+
+    def close(self, error: Exception = None) -> None:
+        """Discard the queued messages. Anyone sending later gets error."""
+        self.error = error if error is not None else OutboundQueueException('Outbound queue closed.')
+        for lane in self.lanes:
+            lane.clear()
+        self.size = 0
+        self._drained.set()
+        self._not_empty.set()
+        self._empty.set()
+
+    def drop(self, priority: Priority) -> int:
+        """Discard the messages queued with the given priority, returning how many they were."""
+        lane = self.lanes[priority]
+        dropped = len(lane)
+        self.size -= sum(len(data) for _, data in lane)
+        lane.clear()
+        self._update_drained()
+        return dropped
+
+    def replace(self, priority: Priority, entries: List[Tuple[Message, bytes]]) -> None:
+        """Replace the messages queued with the given priority, with their encodings."""
+        lane = self.lanes[priority]
+        self.size -= sum(len(data) for _, data in lane)
+        lane.clear()
+        lane.extend([message, data] for message, data in entries)
+        self.size += sum(len(data) for _, data in lane)
+        self._update_drained()
+
+    def _update_drained(self) -> None:
+        if self.size <= self.low_watermark:
+            self._drained.set()
+
+    async def _write_loop(self) -> None:
+        while not self.closed:
+            for lane in self.lanes:
+                if lane:
+                    _, data = lane.popleft()
+                    break
+            else:
+                self._empty.set()
+                self._not_empty.clear()
+                await self._not_empty.wait()
+                continue
+            self.size -= len(data)
+            self._update_drained()
+            try:
+                await self.write(data)
+            except Exception as e:
+                log.debug('Outbound queue write failed: {}.', e)
+                self.close(OutboundQueueException('Write failed.'))
+                self.error.__cause__ = e
+        self._writing = False
+
+
+def wait(queue: OutboundQueue) -> None:
+    """Overflow policy making senders wait for the queue to drain."""
+    pass
+
+
+def drop_low_priority(queue: OutboundQueue) -> None:
+    """Overflow policy discarding the queued messages of low priority."""
+    dropped = queue.drop(Priority.LOW)
+    log.debug('Dropped {} low priority messages.', dropped)
+
+
+def merge(queue: OutboundQueue) -> None:
+    """
+    Overflow policy merging queued messages superseding each other.
+
+    Messages with a merge_key method are merged, through their merged method, with the
+    previous queued message with the same key (e.g. changes of the same element). Only
+    mergeable messages queued one after the other are merged, as other messages in between
+    could depend on the intermediate state.
+    """
+    for priority in Priority:
+        merged = []
+        run = {}  # merge key -> index in merged
+        changed = False
+        for message, data in queue.lanes[priority]:
+            merge_key = getattr(message, 'merge_key', None)
+            if merge_key is None:
+                run.clear()
+                merged.append((message, data))
+                continue
+            key = merge_key()
+            previous = run.get(key)
+            if previous is None:
+                run[key] = len(merged)
+                merged.append((message, data))
+                continue
+            merged[previous] = (merged[previous][0].merged(message), None)
+            changed = True
+        if changed:
+            queue.replace(priority, [
+                (message, data if data is not None else queue.encode(message)) for message, data in merged
+            ])
+
+
+def disconnect(queue: OutboundQueue) -> None:
+    """Overflow policy closing the queue, so that the client gets disconnected."""
+    queue.close(OutboundQueueException('Client not keeping up: {} bytes queued.'.format(queue.size)))
+
+
+class OutboundQueueException(Exception):
+    pass
@@ -1,5 +1,6 @@
 """Package containing Element base classes"""
-from typing import Tuple
+from enum import IntEnum
+from typing import Optional, Tuple
 
 from bogascore.serialization.serialization import Serializable
 
@@ -12,15 +13,63 @@ __maintainer__ = "Marco Capitani"
 __status__ = "Pre-Alpha"
 
 
+_EMPTY_TYPES = frozenset((str, bytes, int, float, bool, list, tuple, dict))
+
+
+class Visibility(IntEnum):
+    """Who, besides its owner, can see a hidden member of an element."""
+    OWNER = 0
+    TEAM = 1
+
+
 class Element(Serializable):
 
     members = Serializable.members + (
         ('identifier', str),
     )
 
+    # (member, Visibility) couples, for the members not everyone can see
+    hidden_members = ()
+
+    # Whether changes can be applied in place (see Serializable.patch), rather than by
+    # rebuilding the element: only for classes with no state derived from their members
+    # in __init__, e.g. Die
+    patchable = False
+
     def __init__(self, identifier):
         self.identifier = identifier
 
+    def owner_id(self) -> Optional[str]:
+        """Identifier of the player owning the element, by default its owner member, if any."""
+        return getattr(self, 'owner', None)
+
+    @classmethod
+    def hidden_from(cls, viewer: 'Viewer', owner: Optional[str], owner_team: Optional[str]) -> Tuple[str, ...]:
+        """The hidden members viewer cannot see, in an element owned by owner, in owner_team."""
+        if not cls.hidden_members or (viewer.player is not None and viewer.player == owner):
+            return ()
+        same_team = viewer.team is not None and viewer.team == owner_team
+        return tuple(attr for attr, visibility in cls.hidden_members
+                     if not (same_team and visibility is Visibility.TEAM))
+
+    @classmethod
+    def redacted_value(cls, attr: str):
+        """Value standing for a hidden member: the empty value of its type, or None."""
+        attr_type = dict(cls.members)[attr]
+        if attr_type == 'batch':
+            return []
+        return attr_type() if attr_type in _EMPTY_TYPES else None
+
+    def redacted(self, hidden: Tuple[str, ...]) -> 'Element':
+        """
+        A copy of the element, with the hidden members redacted (see redacted_value).
+
+        Copied rather than built anew, as subclasses may have constructors of their own.
+        """
+        redacted = self.copy()
+        redacted.patch([(attr, self.redacted_value(attr)) for attr in hidden])
+        return redacted
+
 
 class NumberResult(Element):
 
@@ -49,6 +98,8 @@ class StrPlayerChoice(Element):
         ('choice', str),
     )
 
+    patchable = True
+
     def __init__(self, identifier: str, choice: str):
         super(StrPlayerChoice, self).__init__(identifier)
         self.choice = choice
@@ -17,10 +17,13 @@ __status__ = "Pre-Alpha"
 
 class Die(Element):
 
-    __slots__ = [
-        'faces',
-        'number'
-    ]
+    members = Element.members + (
+        ('faces', int),
+        ('number', int)
+    )
+
+    # Patched numbers are kept, not rolled again
+    patchable = True
 
     def __init__(self, identifier: str, faces: int, number: int = -1):
         super(Die, self).__init__(identifier)
@@ -1,14 +1,17 @@
 """Contains the Environment class and related classes"""
 
+import asyncio
 from abc import abstractmethod
 from collections import deque
+from copy import copy
 from enum import Enum
-from typing import Callable, Set, Iterable, List
+from typing import Any, Callable, Dict, Hashable, Iterable, List, NamedTuple, Optional, Set, Tuple, Union
 
-from bogascore.communication.client import Client
+from bogascore.communication.client import Client, broadcast
 from bogascore.communication.message import Message
 from bogascore.elements import Element
 from bogascore.log import get_logger
+from bogascore.persistent import EMPTY, PMap
 
 __author__ = "Marco Capitani"
 __copyright__ = "Copyright 2017, Marco Capitani"
@@ -24,66 +27,316 @@ logger = get_logger(__name__)
 
 class Player(Element):
 
-    def __init__(self, name: str):
-        super(Player, self).__init__(name)
+    private_members = (
+        'is_winner',
+        'is_loser'
+    )
+
+    patchable = True
+
+    def __init__(self, identifier: str):
+        super(Player, self).__init__(identifier)
         self.is_winner = False
         self.is_loser = False
 
+    def owner_id(self) -> Optional[str]:
+        return self.identifier
+
 
 class HookTriggers(Enum):
     PRE_ACCEPT = 1
     POST_ACCEPT = 2
 
 
+# Names of the Element classes of each class, itself included, see EnvironmentElements
+_class_names = {}  # type: Dict[type, Tuple[str, ...]]
+
+_MISSING = object()
+
+
+def _element_class_names(cls: type) -> Tuple[str, ...]:
+    names = _class_names.get(cls)
+    if names is None:
+        names = _class_names[cls] = tuple(k.__name__ for k in cls.__mro__ if issubclass(k, Element))
+    return names
+
+
+def _nested_set(outer: PMap, key: Hashable, identifier: str, element: Element) -> PMap:
+    return outer.set(key, outer.get(key, EMPTY).set(identifier, element))
+
+
+def _nested_delete(outer: PMap, key: Hashable, identifier: str) -> PMap:
+    inner = outer[key].delete(identifier)
+    return outer.set(key, inner) if inner else outer.delete(key)
+
+
 class EnvironmentElements(object):
+    """
+    Elements of an environment, by identifier, indexed by class and by the chosen members.
+
+    Elements are found among the instances of a class and of its subclasses, and among
+    the elements with given values of the indexed members (see add_index and find), in
+    time proportional to the elements found. Indexes are kept up to date as elements
+    are added, replaced and removed: elements changed in place must be added again.
+
+    Elements and indexes are kept in persistent maps (see persistent), so that forks
+    (see fork) share them, taking O(log n) time to add or remove an element. Elements
+    are changed in place only by the environment owning them, others change copies.
+    """
 
-    def __init__(self) -> None:
-        self._dict = {}
-        self._class_dict = {}
+    def __init__(self, indexes: Iterable[str] = (), copy_on_write: bool = False) -> None:
+        """With copy_on_write, patch always changes copies of the elements, leaving them as they were."""
+        self.copy_on_write = copy_on_write
+        self._dict = EMPTY  # type: PMap
+        # Class name -> identifier -> element
+        self._class_dict = EMPTY  # type: PMap
+        # Member -> value -> identifier -> element
+        self._indexes = {}  # type: Dict[str, PMap]
+        # Values of the indexed members when each element was indexed
+        self._indexed_values = EMPTY  # type: PMap
+        # Identifiers of the elements only this environment holds, which can be changed in place
+        self._owned = set()  # type: Set[str]
+        for member in indexes:
+            self.add_index(member)
 
     def __getitem__(self, item: str) -> Element:
         return self._dict[item]
 
-    def get(self, item: str, default: Element) -> Element:
-        return self._dict.get(item, default)
+    def __contains__(self, item: str) -> bool:
+        return item in self._dict
 
-    def add(self, element: Element) -> None:
-        self._dict[element.identifier] = element
-        class_name = element.__class__.__name__
-        self._class_dict.setdefault(class_name, set()).add(element)
+    def __len__(self) -> int:
+        return len(self._dict)
 
-    def get_by_class(self, class_name: str) -> Set[Element]:
-        return self._class_dict.get(class_name, set())
+    def get(self, item: str, default: Element) -> Element:
+        return self._dict.get(item, default)
 
-    def remove(self, element_id: str):
-        del self._dict[element_id]
+    def add(self, element: Element, owned: bool = True) -> None:
+        """
+        Add an element, replacing the one with the same identifier, if any.
+
+        Elements held elsewhere too, e.g. by a modification applied to many environments,
+        should not be owned, and are copied before being changed.
+        """
+        identifier = element.identifier
+        old_element = self._dict.get(identifier)
+        # Only the maps of what changed are updated, e.g. for elements changed in place
+        if old_element is not element:
+            self._dict = self._dict.set(identifier, element)
+            class_names = _element_class_names(type(element))
+            if old_element is not None:
+                for class_name in _element_class_names(type(old_element)):
+                    if class_name not in class_names:
+                        self._class_dict = _nested_delete(self._class_dict, class_name, identifier)
+            for class_name in class_names:
+                self._class_dict = _nested_set(self._class_dict, class_name, identifier, element)
+        if self._indexes:
+            values = tuple(getattr(element, member, _MISSING) for member in self._indexes)
+            old_values = self._indexed_values.get(identifier) or (_MISSING,) * len(values)
+            for (member, index), value, old_value in zip(self._indexes.items(), values, old_values):
+                if old_value != value:
+                    if old_value is not _MISSING:
+                        index = _nested_delete(index, old_value, identifier)
+                elif old_element is element:
+                    continue
+                if value is not _MISSING:
+                    index = _nested_set(index, value, identifier, element)
+                self._indexes[member] = index
+            if values != old_values:
+                self._indexed_values = self._indexed_values.set(identifier, values)
+        if owned:
+            self._owned.add(identifier)
+        else:
+            self._owned.discard(identifier)
+
+    def writable(self, element_id: str) -> Element:
+        """
+        The element, if owned, or else a copy replacing it: either can be changed in place.
+
+        Frozen elements are always copied, as they may be held, hashed, anywhere.
+        """
+        element = self._dict[element_id]
+        if self.copy_on_write or element.frozen or element_id not in self._owned:
+            element = element.copy()
+            self.add(element)
+        return element
+
+    def patch(self, element_id: str, changes: List[Tuple[str, Any]]) -> Element:
+        """Change members of an element in place (see Serializable.patch), returning the element."""
+        element = self.writable(element_id)
+        element.patch(changes)
+        if self._indexes and any(attr in self._indexes for attr, _ in changes):
+            self.add(element)
+        return element
+
+    def remove(self, element_id: str) -> None:
+        element = self._dict[element_id]
+        self._dict = self._dict.delete(element_id)
+        self._unindex(element)
+        self._owned.discard(element_id)
+
+    def _unindex(self, element: Element) -> None:
+        identifier = element.identifier
+        for class_name in _element_class_names(type(element)):
+            self._class_dict = _nested_delete(self._class_dict, class_name, identifier)
+        values = self._indexed_values.get(identifier)
+        if values is not None:
+            self._indexed_values = self._indexed_values.delete(identifier)
+            for (member, index), value in zip(self._indexes.items(), values):
+                if value is not _MISSING:
+                    self._indexes[member] = _nested_delete(index, value, identifier)
+
+    def add_index(self, member: str) -> None:
+        """Index the elements by the value of a member, which must be hashable."""
+        if member in self._indexes:
+            return
+        index = EMPTY
+        indexed_values = self._indexed_values
+        for identifier, element in self._dict.items():
+            value = getattr(element, member, _MISSING)
+            if value is not _MISSING:
+                index = _nested_set(index, value, identifier, element)
+            indexed_values = indexed_values.set(identifier, indexed_values.get(identifier, ()) + (value,))
+        self._indexes[member] = index
+        self._indexed_values = indexed_values
+
+    def fork(self) -> 'EnvironmentElements':
+        """
+        A copy, sharing elements and indexes, made in time independent of their number.
+
+        The elements are no longer owned by either copy, each changing copies of them
+        from then on (see writable).
+        """
+        fork = copy(self)
+        fork._indexes = dict(self._indexes)
+        fork._owned = set()
+        self._owned = set()
+        return fork
+
+    def get_by_class(self, cls: Union[str, type]) -> List[Element]:
+        """The instances of a class, by name or class, and of its subclasses."""
+        return list(self._class_dict.get(cls if isinstance(cls, str) else cls.__name__, EMPTY).values())
+
+    def find(self, cls: Union[str, type] = None, **values) -> List[Element]:
+        """
+        The elements with the given member values, instances of cls if given.
+
+        The candidates are taken from the smallest among the class index and the indexes
+        of the members, and filtered by the other criteria: with no index, all the
+        elements are scanned.
+        """
+        candidates = None
+        if cls is not None:
+            candidates = self._class_dict.get(cls if isinstance(cls, str) else cls.__name__, EMPTY)
+        for member, value in values.items():
+            index = self._indexes.get(member)
+            if index is not None:
+                elements = index.get(value, EMPTY)
+                if candidates is None or len(elements) < len(candidates):
+                    candidates = elements
+        if candidates is None:
+            candidates = self._dict
+        class_name = cls if isinstance(cls, str) or cls is None else cls.__name__
+        return [
+            element for element in candidates.values()
+            if (class_name is None or class_name in _element_class_names(type(element))) and
+            all(getattr(element, member, _MISSING) == value for member, value in values.items())
+        ]
+
+
+class Viewer(NamedTuple):
+    """Who a client plays as, None for spectators."""
+    player: Optional[str]
+    team: Optional[str]
+
+
+SPECTATOR = Viewer(None, None)
 
 
 class Environment(object):
+    """
+    Elements of a game, which modifications are applied to and sent to the clients.
+
+    Clients see the hidden members of elements (see Element.hidden_members) according
+    to the player they are seated as, if any (see seat), others being spectators. Each
+    modification is projected once for every group of clients seeing the same members
+    (see EnvModification.view_key).
+    """
 
-    def __init__(self, post_game_hook: Callable[['Environment'], None], clients: List[Client]):
-        self.elements = EnvironmentElements()
+    def __init__(self, post_game_hook: Callable[['Environment'], None], clients: List[Client],
+                 indexes: Iterable[str] = (), copy_on_write: bool = False):
+        """
+        indexes are the members the elements are indexed by, and copy_on_write whether changes
+        leave the elements as they were, for whoever keeps them: see EnvironmentElements.
+        """
+        self.elements = EnvironmentElements(indexes, copy_on_write)
         self.hooks = {
             HookTriggers.POST_ACCEPT: deque([GameOverHook(self, post_game_hook)]),
             HookTriggers.PRE_ACCEPT: deque()
         }
         self.clients = clients
+        self.viewers = {}  # type: Dict[Client, Viewer]
+        # Teams of the players, by player identifier
+        self.teams = {}  # type: Dict[str, str]
+        # Sending of the last modification accepted, which the next one waits for
+        self._sending = None  # type: Optional[asyncio.Future]
 
-    def get_players(self):
-        return self.elements.get_by_class(Player.__name__)
+    def seat(self, client: Client, player: 'Player', team: str = None) -> None:
+        """Make client play as player, in team if any."""
+        self.viewers[client] = Viewer(player.identifier, team)
+        self.teams[player.identifier] = team
+
+    def viewer(self, client: Client) -> Viewer:
+        return self.viewers.get(client, SPECTATOR)
+
+    def get_players(self) -> Set['Player']:
+        return set(self.elements.get_by_class(Player.__name__))
 
     def make_player(self, player: Player):
         self.elements.add(player)
 
-    def accept(self, modification: 'EnvModification'):
-        logger.debug("Accepting modification %s.", modification)
+    def accept(self, modification: 'EnvModification') -> 'Optional[asyncio.Future[List[Tuple[Client, Exception]]]]':
+        """
+        Apply a modification and send it to the clients.
+
+        Returns a future of the clients the modification could not be sent to, with the
+        errors (see broadcast), which are logged anyway. With no clients, e.g. in forks,
+        returns None, needing no event loop. Modifications are sent in the order they
+        are accepted.
+        """
+        logger.debug("Accepting modification {}.", modification)
         for hook in self.hooks.get(HookTriggers.PRE_ACCEPT, []):
             modification = hook(modification)
         modification.apply(self)
-        for client in self.clients:
-            client.send(modification)
+        sent = None
+        if self.clients:
+            # Projected right away, against the state the modification left, which later
+            # modifications may change before it is sent
+            sent = asyncio.ensure_future(self._send(self._projections(modification), self._sending))
+            sent.add_done_callback(_log_failures)
+            self._sending = sent
         for hook in self.hooks.get(HookTriggers.POST_ACCEPT, []):
             hook(modification)
+        return sent
+
+    def _projections(self, modification: 'EnvModification') -> 'List[Tuple[List[Client], EnvModification]]':
+        """The projections of an applied modification, with the clients to send each to."""
+        groups = {}
+        for client in self.clients:
+            groups.setdefault(modification.view_key(self, self.viewer(client)), []).append(client)
+        return [(clients, modification.project(key)) for key, clients in groups.items()]
+
+    @staticmethod
+    async def _send(projections: 'List[Tuple[List[Client], EnvModification]]',
+                    previous: 'Optional[asyncio.Future]') -> List[Tuple[Client, Exception]]:
+        if previous is not None and not previous.done():
+            # Failed or not, the previous modification goes first
+            await asyncio.wait((previous,))
+        if len(projections) == 1:
+            clients, projection = projections[0]
+            return await broadcast(clients, projection)
+        results = await asyncio.gather(*(broadcast(clients, projection) for clients, projection in projections))
+        return [failure for failures in results for failure in failures]
 
     def add_pre_hook(self, hook: Callable[['EnvModification'], 'EnvModification']):
         self._add_hook(HookTriggers.PRE_ACCEPT, hook)
@@ -102,8 +355,63 @@ class Environment(object):
                 raise e
 
     def fetch_client_for_player(self, player: Player) -> Client:
-        # TODO
-        pass
+        for client, viewer in self.viewers.items():
+            if viewer.player == player.identifier:
+                return client
+        raise KeyError(player.identifier)
+
+    def fork(self, clients: bool = False, hooks: bool = False) -> 'Environment':
+        """
+        A copy of the environment, sharing its elements until either changes them (see
+        EnvironmentElements.fork), e.g. to try modifications out.
+
+        The copy sends modifications to no client and calls no hook, unless clients and
+        hooks are set: hooks keep referring to the environment they were added for.
+        """
+        fork = copy(self)
+        for name, value in vars(fork).items():
+            if isinstance(value, (set, list, dict)):
+                setattr(fork, name, copy(value))
+        fork.elements = self.elements.fork()
+        if not clients:
+            fork.clients = []
+            fork.viewers = {}
+        fork.hooks = {trigger: deque(trigger_hooks if hooks else ()) for trigger, trigger_hooks in self.hooks.items()}
+        return fork
+
+    def snapshot(self) -> 'Environment':
+        """The state of the environment, to restore later (see restore)."""
+        return self.fork()
+
+    def restore(self, snapshot: 'Environment') -> None:
+        """
+        Go back to a snapshot, which can be restored again.
+
+        Clients, their seats and hooks are kept as they are, as well as the modifications
+        being sent to the clients.
+        """
+        restored = snapshot.fork()
+        restored.clients, restored.viewers, restored.teams, restored.hooks, restored._sending = \
+            self.clients, self.viewers, self.teams, self.hooks, self._sending
+        vars(self).clear()
+        vars(self).update(vars(restored))
+
+    def hidden_from(self, viewer: Viewer, element: Element) -> Tuple[str, ...]:
+        """The hidden members of element viewer cannot see."""
+        if not element.hidden_members:
+            return ()
+        owner = element.owner_id()
+        return element.hidden_from(viewer, owner, self.teams.get(owner))
+
+
+def _log_failures(sent: 'asyncio.Future[List[Tuple[Client, Exception]]]') -> None:
+    if sent.cancelled():
+        return
+    if sent.exception() is not None:
+        logger.error("Could not send modification: {}.", sent.exception())
+        return
+    for client, error in sent.result():
+        logger.warning("Could not send modification to client '{}': {}.", client.username, error)
 
 
 class EnvModification(Message):
@@ -114,11 +422,24 @@ class EnvModification(Message):
     def apply(self, env: Environment) -> None:
         pass
 
+    def view_key(self, env: Environment, viewer: Viewer) -> Hashable:
+        """
+        Key of the projection of this (already applied) modification viewer can see.
+
+        Viewers with the same key are sent the same projection, see project. None, the
+        default, stands for the modification itself.
+        """
+        return None
+
+    def project(self, key: Hashable) -> 'EnvModification':
+        """The modification as seen by the viewers with the given view_key."""
+        return self
+
 
 class MultipleModification(EnvModification):
 
     members = EnvModification.members + (
-        ('modifications', list),
+        ('modifications', 'batch'),
     )
 
     def __init__(self, modifications: List[EnvModification], msg_type: type = None):
@@ -127,7 +448,16 @@ class MultipleModification(EnvModification):
 
     def apply(self, env: Environment) -> None:
         for mod in self.modifications:
-            mod.apply()
+            mod.apply(env)
+
+    def view_key(self, env: Environment, viewer: Viewer) -> Hashable:
+        keys = tuple(mod.view_key(env, viewer) for mod in self.modifications)
+        return keys if any(key is not None for key in keys) else None
+
+    def project(self, key: Hashable) -> EnvModification:
+        if key is None:
+            return self
+        return MultipleModification([mod.project(k) for mod, k in zip(self.modifications, key)])
 
 
 class NullModification(EnvModification):
@@ -154,7 +484,7 @@ class NewElementModification(EnvModification):
     )
 
     private_members = (
-        'element'
+        'element',
     )
 
     def __init__(self, element_class: type, args: Iterable, msg_type: type = None):
@@ -164,13 +494,32 @@ class NewElementModification(EnvModification):
         self.element = element_class(**dict(args))
 
     def apply(self, env: Environment) -> None:
-        env.elements.add(self.element)
+        old_element = env.elements.get(self.element.identifier, None)
+        if old_element is not None:
+            self.element.stamp_version(old_element)
+        # Held by the modification too
+        env.elements.add(self.element, owned=False)
+
+    def view_key(self, env: Environment, viewer: Viewer) -> Hashable:
+        return env.hidden_from(viewer, self.element) or None
+
+    def project(self, key: Hashable) -> EnvModification:
+        if key is None:
+            return self
+        # Copied, as subclasses may have constructors of their own
+        projected = self.copy()
+        projected.args = [(k, self.element_class.redacted_value(k) if k in key else v) for k, v in self.args]
+        projected.element = self.element.redacted(key)
+        return projected
 
 
 class ChangeElementModification(EnvModification):
     """
     The args field should be a list of couples (field_name, new value)
     containing a field if and only if this envMod changes it.
+
+    Only the changed fields are patched into the element (see EnvironmentElements.patch),
+    unless the element is not patchable, or of another class, and is rebuilt.
     """
 
     members = EnvModification.members + (
@@ -185,15 +534,42 @@ class ChangeElementModification(EnvModification):
         self.element_id = element_id
         self.args = args
 
+    def merge_key(self) -> tuple:
+        """Changes with the same key can be merged, see merged."""
+        return type(self), self.element_class, self.element_id
+
+    def merged(self, later: 'ChangeElementModification') -> 'ChangeElementModification':
+        """A change equivalent to this one followed by later."""
+        args = dict(self.args)
+        args.update(later.args)
+        merged = self.copy()
+        merged.args = list(args.items())
+        return merged
+
     def apply(self, env: Environment) -> None:
         old_element = env.elements[self.element_id]
+        if type(old_element) is self.element_class and self.element_class.patchable:
+            env.elements.patch(self.element_id, self.args)
+            return
         d = {}
         for k, _ in type(old_element).members:
             d[k] = getattr(old_element, k)
         d.update(self.args)
         new_element = self.element_class(**d)
+        new_element.stamp_version(old_element)
         env.elements.add(new_element)
 
+    def view_key(self, env: Environment, viewer: Viewer) -> Hashable:
+        hidden = env.hidden_from(viewer, env.elements[self.element_id])
+        return tuple(k for k, _ in self.args if k in hidden) or None
+
+    def project(self, key: Hashable) -> EnvModification:
+        if key is None:
+            return self
+        projected = self.copy()
+        projected.args = [(k, self.element_class.redacted_value(k) if k in key else v) for k, v in self.args]
+        return projected
+
 
 class RemoveElementModification(EnvModification):
 
@@ -208,10 +584,20 @@ class RemoveElementModification(EnvModification):
     def apply(self, env: Environment) -> None:
         env.elements.remove(self.element.identifier)
 
+    def view_key(self, env: Environment, viewer: Viewer) -> Hashable:
+        return env.hidden_from(viewer, self.element) or None
+
+    def project(self, key: Hashable) -> EnvModification:
+        if key is None:
+            return self
+        projected = self.copy()
+        projected.element = self.element.redacted(key)
+        return projected
+
 
 class GameOverModification(EnvModification):
 
-    members = ()
+    members = EnvModification.members
 
     def apply(self, env: Environment) -> None:
         return
@@ -228,9 +614,7 @@ class PlayerWinsModification(GameOverModification):
         self.player = player
 
     def apply(self, env: Environment) -> None:
-        for p in self.player:
-            p.is_winner = True
-        env.winning_player = self.player
+        env.winning_player = _flagged(env, self.player, 'is_winner')
 
 
 class PlayerLosesModification(EnvModification):
@@ -244,11 +628,22 @@ class PlayerLosesModification(EnvModification):
         self.player = player
 
     def apply(self, env: Environment) -> None:
-        for p in self.player:
-            p.is_loser = True
-        if getattr(env, 'losing_players', None) is None:
-            env.losing_players = set()
-        env.losing_players += self.player
+        env.losing_players = getattr(env, 'losing_players', []) + _flagged(env, self.player, 'is_loser')
+
+
+def _flagged(env: Environment, players: List[Player], flag: str) -> List[Player]:
+    """
+    The players as env holds them, with flag set.
+
+    Players are changed through env.elements (see writable), as forks share them, and
+    copied if env does not hold them.
+    """
+    flagged = []
+    for p in players:
+        player = env.elements.writable(p.identifier) if p.identifier in env.elements else p.copy()
+        setattr(player, flag, True)
+        flagged.append(player)
+    return flagged
 
 
 # noinspection PyUnusedLocal
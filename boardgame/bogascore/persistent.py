@@ -0,0 +1,247 @@
+"""
+Persistent maps, sharing their structure with the maps they are made from
+
+A PMap is never changed: set and delete return new maps, sharing all but O(log n) of
+their nodes with the original, which stays as it was. Copies are then free, as needed
+by forks and snapshots of environments (see Environment.fork).
+
+PMaps are hash array mapped tries: each node branches on 5 bits of the hash of the keys,
+holding its children in a tuple as long as the number of children, indexed through a
+32 bit bitmap. Keys with the same 64 bit hash share a collision node.
+"""
+from collections.abc import Mapping
+from typing import Any, Hashable, Iterable, Iterator, Tuple
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+_BITS = 5
+_MASK = (1 << _BITS) - 1
+_HASH_MASK = (1 << 64) - 1
+
+_MISSING = object()
+
+
+def _hash(key: Hashable) -> int:
+    return hash(key) & _HASH_MASK
+
+
+try:
+    _popcount = int.bit_count
+except AttributeError:  # Before Python 3.10
+    def _popcount(n: int) -> int:
+        return bin(n).count('1')
+
+
+class _Bitmap(object):
+    """Node whose entries are (key, value) leaves or child nodes, by 5 bits of hash."""
+
+    __slots__ = ('bitmap', 'entries')
+
+    def __init__(self, bitmap: int, entries: tuple) -> None:
+        self.bitmap = bitmap
+        self.entries = entries
+
+    def get(self, h: int, shift: int, key: Hashable, default):
+        bit = 1 << ((h >> shift) & _MASK)
+        if not self.bitmap & bit:
+            return default
+        entry = self.entries[_popcount(self.bitmap & (bit - 1))]
+        if type(entry) is tuple:
+            k = entry[0]
+            return entry[1] if k is key or k == key else default
+        return entry.get(h, shift + _BITS, key, default)
+
+    def assoc(self, h: int, shift: int, key: Hashable, value) -> Tuple['_Bitmap', bool]:
+        """Return the node with key set to value, and whether key was added."""
+        bit = 1 << ((h >> shift) & _MASK)
+        i = _popcount(self.bitmap & (bit - 1))
+        entries = self.entries
+        if not self.bitmap & bit:
+            return _Bitmap(self.bitmap | bit, entries[:i] + ((key, value),) + entries[i:]), True
+        entry = entries[i]
+        if type(entry) is tuple:
+            k, v = entry
+            if k is key or k == key:
+                if v is value:
+                    return self, False
+                new_entry, added = (key, value), False
+            else:
+                new_entry, added = _pair(_hash(k), k, v, h, key, value, shift + _BITS), True
+        else:
+            new_entry, added = entry.assoc(h, shift + _BITS, key, value)
+            if new_entry is entry:
+                return self, False
+        return _Bitmap(self.bitmap, entries[:i] + (new_entry,) + entries[i + 1:]), added
+
+    def dissoc(self, h: int, shift: int, key: Hashable):
+        """Return the node without key, None if left empty, or self if key is missing."""
+        bit = 1 << ((h >> shift) & _MASK)
+        if not self.bitmap & bit:
+            return self
+        i = _popcount(self.bitmap & (bit - 1))
+        entries = self.entries
+        entry = entries[i]
+        if type(entry) is tuple:
+            k = entry[0]
+            if not (k is key or k == key):
+                return self
+            new_entry = None
+        else:
+            new_entry = entry.dissoc(h, shift + _BITS, key)
+            if new_entry is entry:
+                return self
+            if new_entry is not None:
+                new_entry = _inlined(new_entry)
+        if new_entry is None:
+            if len(entries) == 1:
+                return None
+            return _Bitmap(self.bitmap & ~bit, entries[:i] + entries[i + 1:])
+        return _Bitmap(self.bitmap, entries[:i] + (new_entry,) + entries[i + 1:])
+
+    def items(self) -> Iterator[Tuple[Hashable, Any]]:
+        for entry in self.entries:
+            if type(entry) is tuple:
+                yield entry
+            else:
+                yield from entry.items()
+
+
+class _Collision(object):
+    """Node of the keys with the same hash."""
+
+    __slots__ = ('hash', 'entries')
+
+    def __init__(self, h: int, entries: tuple) -> None:
+        self.hash = h
+        self.entries = entries
+
+    def get(self, h: int, shift: int, key: Hashable, default):
+        for k, v in self.entries:
+            if k is key or k == key:
+                return v
+        return default
+
+    def assoc(self, h: int, shift: int, key: Hashable, value) -> Tuple[Any, bool]:
+        if h != self.hash:
+            # Branch where the hashes differ
+            node = _Bitmap(1 << ((self.hash >> shift) & _MASK), (self,))
+            return node.assoc(h, shift, key, value)
+        for i, (k, v) in enumerate(self.entries):
+            if k is key or k == key:
+                if v is value:
+                    return self, False
+                return _Collision(h, self.entries[:i] + ((key, value),) + self.entries[i + 1:]), False
+        return _Collision(h, self.entries + ((key, value),)), True
+
+    def dissoc(self, h: int, shift: int, key: Hashable):
+        for i, (k, _) in enumerate(self.entries):
+            if k is key or k == key:
+                entries = self.entries[:i] + self.entries[i + 1:]
+                return _Collision(h, entries) if entries else None
+        return self
+
+    def items(self) -> Iterator[Tuple[Hashable, Any]]:
+        return iter(self.entries)
+
+
+def _pair(h1: int, k1: Hashable, v1, h2: int, k2: Hashable, v2, shift: int):
+    """Node holding two keys, branching as deep as their hashes are equal."""
+    if h1 == h2:
+        return _Collision(h1, ((k1, v1), (k2, v2)))
+    b1 = (h1 >> shift) & _MASK
+    b2 = (h2 >> shift) & _MASK
+    if b1 == b2:
+        return _Bitmap(1 << b1, (_pair(h1, k1, v1, h2, k2, v2, shift + _BITS),))
+    if b1 < b2:
+        return _Bitmap((1 << b1) | (1 << b2), ((k1, v1), (k2, v2)))
+    return _Bitmap((1 << b1) | (1 << b2), ((k2, v2), (k1, v1)))
+
+
+def _inlined(node):
+    """A node left with a single leaf is replaced by the leaf in its parent."""
+    if len(node.entries) == 1 and type(node.entries[0]) is tuple:
+        return node.entries[0]
+    return node
+
+
+_EMPTY_NODE = _Bitmap(0, ())
+
+
+class PMap(Mapping):
+    """
+    Persistent map: set and delete return updated maps, in O(log n) time and space.
+
+    items and values iterate without looking keys up again.
+    """
+
+    __slots__ = ('_root', '_size')
+
+    def __init__(self, items: Iterable[Tuple[Hashable, Any]] = ()) -> None:
+        self._root = _EMPTY_NODE
+        self._size = 0
+        for key, value in (items.items() if isinstance(items, Mapping) else items):
+            self._root, added = self._root.assoc(_hash(key), 0, key, value)
+            self._size += added
+
+    @classmethod
+    def _make(cls, root: _Bitmap, size: int) -> 'PMap':
+        new = cls.__new__(cls)
+        new._root = root
+        new._size = size
+        return new
+
+    def __getitem__(self, key: Hashable):
+        value = self._root.get(_hash(key), 0, key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key: Hashable, default=None):
+        return self._root.get(_hash(key), 0, key, default)
+
+    def __contains__(self, key) -> bool:
+        return self._root.get(_hash(key), 0, key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator[Hashable]:
+        for key, _ in self._root.items():
+            yield key
+
+    def items(self) -> Iterator[Tuple[Hashable, Any]]:
+        return self._root.items()
+
+    def values(self) -> Iterator[Any]:
+        for _, value in self._root.items():
+            yield value
+
+    def set(self, key: Hashable, value) -> 'PMap':
+        """The map with key set to value."""
+        root, added = self._root.assoc(_hash(key), 0, key, value)
+        if root is self._root:
+            return self
+        return PMap._make(root, self._size + added)
+
+    def delete(self, key: Hashable) -> 'PMap':
+        """
+        The map without key.
+
+        :raises KeyError: if key is missing.
+        """
+        root = self._root.dissoc(_hash(key), 0, key)
+        if root is self._root:
+            raise KeyError(key)
+        return PMap._make(root if root is not None else _EMPTY_NODE, self._size - 1)
+
+    def __repr__(self) -> str:
+        return 'PMap({})'.format(dict(self.items()))
+
+
+EMPTY = PMap()
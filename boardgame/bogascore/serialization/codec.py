@@ -1,8 +1,11 @@
 """Package containing codecs for (de)-serialization"""
 import json
 from abc import ABCMeta, abstractmethod
+from base64 import b64encode
+from collections.abc import Mapping, Sequence
 from enum import Enum
-from typing import Dict
+from struct import Struct
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
 from bogascore.serialization.serialization import Primitive
 
@@ -17,10 +20,13 @@ __status__ = "Pre-Alpha"
 
 class AvailableCodecs(Enum):
     JSON = 1
+    BINARY = 2
 
     def get_codec(self):
         if self == AvailableCodecs.JSON:
             return JsonCodec
+        elif self == AvailableCodecs.BINARY:
+            return BinaryCodec
         else:
             raise ValueError('Codec {} is not available.'.format(self.name))
 
@@ -37,6 +43,11 @@ class Codec(metaclass=ABCMeta):
     def decode(cls, data: bytes) -> Dict[str, Primitive]:
         pass
 
+    @classmethod
+    def decode_lazy(cls, data: bytes) -> Mapping:
+        """Decode data as decode does, possibly decoding the values only when accessed."""
+        return cls.decode(data)
+
     def __str__(self):
         return self.__class__.__name__
 
@@ -44,11 +55,45 @@ class Codec(metaclass=ABCMeta):
         return str(self)
 
 
+def estimate_size(v: Primitive) -> int:
+    """
+    Estimate the encoded size of serialized data without encoding it.
+
+    The estimate is the JSON size, or slightly more, which bounds the size with BinaryCodec too.
+    """
+    t = type(v)
+    if t is str:
+        if v.isascii():
+            return len(v) + 2
+        # JSON escapes each non ASCII character in 6 bytes, or 12
+        return len(v) + 5 * (len(v.encode()) - len(v)) + 2
+    if t is dict:
+        return 1 + sum(len(k) + 6 + estimate_size(x) for k, x in v.items())
+    if t is list or t is tuple or t is set:
+        return 1 + sum(estimate_size(x) + 2 for x in v)
+    if t is int:
+        return 2 + v.bit_length() // 3
+    if t is bytes:
+        return (len(v) + 2) // 3 * 4 + 2
+    if t is float:
+        return 24
+    return 5
+
+
+def _json_default(o):
+    if type(o) is bytes:
+        return b64encode(o).decode()
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(o).__name__))
+
+
 class JsonCodec(Codec):
+    """JSON codec. Bytes are sent base64 encoded."""
+
+    _encoder = json.JSONEncoder(default=_json_default)
 
     @classmethod
     def encode(cls, data_dict: Dict[str, Primitive]) -> bytes:
-        return json.dumps(data_dict).encode()
+        return cls._encoder.encode(data_dict).encode()
 
     @classmethod
     def decode(cls, data: bytes) -> Dict[str, Primitive]:
@@ -59,3 +104,384 @@ class JsonCodec(Codec):
 
     def __repr__(self):
         return str(self)
+
+
+# Tags of the values encoded by BinaryCodec. Small ints, and short strings, lists and dicts
+# have their value or length packed in the tag.
+_FIXINT = 0x00  # 0x00-0x7f: int 0-127
+_FIXSTR = 0x80  # 0x80-0x9f: str, 0-31 bytes
+_FIXLIST = 0xa0  # 0xa0-0xaf: list, 0-15 items
+_FIXDICT = 0xb0  # 0xb0-0xbf: dict, 0-15 items
+_NONE = 0xc0
+_FALSE = 0xc1
+_TRUE = 0xc2
+_INT = 0xc3  # zigzag varint
+_FLOAT = 0xc4  # IEEE 754 double
+_STR = 0xc5  # varint length, UTF-8
+_BYTES = 0xc6  # varint length
+_LIST = 0xc7  # varint number of items
+_DICT = 0xc8  # varint number of items
+
+_double = Struct('>d')
+
+# Encodings of the short strings seen so far (member and class names, identifiers...)
+_str_items = {}
+_STR_ITEMS_MAX = 4096
+
+
+def _write_varint(n: int, out: bytearray) -> None:
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    n = 0
+    shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+def _write_header(fix_tag: int, fix_max: int, tag: int, n: int, out: bytearray) -> None:
+    if n <= fix_max:
+        out.append(fix_tag | n)
+    else:
+        out.append(tag)
+        _write_varint(n, out)
+
+
+def _encode_value(v, out: bytearray) -> None:
+    t = type(v)
+    if t is str:
+        item = _str_items.get(v)
+        if item is None:
+            b = v.encode()
+            item = bytearray()
+            _write_header(_FIXSTR, 0x1f, _STR, len(b), item)
+            item = bytes(item + b)
+            if len(b) <= 0x1f:
+                if len(_str_items) >= _STR_ITEMS_MAX:
+                    _str_items.clear()
+                _str_items[v] = item
+        out += item
+    elif t is int:
+        if 0 <= v <= 0x7f:
+            out.append(v)
+        else:
+            out.append(_INT)
+            _write_varint(v << 1 if v >= 0 else (-v << 1) - 1, out)
+    elif t is dict:
+        _write_header(_FIXDICT, 0x0f, _DICT, len(v), out)
+        for k, x in v.items():
+            _encode_value(k, out)
+            _encode_value(x, out)
+    elif t is list or t is tuple or t is set:
+        _write_header(_FIXLIST, 0x0f, _LIST, len(v), out)
+        for x in v:
+            _encode_value(x, out)
+    elif v is None:
+        out.append(_NONE)
+    elif t is bool:
+        out.append(_TRUE if v else _FALSE)
+    elif t is float:
+        out.append(_FLOAT)
+        out += _double.pack(v)
+    elif t is bytes or t is bytearray:
+        out.append(_BYTES)
+        _write_varint(len(v), out)
+        out += v
+    # Subclasses of the primitive types (e.g. enums)
+    elif isinstance(v, bool):
+        _encode_value(bool(v), out)
+    elif isinstance(v, int):
+        _encode_value(int(v), out)
+    elif isinstance(v, str):
+        _encode_value(str(v), out)
+    elif isinstance(v, float):
+        _encode_value(float(v), out)
+    else:
+        raise TypeError('Object of type {} cannot be encoded by BinaryCodec'.format(t.__name__))
+
+
+# The hot decoding loops compare tags with literals, cheaper than global constants:
+# 0x80 is _FIXSTR, 0xa0 _FIXLIST, and the string of tag t ends at pos + t - 0x7f.
+
+def _decode_items(data: bytes, pos: int, n: int) -> Tuple[list, int]:
+    items = []
+    append = items.append
+    for _ in range(n):
+        # Small ints and short strings are decoded inline, sparing a call
+        tag = data[pos]
+        if tag < 0x80:
+            append(tag)
+            pos += 1
+        elif tag < 0xa0:
+            end = pos + tag - 0x7f
+            append(data[pos + 1:end].decode())
+            pos = end
+        else:
+            x, pos = _decoders[tag](data, pos + 1, tag)
+            append(x)
+    return items, pos
+
+
+def _decode_dict(data: bytes, pos: int, n: int) -> Tuple[dict, int]:
+    d = {}
+    for _ in range(n):
+        # Keys are almost always short strings, values often small ints or short strings
+        tag = data[pos]
+        if 0x80 <= tag < 0xa0:
+            end = pos + tag - 0x7f
+            k = data[pos + 1:end].decode()
+            pos = end
+        else:
+            k, pos = _decode_value(data, pos)
+        tag = data[pos]
+        if tag < 0x80:
+            d[k] = tag
+            pos += 1
+        elif tag < 0xa0:
+            end = pos + tag - 0x7f
+            d[k] = data[pos + 1:end].decode()
+            pos = end
+        else:
+            d[k], pos = _decoders[tag](data, pos + 1, tag)
+    return d, pos
+
+
+def _decode_value(data: bytes, pos: int) -> Tuple[Primitive, int]:
+    tag = data[pos]
+    if tag < 0x80:
+        return tag, pos + 1
+    if tag < 0xa0:
+        end = pos + tag - 0x7f
+        return data[pos + 1:end].decode(), end
+    return _decoders[tag](data, pos + 1, tag)
+
+
+# Decoders of the values with the other tags, from the position following the tag,
+# by tag: a table lookup instead of a chain of comparisons.
+
+def _decode_fixlist(data: bytes, pos: int, tag: int) -> Tuple[list, int]:
+    return _decode_items(data, pos, tag - _FIXLIST)
+
+
+def _decode_fixdict(data: bytes, pos: int, tag: int) -> Tuple[dict, int]:
+    return _decode_dict(data, pos, tag - _FIXDICT)
+
+
+def _decode_constant(data: bytes, pos: int, tag: int) -> Tuple[Optional[bool], int]:
+    return _CONSTANTS[tag], pos
+
+
+def _decode_int(data: bytes, pos: int, tag: int) -> Tuple[int, int]:
+    n, pos = _read_varint(data, pos)
+    return (n >> 1) ^ -(n & 1), pos
+
+
+def _decode_float(data: bytes, pos: int, tag: int) -> Tuple[float, int]:
+    return _double.unpack_from(data, pos)[0], pos + 8
+
+
+def _decode_str(data: bytes, pos: int, tag: int) -> Tuple[Union[str, bytes], int]:
+    n, pos = _read_varint(data, pos)
+    end = pos + n
+    if end > len(data):
+        raise ValueError('Truncated data')
+    return (data[pos:end].decode() if tag == _STR else bytes(data[pos:end])), end
+
+
+def _decode_list(data: bytes, pos: int, tag: int) -> Tuple[list, int]:
+    n, pos = _read_varint(data, pos)
+    return _decode_items(data, pos, n)
+
+
+def _decode_long_dict(data: bytes, pos: int, tag: int) -> Tuple[dict, int]:
+    n, pos = _read_varint(data, pos)
+    return _decode_dict(data, pos, n)
+
+
+def _decode_unknown(data: bytes, pos: int, tag: int):
+    raise ValueError('Unknown tag {} at position {}'.format(tag, pos - 1))
+
+
+_CONSTANTS = {_NONE: None, _FALSE: False, _TRUE: True}
+
+_decoders = [_decode_unknown] * 256  # type: List[Callable[[bytes, int, int], Tuple[Primitive, int]]]
+for _tag in range(_FIXLIST, _FIXDICT):
+    _decoders[_tag] = _decode_fixlist
+for _tag in range(_FIXDICT, _NONE):
+    _decoders[_tag] = _decode_fixdict
+for _tag in _CONSTANTS:
+    _decoders[_tag] = _decode_constant
+_decoders[_INT] = _decode_int
+_decoders[_FLOAT] = _decode_float
+_decoders[_STR] = _decode_str
+_decoders[_BYTES] = _decode_str
+_decoders[_LIST] = _decode_list
+_decoders[_DICT] = _decode_long_dict
+
+
+def _skip_value(data: bytes, pos: int) -> int:
+    """Return the position following the value at pos, without decoding it."""
+    tag = data[pos]
+    pos += 1
+    if tag < _FIXSTR:
+        return pos
+    if tag < _FIXLIST:
+        return pos + tag - _FIXSTR
+    if tag < _FIXDICT:
+        n = tag - _FIXLIST
+    elif tag < _NONE:
+        n = 2 * (tag - _FIXDICT)
+    elif tag == _NONE or tag == _TRUE or tag == _FALSE:
+        return pos
+    elif tag == _INT:
+        return _read_varint(data, pos)[1]
+    elif tag == _FLOAT:
+        return pos + 8
+    elif tag == _STR or tag == _BYTES:
+        n, pos = _read_varint(data, pos)
+        return pos + n
+    elif tag == _LIST:
+        n, pos = _read_varint(data, pos)
+    elif tag == _DICT:
+        n, pos = _read_varint(data, pos)
+        n *= 2
+    else:
+        raise ValueError('Unknown tag {} at position {}'.format(tag, pos - 1))
+    for _ in range(n):
+        pos = _skip_value(data, pos)
+    return pos
+
+
+def _lazy_value(data: bytes, pos: int):
+    """Decode the value at pos, as a LazyDict or LazyList if it is a dict or a list."""
+    tag = data[pos]
+    if _FIXLIST <= tag < _NONE or tag == _LIST or tag == _DICT:
+        is_dict = _FIXDICT <= tag < _NONE or tag == _DICT
+        if tag == _LIST or tag == _DICT:
+            n, pos = _read_varint(data, pos + 1)
+        else:
+            n = tag - (_FIXDICT if is_dict else _FIXLIST)
+            pos += 1
+        if is_dict:
+            offsets = {}
+            for _ in range(n):
+                k, pos = _decode_value(data, pos)
+                offsets[k] = pos
+                pos = _skip_value(data, pos)
+            return LazyDict(data, offsets), pos
+        offsets = []
+        for _ in range(n):
+            offsets.append(pos)
+            pos = _skip_value(data, pos)
+        return LazyList(data, offsets), pos
+    return _decode_value(data, pos)
+
+
+class LazyDict(Mapping):
+    """Dictionary decoded by BinaryCodec.decode_lazy: each value is decoded when first accessed."""
+
+    def __init__(self, data: bytes, offsets: Dict[Primitive, int]) -> None:
+        self.data = data
+        self.offsets = offsets
+        self._values = {}
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            value = self._values[key] = _decode_value(self.data, self.offsets[key])[0]
+            return value
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def view(self, key) -> Union['LazyDict', 'LazyList', Primitive]:
+        """Return the value at key, lazily decoded itself if it is a dict or a list."""
+        return _lazy_value(self.data, self.offsets[key])[0]
+
+
+class LazyList(Sequence):
+    """List decoded by BinaryCodec.decode_lazy: each item is decoded when first accessed."""
+
+    def __init__(self, data: bytes, offsets: List[int]) -> None:
+        self.data = data
+        self.offsets = offsets
+        self._items = {}
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self.offsets)))]
+        try:
+            return self._items[index]
+        except KeyError:
+            item = self._items[index] = _decode_value(self.data, self.offsets[index])[0]
+            return item
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+
+class BinaryCodec(Codec):
+    """
+    Compact, tagged binary codec, supporting every Primitive type natively.
+
+    Each value is encoded as a one byte tag followed by its payload: ints are zigzag
+    varints, floats 8 bytes IEEE 754 doubles, strings (UTF-8) and bytes are prefixed
+    by their varint length, lists (tuples and sets too) and dicts by their varint
+    number of items. Ints up to 127, and strings, lists and dicts short enough have
+    their value or length packed in the tag itself. Lists are decoded as lists, as with JSON.
+
+    Messages are about 25% smaller and encode about 20% faster than with JsonCodec, but decode
+    about 10% slower, as decoding is pure Python against the C JSON decoder: see benchcodec.
+    """
+
+    @classmethod
+    def encode(cls, data_dict: Dict[str, Primitive]) -> bytes:
+        out = bytearray()
+        _encode_value(data_dict, out)
+        return bytes(out)
+
+    @classmethod
+    def decode(cls, data: bytes) -> Dict[str, Primitive]:
+        if type(data) is memoryview:
+            data = data.tobytes()
+        try:
+            # Messages are dicts: straight to their items
+            tag = data[0]
+            value, end = _decode_dict(data, 1, tag - _FIXDICT) if _FIXDICT <= tag < _NONE else _decode_value(data, 0)
+        except (IndexError, UnicodeDecodeError) as e:
+            raise ValueError('Malformed BinaryCodec data') from e
+        if end != len(data):
+            raise ValueError('Truncated BinaryCodec data' if end > len(data) else 'Trailing data after BinaryCodec value')
+        return value
+
+    @classmethod
+    def decode_lazy(cls, data: bytes) -> Mapping:
+        """Index the top level dict, its values are decoded when accessed: see LazyDict."""
+        if type(data) is memoryview:
+            data = data.tobytes()
+        try:
+            value, end = _lazy_value(data, 0)
+        except (IndexError, UnicodeDecodeError) as e:
+            raise ValueError('Malformed BinaryCodec data') from e
+        if end != len(data):
+            raise ValueError('Truncated BinaryCodec data' if end > len(data) else 'Trailing data after BinaryCodec value')
+        return value
+
+    def __str__(self):
+        return str(self.__class__)
+
+    def __repr__(self):
+        return str(self)
@@ -0,0 +1,149 @@
+"""
+Compression of encoded messages, with zlib and a preset dictionary
+
+BoGaS messages are small and repetitive: the same class names, member names and element
+identifiers over and over. Too small for zlib to find repetitions inside a single message,
+but not if zlib is given, as preset dictionary, a sample of typical messages. Such
+dictionaries are trained offline from a recorded corpus of messages (see zdict), and
+registered under their ID, which peers exchange to agree on compression.
+
+Compressed messages start with a flag byte, telling whether the rest is compressed:
+messages shorter than the threshold are not worth the CPU time and are sent as they are.
+"""
+import zlib
+from collections.abc import Mapping
+from hashlib import sha256
+from typing import Dict, Type
+
+from bogascore.communication.connection import MAX_FRAME_SIZE
+from bogascore.log import get_logger
+from bogascore.serialization.codec import Codec
+from bogascore.serialization.serialization import Primitive
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+log = get_logger(__name__)
+
+# Encoded messages shorter than this are not compressed
+COMPRESSION_THRESHOLD = 128
+
+COMPRESSION_LEVEL = 6
+
+_RAW = 0
+_DEFLATE = 1
+
+# Preset dictionaries, by ID
+dictionaries = {}  # type: Dict[str, bytes]
+
+_compressed_codecs = {}
+
+
+def dictionary_id(dictionary: bytes) -> str:
+    return sha256(dictionary).hexdigest()[:16]
+
+
+def register_dictionary(dictionary: bytes) -> str:
+    """Make a dictionary available for negotiation, returning its ID."""
+    identifier = dictionary_id(dictionary)
+    dictionaries[identifier] = dictionary
+    return identifier
+
+
+def load_dictionary(path: str) -> str:
+    """Register the dictionary stored in a file, returning its ID."""
+    with open(path, 'rb') as f:
+        return register_dictionary(f.read())
+
+
+class CompressedCodec(Codec):
+    """
+    Wrapper of a codec, compressing its output.
+
+    Use compressed() to get the subclass wrapping a given codec.
+    """
+
+    codec = None  # type: Type[Codec]
+
+    dictionary = b''
+
+    threshold = COMPRESSION_THRESHOLD
+
+    # Largest decompressed message, so that small frames cannot inflate without bounds
+    max_size = MAX_FRAME_SIZE
+
+    # Compressor primed with the dictionary: copying it is cheaper than priming a new one.
+    _compressor = None
+
+    @classmethod
+    def encode(cls, data_dict: Dict[str, Primitive]) -> bytes:
+        data = cls.codec.encode(data_dict)
+        if len(data) < cls.threshold:
+            return bytes((_RAW,)) + data
+        compressor = cls._compressor.copy()
+        compressed = compressor.compress(data) + compressor.flush()
+        if len(compressed) >= len(data):
+            return bytes((_RAW,)) + data
+        return bytes((_DEFLATE,)) + compressed
+
+    @classmethod
+    def decode(cls, data: bytes) -> Dict[str, Primitive]:
+        return cls.codec.decode(cls._decompress(data))
+
+    @classmethod
+    def decode_lazy(cls, data: bytes) -> Mapping:
+        return cls.codec.decode_lazy(cls._decompress(data))
+
+    @classmethod
+    def _decompress(cls, data: bytes) -> bytes:
+        flag = data[0]
+        if flag == _RAW:
+            return data[1:]
+        if flag != _DEFLATE:
+            raise ValueError('Unknown compression flag {}.'.format(flag))
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=cls.dictionary)
+        decompressed = decompressor.decompress(data[1:], cls.max_size)
+        if decompressor.unconsumed_tail:
+            raise ValueError('Message decompresses to more than {} bytes.'.format(cls.max_size))
+        decompressed += decompressor.flush()
+        if len(decompressed) > cls.max_size:
+            raise ValueError('Message decompresses to more than {} bytes.'.format(cls.max_size))
+        return decompressed
+
+    def __str__(self):
+        return 'Compressed{}'.format(self.codec)
+
+
+def compressed(codec: Type[Codec], identifier: str, threshold: int = COMPRESSION_THRESHOLD) -> Type[Codec]:
+    """
+    Return the codec wrapping codec, compressing with the dictionary registered as identifier.
+
+    :raises KeyError: if no dictionary is registered with the given ID.
+    """
+    key = (codec, identifier, threshold)
+    wrapper = _compressed_codecs.get(key)
+    if wrapper is None:
+        dictionary = dictionaries[identifier]
+        compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=dictionary) \
+            if dictionary else zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+        wrapper = type('Compressed' + codec.__name__, (CompressedCodec,), {
+            'codec': codec,
+            'dictionary': dictionary,
+            'threshold': threshold,
+            '_compressor': compressor
+        })
+        _compressed_codecs[key] = wrapper
+    return wrapper
+
+
+def negotiate_compression(identifier: str) -> str:
+    """Return identifier if the dictionary is available, '' otherwise."""
+    if identifier in dictionaries:
+        return identifier
+    log.debug('Compression dictionary {} is not available.', identifier)
+    return ''
@@ -0,0 +1,316 @@
+"""
+Schema of the serializable classes, for a positional and more compact serialization
+
+A Schema gives every Serializable class defined in the schema modules a small integer ID,
+its position in the schema. Peers sharing the same schema, as proven by its fingerprint,
+can exchange records instead of dictionaries: a record is a dictionary holding, under
+RECORD_TAG, the class ID followed by the values of the class members in order.
+Classes given by 'type' members travel as IDs as well, and so do the classes of the
+column blocks of 'batch' members.
+
+Serializables of classes outside the schema are serialized as usual, so they can
+still be sent, only less compactly.
+"""
+from hashlib import sha256
+from importlib import import_module
+from keyword import iskeyword
+from typing import Callable, Dict, List, Optional
+
+from bogascore.log import get_logger
+from bogascore.serialization.serialization import SerializableMeta, Serializable, Primitive, \
+    SerializationException, LazyBatch, class_name_table, decoders_by_name, encode_value, decode_value, \
+    decode_bytes, encode_batch, serialization_dispatch_table, deserialization_dispatch_table
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+log = get_logger(__name__)
+
+# Serialization key of records
+RECORD_TAG = '#'
+
+# Modules whose Serializable classes are part of the schema. Games may add their own.
+schema_modules = [
+    'bogascore.communication.message',
+    'bogascore.elements',
+    'bogascore.elements.die',
+    'bogascore.environment',
+    'bogasserver.utilsmessages',
+]
+
+_plain_types = frozenset((type(None), str, int, bool, float, bytes))
+
+_inline_encoders = {
+    type(None): '{}',
+    str: '{}',
+    int: '{}',
+    bool: '{}',
+    float: '{}',
+    bytes: '{}',
+    set: 'encode_sequence({})',
+    list: 'encode_sequence({})',
+    tuple: 'encode_sequence({})',
+    dict: 'encode({})',
+    'type': 'ids[{}]',
+    'batch': 'encode_batch({})',
+    'any': 'encode({})'
+}
+
+_inline_decoders = {
+    str: '{}',
+    int: '{}',
+    bool: '{}',
+    float: '{}',
+    bytes: 'decode_bytes({})',
+    set: 'set(decode_sequence({}))',
+    list: 'decode_sequence({})',
+    tuple: 'tuple(decode_sequence({}))',
+    dict: 'decode({})',
+    'type': 'classes[{}]',
+    'batch': 'decode_batch({})',
+    'any': 'decode({})'
+}
+
+
+class Schema(object):
+    """Serializable classes of the schema modules, indexed by ID."""
+
+    _current = None
+
+    def __init__(self, classes: List[SerializableMeta]) -> None:
+        self.classes = sorted(classes, key=lambda c: (c.__module__, c.__qualname__))
+        self.ids = {cls: i for i, cls in enumerate(self.classes)}
+        self.fingerprint = sha256('\n'.join(
+            '{}.{}({})'.format(cls.__module__, cls.__qualname__, ','.join(
+                '{}:{}'.format(attr, attr_type if isinstance(attr_type, str) else attr_type.__name__)
+                for attr, attr_type in cls.members
+            ))
+            for cls in self.classes
+        ).encode()).hexdigest()[:16]
+        self._encoders = {cls: self._compile_encoder(cls) for cls in self.classes}
+        self._decoders = [self._compile_decoder(cls) for cls in self.classes]
+        self._column_encoders = {
+            cls: self._compile_column_encoder(cls) for cls in self.classes if self._has_records(cls)
+        }
+        self._row_decoders = [self._compile_row_decoder(cls) for cls in self.classes]
+        self._member_decoders = {}
+
+    @classmethod
+    def current(cls) -> 'Schema':
+        """Schema of the Serializable classes currently defined in the schema modules."""
+        for module in schema_modules:
+            import_module(module)
+        classes = [
+            c for c in class_name_table.values()
+            if isinstance(c, SerializableMeta) and c.__module__ in schema_modules
+        ]
+        if cls._current is None or cls._current.classes != sorted(
+                classes, key=lambda c: (c.__module__, c.__qualname__)):
+            cls._current = Schema(classes)
+        return cls._current
+
+    def encode(self, v) -> Primitive:
+        """Serialize a value, using records for the Serializables of the schema."""
+        t = type(v)
+        if t in _plain_types:
+            return v
+        encoder = self._encoders.get(t)
+        if encoder is not None:
+            return encoder(v)
+        if t is list or t is tuple or t is set:
+            return self.encode_sequence(v)
+        if t is dict:
+            return {k: self.encode(x) for k, x in v.items()}
+        return encode_value(v)
+
+    def encode_sequence(self, s) -> tuple:
+        for x in s:
+            if type(x) not in _plain_types:
+                return tuple(self.encode(x) for x in s)
+        return tuple(s)
+
+    def encode_batch(self, items) -> tuple:
+        """Serialize a list as encode_batch does, with class IDs in the column blocks."""
+        return encode_batch(items, self._column_encoders, self.ids.__getitem__, self.encode)
+
+    def decode(self, v):
+        """Inverse of encode: rebuild the records and tagged Serializables found in v."""
+        t = type(v)
+        if t is dict:
+            record = v.get(RECORD_TAG)
+            if record is not None:
+                return self._decoders[record[0]](record)
+            return decode_value(v)
+        if t is list or t is tuple:
+            return self.decode_sequence(v)
+        return v
+
+    def decode_sequence(self, s) -> list:
+        for x in s:
+            if type(x) is dict or type(x) is list:
+                return [self.decode(x) for x in s]
+        return list(s)
+
+    def decode_batch(self, s) -> LazyBatch:
+        return LazyBatch(s, self._row_decoders, self.decode)
+
+    def decode_message(self, data: Dict[str, Primitive]) -> Serializable:
+        """Decode a top level message, either a record or a message serialized as usual."""
+        try:
+            record = data.get(RECORD_TAG)
+            if record is None:
+                return decoders_by_name[data['msg_type']](data)
+            return self._decoders[record[0]](record)
+        except SerializationException:
+            raise
+        except Exception as e:
+            raise SerializationException("Error during deserialization.") from e
+
+    def member_decoders(self, cls: SerializableMeta) -> List[Callable]:
+        """Functions decoding the members of the records of cls, one per member in order."""
+        decoders = self._member_decoders.get(cls)
+        if decoders is None:
+            namespace = self._namespace()
+            decoders = self._member_decoders[cls] = [
+                eval(compile('lambda v: ' + self._field_code(
+                    attr_type, 'v', _inline_decoders, deserialization_dispatch_table, namespace),
+                    '<decode_member {}.{}>'.format(cls.__qualname__, attr), 'eval'), namespace)
+                for attr, attr_type in cls.members
+            ]
+        return decoders
+
+    def _namespace(self) -> dict:
+        return {
+            'ids': self.ids,
+            'classes': self.classes,
+            'encode': self.encode,
+            'encode_sequence': self.encode_sequence,
+            'encode_batch': self.encode_batch,
+            'decode': self.decode,
+            'decode_sequence': self.decode_sequence,
+            'decode_batch': self.decode_batch,
+            'decode_bytes': decode_bytes,
+            'SerializationException': SerializationException,
+            'log': log
+        }
+
+    @staticmethod
+    def _field_code(attr_type, value_code: str, inline: dict, table: dict, namespace: dict) -> str:
+        if attr_type in inline:
+            return inline[attr_type].format(value_code)
+        if isinstance(attr_type, SerializableMeta):
+            return inline[dict].format(value_code)
+        function_name = '_f{}'.format(len(namespace))
+
+        def function(value, _attr_type=attr_type):
+            return table[_attr_type](value)
+        namespace[function_name] = function
+        return '{}({})'.format(function_name, value_code)
+
+    @staticmethod
+    def _has_records(cls: SerializableMeta) -> bool:
+        """Classes with hand written (de)serialization keep it, and are never sent as records."""
+        return (getattr(cls.serialize, 'compilable', False)
+                and getattr(cls.deserialize, 'compilable', False)
+                and all(attr.isidentifier() and not iskeyword(attr) for attr, _ in cls.members))
+
+    def _compile_encoder(self, cls: SerializableMeta):
+        if not self._has_records(cls):
+            return encode_value
+        namespace = self._namespace()
+        namespace['encode_value'] = encode_value
+        fields = ''.join(
+            ', ' + self._field_code(attr_type, 'self.' + attr, _inline_encoders,
+                                    serialization_dispatch_table, namespace)
+            for attr, attr_type in cls.members
+        )
+        source = (
+            'def encode_record(self):\n'
+            '    try:\n'
+            '        return {{{!r}: [{}{}]}}\n'
+            '    except (AttributeError, KeyError):\n'
+            '        # Some member is not set, or refers to a class outside the schema\n'
+            '        return encode_value(self)\n'
+            '    except Exception as e:\n'
+            '        raise SerializationException("Error during serialization.") from e\n'
+        ).format(RECORD_TAG, self.ids[cls], fields)
+        return self._compile(cls, 'encode_record', source, namespace)
+
+    def _compile_decoder(self, cls: SerializableMeta):
+        namespace = self._namespace()
+        namespace['cls'] = cls
+        if not self._has_records(cls):
+            source = (
+                'def decode_record(r):\n'
+                '    raise SerializationException("Class {} has no records.")\n'
+            ).format(cls.__name__)
+            return self._compile(cls, 'decode_record', source, namespace)
+        args = ''.join(
+            '\n            {}={},'.format(attr, self._field_code(
+                attr_type, 'r[{}]'.format(i), _inline_decoders, deserialization_dispatch_table, namespace))
+            for i, (attr, attr_type) in enumerate(cls.members, 1)
+        )
+        source = (
+            'def decode_record(r):\n'
+            '    try:\n'
+            '        return cls({}\n        )\n'
+            '    except Exception as e:\n'
+            "        log.debug('r: {{}}, members: {{}}.', r, cls.members)\n"
+            '        raise SerializationException("Error during deserialization.") from e\n'
+        ).format(args)
+        return self._compile(cls, 'decode_record', source, namespace)
+
+    def _compile_column_encoder(self, cls: SerializableMeta):
+        namespace = self._namespace()
+        columns = ', '.join(
+            '[{} for o in run]'.format(self._field_code(
+                attr_type, 'o.' + attr, _inline_encoders, serialization_dispatch_table, namespace))
+            for attr, attr_type in cls.members
+        )
+        source = (
+            'def encode_columns(run):\n'
+            '    return [{}]\n'
+        ).format(columns)
+        return self._compile(cls, 'encode_columns', source, namespace)
+
+    def _compile_row_decoder(self, cls: SerializableMeta):
+        namespace = self._namespace()
+        namespace['cls'] = cls
+        if not self._has_records(cls):
+            source = (
+                'def decode_row(c, j):\n'
+                '    raise SerializationException("Class {} has no records.")\n'
+            ).format(cls.__name__)
+            return self._compile(cls, 'decode_row', source, namespace)
+        args = ''.join(
+            '\n            {}={},'.format(attr, self._field_code(
+                attr_type, 'c[{}][j]'.format(i), _inline_decoders, deserialization_dispatch_table, namespace))
+            for i, (attr, attr_type) in enumerate(cls.members)
+        )
+        source = (
+            'def decode_row(c, j):\n'
+            '    try:\n'
+            '        return cls({}\n        )\n'
+            '    except Exception as e:\n'
+            "        log.debug('row: {{}}, members: {{}}.', j, cls.members)\n"
+            '        raise SerializationException("Error during deserialization.") from e\n'
+        ).format(args)
+        return self._compile(cls, 'decode_row', source, namespace)
+
+    @staticmethod
+    def _compile(cls: SerializableMeta, name: str, source: str, namespace: dict):
+        exec(compile(source, '<{} {}>'.format(name, cls.__qualname__), 'exec'), namespace)
+        function = namespace[name]
+        function.__qualname__ = '{}.{}'.format(cls.__qualname__, name)
+        return function
+
+
+def negotiate_schema(fingerprint: str) -> Optional[Schema]:
+    """Return the current schema if it has the given fingerprint, None otherwise."""
+    schema = Schema.current()
+    return schema if fingerprint == schema.fingerprint else None
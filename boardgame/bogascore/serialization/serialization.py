@@ -5,10 +5,30 @@ Every message class and every class that could be passed as a field in a message
 the serializable interface, and register itself through the SerializableMeta class.
 SerializableMeta is a utility metaclass, that automates the building of slotted classes and
 serializable classes registry management.
+
+Classes setting frozen = True get immutable members once constructed. Their serialized
+form and hash are cached, stamped with the instance version: anything changing an instance
+in place, or replacing it with a successor (see stamp_version), bumps the version.
+
+Serializable values nested in other Serializables (directly, or inside lists, tuples,
+sets and dicts) are serialized as dictionaries tagged with their class name under the
+TYPE_TAG key, and rebuilt by the decoder of the tagged class.
+
+Members of type 'batch' hold lists of Serializables, often many of the same class (e.g.
+the modifications of a turn). Runs of at least BATCH_RUN_MIN instances of a class are
+serialized as columns: a dictionary holding, under COLUMNS_TAG, the class name, the run
+length and one list of values per member. Decoded batches are LazyBatch sequences,
+building the instances of a run only when they are accessed.
+
+Members of type 'any' hold values of any type, Serializables of any class included,
+serialized as nested values are.
 """
-from base64 import encodebytes, decodebytes
+from base64 import decodebytes
+from bisect import bisect_right
+from collections.abc import Sequence
 from datetime import datetime
-from typing import TypeVar, Dict
+from keyword import iskeyword
+from typing import Any, Dict, Iterable, Tuple, TypeVar
 
 from bogascore.log import get_logger
 
@@ -20,7 +40,7 @@ __version__ = "0.1"
 __maintainer__ = "Marco Capitani"
 __status__ = "Pre-Alpha"
 
-Primitive = TypeVar('Primitive', None, str, int, bool, float, set, list, tuple, dict)
+Primitive = TypeVar('Primitive', None, str, int, bool, float, bytes, set, list, tuple, dict)
 
 log = get_logger(__name__)
 
@@ -40,9 +60,176 @@ class_name_table = {
 }
 
 
+# Serialization tag holding the class name of nested Serializables
+TYPE_TAG = '__type__'
+
+# Deserialize functions of the Serializable classes, by class name
+decoders_by_name = {}
+
+_plain_types = frozenset((type(None), str, int, bool, float, bytes))
+_container_types = frozenset((list, tuple, dict))
+
+
 def resolve_class_name(name: str) -> type:
     return class_name_table[name]
 
+
+def encode_value(v):
+    """Serialize a value of any type, tagging the Serializables found in it."""
+    t = type(v)
+    if t in _plain_types:
+        return v
+    if isinstance(v, Serializable):
+        return {TYPE_TAG: t.__name__, **v.serialize()}
+    if t is list or t is tuple or t is set:
+        return encode_sequence(v)
+    if t is dict:
+        return {k: encode_value(x) for k, x in v.items()}
+    encoder = serialization_dispatch_table.get(t)
+    return encoder(v) if encoder is not None else v
+
+
+def encode_sequence(s) -> tuple:
+    for x in s:
+        if type(x) not in _plain_types:
+            return tuple(encode_value(x) for x in s)
+    return tuple(s)
+
+
+def decode_value(v):
+    """Inverse of encode_value: rebuild the tagged Serializables found in v."""
+    t = type(v)
+    if t is dict:
+        tag = v.get(TYPE_TAG)
+        if tag is not None:
+            return decoders_by_name[tag](v)
+        return {k: decode_value(x) for k, x in v.items()}
+    if t is list or t is tuple:
+        return decode_sequence(v)
+    return v
+
+
+def decode_bytes(b) -> bytes:
+    """Bytes are kept as such by binary codecs, and travel base64 encoded with text ones."""
+    return b if type(b) is bytes else decodebytes(b.encode())
+
+
+def decode_sequence(s) -> list:
+    for x in s:
+        if type(x) in _container_types:
+            return [decode_value(x) for x in s]
+    return list(s)
+
+
+# Serialization tag of the column blocks of batches
+COLUMNS_TAG = '__columns__'
+
+# Shorter runs of a class are serialized instance by instance
+BATCH_RUN_MIN = 4
+
+# Functions turning a run of instances into member columns, by class
+column_encoders = {}
+
+# Functions building the instance of a row of member columns, by class name
+row_decoders_by_name = {}
+
+
+def encode_batch(items, encoders=None, header=None, encode=None) -> tuple:
+    """
+    Serialize a list, turning runs of Serializables of the same class into column blocks.
+
+    The optional arguments are the column encoders, the block header of a class and the
+    fallback encoder to use instead of the module ones, so that schemas can reuse the
+    run detection.
+    """
+    if encoders is None:
+        encoders, header, encode = column_encoders, _name_header, encode_value
+    output = []
+    n = len(items)
+    i = 0
+    while i < n:
+        cls = type(items[i])
+        j = i + 1
+        while j < n and type(items[j]) is cls:
+            j += 1
+        encoder = encoders.get(cls) if j - i >= BATCH_RUN_MIN else None
+        if encoder is not None:
+            try:
+                output.append({COLUMNS_TAG: [header(cls), j - i] + encoder(items[i:j])})
+                i = j
+                continue
+            except (AttributeError, KeyError):
+                # Some member is not set: serialize the run instance by instance
+                pass
+        output.extend(encode(x) for x in items[i:j])
+        i = j
+    return tuple(output)
+
+
+def _name_header(cls: type) -> str:
+    return cls.__name__
+
+
+def decode_batch(s) -> 'LazyBatch':
+    """Inverse of encode_batch."""
+    return LazyBatch(s, row_decoders_by_name, decode_value)
+
+
+_PENDING = object()
+
+
+class LazyBatch(Sequence):
+    """
+    Sequence of decoded batch items.
+
+    Items serialized one by one are decoded right away, those of column blocks
+    on first access.
+    """
+
+    __slots__ = ('_items', '_starts', '_blocks')
+
+    def __init__(self, encoded, row_decoders, decode) -> None:
+        self._items = []
+        self._starts = []
+        self._blocks = []
+        for x in encoded:
+            block = x.get(COLUMNS_TAG) if type(x) is dict else None
+            if block is None:
+                self._items.append(decode(x))
+                continue
+            count = block[1]
+            self._starts.append(len(self._items))
+            self._blocks.append((row_decoders[block[0]], block[2:]))
+            self._items.extend([_PENDING] * count)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self._items)))]
+        item = self._items[index]
+        if item is _PENDING:
+            if index < 0:
+                index += len(self._items)
+            b = bisect_right(self._starts, index) - 1
+            row_decoder, columns = self._blocks[b]
+            item = self._items[index] = row_decoder(columns, index - self._starts[b])
+        return item
+
+    def __iter__(self):
+        for i in range(len(self._items)):
+            yield self[i]
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Sequence) or isinstance(other, (str, bytes)):
+            return NotImplemented
+        return len(self) == len(other) and all(x == y for x, y in zip(self, other))
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+
 serialization_dispatch_table = {
     type(None): lambda n: n,
     str: lambda s: s,
@@ -50,11 +237,13 @@ serialization_dispatch_table = {
     bool: lambda b: b,
     float: lambda f: f,
     datetime: lambda d: d.timestamp,
-    set: lambda s: tuple(s),
-    list: lambda l: tuple(l),
-    tuple: lambda t: t,
-    bytes: lambda b: encodebytes(b).decode().replace('\n', ''),
-    'type': lambda t: t.__name__
+    set: encode_sequence,
+    list: encode_sequence,
+    tuple: encode_sequence,
+    bytes: lambda b: b,
+    'type': lambda t: t.__name__,
+    'batch': encode_batch,
+    'any': encode_value
 }
 
 deserialization_dispatch_table = {
@@ -63,50 +252,354 @@ deserialization_dispatch_table = {
     bool: lambda b: b,
     float: lambda f: f,
     datetime: lambda d: datetime.fromtimestamp(d),
-    set: lambda s: set(s),
-    list: lambda l: list(l),
-    tuple: lambda t: tuple(t),
-    bytes: lambda b: decodebytes(b.encode()),
-    'type': resolve_class_name
+    set: lambda s: set(decode_sequence(s)),
+    list: decode_sequence,
+    tuple: lambda t: tuple(decode_sequence(t)),
+    bytes: decode_bytes,
+    'type': resolve_class_name,
+    'batch': decode_batch,
+    'any': decode_value
 }
 
 
+# Serialization code for builtin types, inlined in the generated (de)serializers.
+# An entry is only used if the corresponding dispatch table entry has not been overridden.
+_inline_serializers = {
+    type(None): '{}',
+    str: '{}',
+    int: '{}',
+    bool: '{}',
+    float: '{}',
+    set: 'encode_sequence({})',
+    list: 'encode_sequence({})',
+    tuple: 'encode_sequence({})',
+    bytes: '{}',
+    'type': '{}.__name__',
+    'batch': 'encode_batch({})',
+    'any': 'encode_value({})'
+}
+
+_inline_deserializers = {
+    str: '{}',
+    int: '{}',
+    bool: '{}',
+    float: '{}',
+    set: 'set(decode_sequence({}))',
+    list: 'decode_sequence({})',
+    tuple: 'tuple(decode_sequence({}))',
+    bytes: 'decode_bytes({})',
+    'type': 'class_name_table[{}]',
+    'batch': 'decode_batch({})',
+    'any': 'decode_value({})'
+}
+
+_builtin_serializers = dict(serialization_dispatch_table)
+_builtin_deserializers = dict(deserialization_dispatch_table)
+
+
+def _field_code(attr_type, value_code: str, table: dict, builtins: dict, inline: dict, namespace: dict) -> str:
+    """
+    Return the code converting value_code according to attr_type.
+
+    Builtin types are inlined, other types get their dispatch function bound
+    in the namespace of the generated function. Types still unknown are looked up lazily,
+    so that errors surface at (de)serialization time as they always did.
+    """
+    function = table.get(attr_type)
+    if attr_type in inline and function is builtins.get(attr_type):
+        return inline[attr_type].format(value_code)
+    function_name = '_f{}'.format(len(namespace))
+    if function is None:
+        def function(value, _attr_type=attr_type):
+            return table[_attr_type](value)
+    namespace[function_name] = function
+    return '{}({})'.format(function_name, value_code)
+
+
+def _cached_serializer(serialize):
+    """Wrap the serialize function of a frozen class, caching its output per instance version."""
+    def cached_serialize(self):
+        try:
+            version, serialized = self._cache
+            if version == self._version:
+                return serialized
+        except AttributeError:
+            pass
+        serialized = serialize(self)
+        try:
+            object.__setattr__(self, '_cache', (self._version, serialized))
+        except AttributeError:
+            pass  # Still under construction
+        return serialized
+    cached_serialize.__qualname__ = serialize.__qualname__
+    cached_serialize.compilable = True
+    return cached_serialize
+
+
+def hashable(v):
+    """Canonical hashable form of a serialized value."""
+    t = type(v)
+    if t is dict:
+        return frozenset((k, hashable(x)) for k, x in v.items())
+    if t is list or t is tuple:
+        return tuple(hashable(x) for x in v)
+    if t is set:
+        return frozenset(hashable(x) for x in v)
+    return v
+
+
+def _compile(cls: 'SerializableMeta', name: str, source: str, namespace: dict):
+    code = compile(source, '<{} {}>'.format(name, cls.__qualname__), 'exec')
+    exec(code, namespace)
+    function = namespace[name]
+    function.__qualname__ = '{}.{}'.format(cls.__qualname__, name)
+    function.compilable = True
+    return function
+
+
+def _compile_serializer(cls: 'SerializableMeta'):
+    namespace = {
+        'encode_sequence': encode_sequence,
+        'encode_batch': encode_batch,
+        'encode_value': encode_value,
+        'SerializationException': SerializationException,
+        'reference_serialize': Serializable.serialize
+    }
+    fields = ''.join(
+        '\n            {!r}: {},'.format(attr, _field_code(
+            attr_type, 'self.' + attr, serialization_dispatch_table,
+            _builtin_serializers, _inline_serializers, namespace))
+        for attr, attr_type in cls.members
+    )
+    source = (
+        'def serialize(self):\n'
+        '    try:\n'
+        '        return {{{}\n        }}\n'
+        '    except AttributeError:\n'
+        '        # Some member is not set: let the reference implementation default it to None.\n'
+        '        return reference_serialize(self)\n'
+        '    except Exception as e:\n'
+        '        raise SerializationException("Error during serialization.") from e\n'
+    ).format(fields)
+    return _compile(cls, 'serialize', source, namespace)
+
+
+def _compile_deserializer(cls: 'SerializableMeta'):
+    namespace = {
+        'decode_bytes': decode_bytes,
+        'decode_sequence': decode_sequence,
+        'decode_batch': decode_batch,
+        'decode_value': decode_value,
+        'class_name_table': class_name_table,
+        'SerializationException': SerializationException,
+        'log': log
+    }
+    args = ''.join(
+        '\n            {}={},'.format(attr, _field_code(
+            attr_type, 'v[{!r}]'.format(attr), deserialization_dispatch_table,
+            _builtin_deserializers, _inline_deserializers, namespace))
+        for attr, attr_type in cls.members
+    )
+    source = (
+        'def deserialize(cls, v):\n'
+        '    try:\n'
+        '        return cls({}\n        )\n'
+        '    except Exception as e:\n'
+        "        log.debug('v: {{}}, members: {{}}.', v, cls.members)\n"
+        '        raise SerializationException("Error during deserialization.") from e\n'
+    ).format(args)
+    return _compile(cls, 'deserialize', source, namespace)
+
+
+def _compile_column_encoder(cls: 'SerializableMeta'):
+    namespace = {
+        'encode_sequence': encode_sequence,
+        'encode_batch': encode_batch,
+        'encode_value': encode_value
+    }
+    columns = ', '.join(
+        '[{} for o in run]'.format(_field_code(
+            attr_type, 'o.' + attr, serialization_dispatch_table,
+            _builtin_serializers, _inline_serializers, namespace))
+        for attr, attr_type in cls.members
+    )
+    source = (
+        'def encode_columns(run):\n'
+        '    return [{}]\n'
+    ).format(columns)
+    return _compile(cls, 'encode_columns', source, namespace)
+
+
+def _compile_row_decoder(cls: 'SerializableMeta'):
+    namespace = {
+        'cls': cls,
+        'decode_bytes': decode_bytes,
+        'decode_sequence': decode_sequence,
+        'decode_batch': decode_batch,
+        'decode_value': decode_value,
+        'class_name_table': class_name_table,
+        'SerializationException': SerializationException,
+        'log': log
+    }
+    args = ''.join(
+        '\n            {}={},'.format(attr, _field_code(
+            attr_type, 'c[{}][j]'.format(i), deserialization_dispatch_table,
+            _builtin_deserializers, _inline_deserializers, namespace))
+        for i, (attr, attr_type) in enumerate(cls.members)
+    )
+    source = (
+        'def decode_row(c, j):\n'
+        '    try:\n'
+        '        return cls({}\n        )\n'
+        '    except Exception as e:\n'
+        "        log.debug('row: {{}}, members: {{}}.', j, cls.members)\n"
+        '        raise SerializationException("Error during deserialization.") from e\n'
+    ).format(args)
+    return _compile(cls, 'decode_row', source, namespace)
+
+
 class SerializableMeta(type):
+    """
+    Metaclass of all Serializables.
 
-    def __init__(cls, name: str, bases: tuple, cls_dict: dict) -> None:
+    Builds slotted classes, with a slot for every member and private member not already
+    slotted in a base class (slots declared explicitly in the class body are kept, so
+    '__dict__' can be declared to opt out), and generates the (de)serializers.
+    """
+
+    def __new__(mcs, name: str, bases: tuple, cls_dict: dict):
+        members = cls_dict['members'] if 'members' in cls_dict else mcs._inherited(bases, 'members', ())
+        if 'private_members' in cls_dict:
+            private_members = cls_dict['private_members']
+        else:
+            private_members = mcs._inherited(bases, 'private_members', ())
         try:
-            members = [x for x, _ in cls.members]
-            if hasattr(cls, 'private_members'):
-                members = members + list(cls.private_members)
+            if isinstance(private_members, str):
+                raise TypeError('private_members must be a sequence of names, not a string')
+            names = [x for x, _ in members] + list(private_members)
+            if cls_dict.get('frozen', mcs._inherited(bases, 'frozen', False)):
+                names += ['_version', '_cache', '_hash']
         except (KeyError, TypeError, ValueError) as e:
             raise TypeError('Class "{}" attribute "members" illegally defined. '
                             .format(name)) from e
+        slotted = set()
+        for base in bases:
+            for klass in base.__mro__:
+                klass_slots = klass.__dict__.get('__slots__', ())
+                slotted.update((klass_slots,) if isinstance(klass_slots, str) else klass_slots)
+        declared = cls_dict.get('__slots__', ())
+        declared = [declared] if isinstance(declared, str) else list(declared)
+        slots = []
+        for attr in declared + names:
+            if attr not in slotted and attr not in cls_dict and attr not in slots:
+                slots.append(attr)
+        cls_dict['__slots__'] = tuple(slots)
+        return super().__new__(mcs, name, bases, cls_dict)
+
+    @staticmethod
+    def _inherited(bases: tuple, attr: str, default):
+        for base in bases:
+            if hasattr(base, attr):
+                return getattr(base, attr)
+        return default
+
+    def __init__(cls, name: str, bases: tuple, cls_dict: dict) -> None:
         if not hasattr(cls, 'serialize') or not callable(cls.serialize):
             raise TypeError('Class "{}" attribute "serialize" undefined or not callable.'
                             .format(name))
         if not hasattr(cls, 'deserialize') or not callable(cls.deserialize):
             raise TypeError('Class "{}" attribute "deserialize" undefined or not callable.'
                             .format(name))
-        cls.__slots__ = members
         super().__init__(name, bases, cls_dict)
+        if cls.frozen:
+            cls._freeze()
+        if bases:
+            # The root class keeps the reference implementation.
+            cls.compile()
         cls.register()
 
+    def _freeze(cls) -> None:
+        """Make members read-only once the outermost __init__ returns."""
+        init = cls.__init__
+        member_names = frozenset(attr for attr, _ in cls.members)
+
+        def __init__(self, *args, **kwargs):
+            init(self, *args, **kwargs)
+            if type(self) is cls:
+                object.__setattr__(self, '_version', 0)
+
+        def __setattr__(self, attr, value):
+            if attr in member_names and hasattr(self, '_version'):
+                raise AttributeError('Cannot set member "{}" of frozen {}.'.format(attr, type(self).__name__))
+            object.__setattr__(self, attr, value)
+
+        __init__.__qualname__ = '{}.__init__'.format(cls.__qualname__)
+        __setattr__.__qualname__ = '{}.__setattr__'.format(cls.__qualname__)
+        cls.__init__ = __init__
+        cls.__setattr__ = __setattr__
+
+    def compile(cls) -> None:
+        """
+        Replace serialize and deserialize with functions specialized for the class members.
+
+        Methods overridden by hand are left alone, as are classes whose members
+        could not be passed as keyword arguments. Only classes with neither
+        get column (de)serializers for batches.
+        """
+        if not all(attr.isidentifier() and not iskeyword(attr) for attr, _ in cls.members):
+            return
+        if getattr(cls.serialize, 'compilable', False) and getattr(cls.deserialize, 'compilable', False):
+            column_encoders[cls] = _compile_column_encoder(cls)
+            row_decoders_by_name[cls.__name__] = _compile_row_decoder(cls)
+        else:
+            column_encoders.pop(cls, None)
+            row_decoders_by_name.pop(cls.__name__, None)
+        if getattr(cls.serialize, 'compilable', False):
+            cls.serialize = _compile_serializer(cls)
+            if cls.frozen:
+                cls.serialize = _cached_serializer(cls.serialize)
+        if getattr(cls.deserialize, 'compilable', False):
+            cls.deserialize = classmethod(_compile_deserializer(cls))
+        decoders_by_name[cls.__name__] = cls.deserialize
+
     def register(cls, serialize_function=None, deserialize_function=None):
+        custom = serialize_function is not None or deserialize_function is not None
         if serialize_function is None:
-            def serialize_function(o: 'Serializable'):
-                return o.serialize()
+            serialize_function = encode_value
         if deserialize_function is None:
-            def deserialize_function(d: Dict[str, Primitive]):
-                cls.deserialize(d)
+            deserialize_function = decode_value
         serialization_dispatch_table[cls] = serialize_function
         deserialization_dispatch_table[cls] = deserialize_function
         class_name_table[cls.__name__] = cls
+        decoders_by_name[cls.__name__] = cls.deserialize
+        if custom:
+            # Generated code binds dispatch functions, so it has to be regenerated.
+            for registered in list(class_name_table.values()):
+                if isinstance(registered, SerializableMeta) and registered is not Serializable:
+                    registered.compile()
+
+
+# Member names and slots of the Serializable classes, see Serializable.patch and copy
+_member_names = {}
+_all_slots = {}
+
+
+def _slots_of(cls: type) -> Tuple[str, ...]:
+    slots = []
+    for klass in cls.__mro__:
+        klass_slots = klass.__dict__.get('__slots__', ())
+        for slot in (klass_slots,) if isinstance(klass_slots, str) else klass_slots:
+            if slot not in ('__dict__', '__weakref__') and slot not in slots:
+                slots.append(slot)
+    return tuple(slots)
 
 
 class Serializable(metaclass=SerializableMeta):
 
     members = ()
 
+    frozen = False
+
     def serialize(self) -> Dict[str, Primitive]:
         try:
             output = {}
@@ -117,6 +610,8 @@ class Serializable(metaclass=SerializableMeta):
         except Exception as e:
             raise SerializationException("Error during serialization.") from e
 
+    serialize.compilable = True
+
     @classmethod
     def deserialize(cls, v: Dict[str, Primitive]) -> S:
         try:
@@ -131,14 +626,75 @@ class Serializable(metaclass=SerializableMeta):
             log.debug('v: {}, members: {}.', v, cls.members)
             raise SerializationException("Error during deserialization.") from e
 
+    deserialize.__func__.compilable = True
+
+    @property
+    def version(self) -> int:
+        """Version of a frozen instance, always 0 for the others."""
+        return getattr(self, '_version', 0)
+
+    def stamp_version(self, predecessor: 'Serializable') -> None:
+        """Mark a frozen instance as the successor of predecessor, which it replaces."""
+        if not self.frozen:
+            return
+        object.__setattr__(self, '_version', predecessor.version + 1)
+
+    def patch(self, changes: Iterable[Tuple[str, Any]]) -> None:
+        """
+        Set the given members in place, (member, value) couples, frozen ones too.
+
+        Frozen instances get a new version, as the successor they stand for, and a new
+        hash: only fresh copies (see copy) should be patched, not instances which may be
+        held already, e.g. as dict keys. Derived state set up by __init__ is not updated.
+        """
+        cls = type(self)
+        names = _member_names.get(cls)
+        if names is None:
+            names = _member_names[cls] = frozenset(attr for attr, _ in cls.members)
+        for attr, value in changes:
+            if attr not in names:
+                raise AttributeError('"{}" is not a member of {}.'.format(attr, cls.__name__))
+            object.__setattr__(self, attr, value)
+        if self.frozen:
+            object.__setattr__(self, '_version', self.version + 1)
+
+    def copy(self) -> 'Serializable':
+        """A shallow copy, made without calling __init__, of the same version."""
+        cls = type(self)
+        slots = _all_slots.get(cls)
+        if slots is None:
+            slots = _all_slots[cls] = _slots_of(cls)
+        new = cls.__new__(cls)
+        for slot in slots:
+            try:
+                object.__setattr__(new, slot, object.__getattribute__(self, slot))
+            except AttributeError:
+                pass
+        if hasattr(self, '__dict__'):
+            new.__dict__.update(self.__dict__)
+        return new
+
     def __eq__(self, other):
+        if self is other:
+            return True
         if not isinstance(other, Serializable):
             return False
+        if self.frozen and other.frozen and hash(self) != hash(other):
+            return False
         return self.serialize() == other.serialize()
 
     def __hash__(self):
-        # TODO: won't work right now as Dict is un-hashable. Migrate to unmodifiable dict?
-        return hash(self.serialize())
+        if not self.frozen:
+            return hash(hashable(self.serialize()))
+        try:
+            version, h = self._hash
+            if version == self._version:
+                return h
+        except AttributeError:
+            pass
+        h = hash(hashable(self.serialize()))
+        object.__setattr__(self, '_hash', (self._version, h))
+        return h
 
 
 class SerializationException(Exception):
@@ -0,0 +1,113 @@
+"""
+Training of compression dictionaries
+
+Record a corpus wrapping the codec of a server or client with recording(), then build
+the dictionary with:
+
+    python -m bogascore.serialization.zdict corpus [corpus ...] -o dictionary
+
+and load it with compression.load_dictionary on both ends.
+
+The dictionary is made of the corpus segments sharing the most substrings with the
+other messages, as zlib can only refer to the last 32 KiB of data, dictionary included.
+The segments covering the most common substrings come last, closest to the data.
+"""
+from argparse import ArgumentParser
+from collections import Counter
+from heapq import heapify, heappop, heappush
+from struct import Struct
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Type
+
+from bogascore.serialization.codec import Codec
+from bogascore.serialization.serialization import Primitive
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+DICTIONARY_SIZE = 32 * 1024
+
+# Messages are recorded prefixed by their length
+_length = Struct('>I')
+
+
+def recording(codec: Type[Codec], corpus: BinaryIO) -> Type[Codec]:
+    """Return a codec encoding as codec does, and appending every encoded message to corpus."""
+    def encode(cls, data_dict: Dict[str, Primitive]) -> bytes:
+        data = codec.encode(data_dict)
+        corpus.write(_length.pack(len(data)) + data)
+        return data
+    return type('Recording' + codec.__name__, (codec,), {'encode': classmethod(encode)})
+
+
+def read_corpus(corpus: BinaryIO) -> Iterator[bytes]:
+    while True:
+        header = corpus.read(_length.size)
+        if len(header) < _length.size:
+            return
+        yield corpus.read(_length.unpack(header)[0])
+
+
+def train(messages: Iterable[bytes], size: int = DICTIONARY_SIZE, segment: int = 64, k: int = 6) -> bytes:
+    """
+    Build a dictionary of at most size bytes for messages like the given ones.
+
+    Segments are scored by the number of messages containing each of their k-grams,
+    counting every k-gram only once overall: this favours common and diverse content.
+    """
+    messages = list(messages)
+    frequency = Counter()
+    for message in messages:
+        frequency.update({message[i:i + k] for i in range(len(message) - k + 1)})
+    candidates = []  # type: List[bytes]
+    for message in messages:
+        for start in range(0, max(len(message) - k + 1, 1), segment // 2):
+            candidates.append(message[start:start + segment])
+
+    def score(candidate: bytes) -> int:
+        return sum(frequency[g] for g in {candidate[i:i + k] for i in range(len(candidate) - k + 1)}
+                   if frequency[g] > 1)
+
+    heap = [(-score(c), i) for i, c in enumerate(candidates)]
+    heapify(heap)
+    chosen = []
+    total = 0
+    while heap and total < size:
+        negative_score, i = heappop(heap)
+        candidate = candidates[i]
+        current = score(candidate)
+        if current == 0:
+            continue
+        if heap and current < -heap[0][0]:
+            # Stale score: some of its k-grams were already taken
+            heappush(heap, (-current, i))
+            continue
+        chosen.append(candidate)
+        total += len(candidate)
+        for j in range(len(candidate) - k + 1):
+            frequency[candidate[j:j + k]] = 0
+    return b''.join(reversed(chosen))[-size:]
+
+
+def main(args=None) -> None:
+    parser = ArgumentParser(description='Build a compression dictionary from recorded corpora.')
+    parser.add_argument('corpus', nargs='+', help='corpus files, as written by recording()')
+    parser.add_argument('-o', '--output', required=True, help='dictionary file')
+    parser.add_argument('-s', '--size', type=int, default=DICTIONARY_SIZE, help='maximum dictionary size')
+    args = parser.parse_args(args)
+    messages = []
+    for path in args.corpus:
+        with open(path, 'rb') as f:
+            messages.extend(read_corpus(f))
+    dictionary = train(messages, args.size)
+    with open(args.output, 'wb') as f:
+        f.write(dictionary)
+    print('Dictionary of {} bytes built from {} messages.'.format(len(dictionary), len(messages)))
+
+
+if __name__ == '__main__':
+    main()
@@ -15,3 +15,8 @@ class ILobby(object, metaclass=ABCMeta):
     @abstractmethod
     def accept_new_client(self, stream, client_details):
         pass
+
+    @abstractmethod
+    def accept_connection(self, connection, client_details):
+        """Like accept_new_client, for clients already wrapped in a Connection."""
+        pass
@@ -0,0 +1,239 @@
+"""
+asyncio implementation of the bogas server
+
+An alternative to the tornado server, with no IOStream in between: frames are parsed
+straight out of the receive buffer of an asyncio BufferedProtocol, and accepted clients
+are handed to the lobby as ProtocolConnections. Framing and its negotiation are those
+of SocketConnection, so the same clients can connect to either server.
+"""
+import asyncio
+import os
+import stat
+from collections import deque
+from typing import Optional
+
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+
+from bogascore.communication.client import ClientDetails
+from bogascore.communication.connection import Connection, Framing, FramingException, MAX_FRAME_SIZE
+from bogascore.log import get_logger
+from bogasserver import ILobby
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+log = get_logger(__name__)
+
+
+def remove_socket(path: str) -> None:
+    """
+    Like tornado's bind_unix_socket, remove the stale socket file at path, if any.
+
+    :raises ValueError: if a file other than a socket is at path.
+    """
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise ValueError('File {} exists and is not a socket.'.format(path))
+    os.remove(path)
+
+
+class ProtocolConnection(asyncio.BufferedProtocol, Connection):
+    """
+    Connection over an asyncio transport.
+
+    Complete frames are copied out of the reusable receive buffer as soon as they arrive,
+    and queued until received. Frames too large for the buffer get a buffer of their own.
+    """
+
+    BUFFER_SIZE = 16 * 1024
+
+    def __init__(self, on_connection=None, framing: Framing = Framing.LEGACY) -> None:
+        """on_connection is called with the connection once it is established."""
+        self.on_connection = on_connection
+        self.framing = framing
+        self.transport = None  # type: Optional[asyncio.Transport]
+        self.buffer = bytearray(self.BUFFER_SIZE)
+        self._start = 0
+        self._end = 0
+        # Frame larger than the buffer being received, and how much of it arrived
+        self._large = None  # type: Optional[bytearray]
+        self._large_end = 0
+        self._frames = deque()
+        self._waiter = None  # type: Optional[asyncio.Future]
+        self._can_write = asyncio.Event()
+        self._can_write.set()
+        self._negotiable = framing == Framing.LEGACY
+        self._closed = None  # type: Optional[Exception]
+
+    # Protocol callbacks
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self.transport = transport
+        if self.on_connection is not None:
+            self.on_connection(self)
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        if self._large is not None:
+            return memoryview(self._large)[self._large_end:]
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif self._end == len(self.buffer):
+            pending = self._end - self._start
+            self.buffer[:pending] = self.buffer[self._start:self._end]
+            self._start, self._end = 0, pending
+        return memoryview(self.buffer)[self._end:]
+
+    def buffer_updated(self, nbytes: int) -> None:
+        if self._large is not None:
+            self._large_end += nbytes
+            if self._large_end == len(self._large):
+                self._push(self._large)
+                self._large = None
+            return
+        self._end += nbytes
+        try:
+            self._parse()
+        except FramingException as e:
+            log.warning('Closing connection: {}', e)
+            self.transport.close()
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self._closed = StreamClosedError(real_error=exc)
+        self._can_write.set()
+        self._wake()
+
+    def pause_writing(self) -> None:
+        self._can_write.clear()
+
+    def resume_writing(self) -> None:
+        self._can_write.set()
+
+    # Frames
+
+    def _parse(self) -> None:
+        while True:
+            header = self.framing.parse_header(self.buffer, self._start, self._end)
+            if header is None:
+                return
+            length, header_size = header
+            if length > MAX_FRAME_SIZE:
+                raise FramingException('Incoming message of {} bytes exceeds the maximum size.'.format(length))
+            start = self._start + header_size
+            if self._negotiable:
+                if length == 0:
+                    if self._end - start < 1:
+                        return
+                    self._start = start + 1
+                    self._accept_framing(self.buffer[start])
+                    continue
+                self._negotiable = False
+            if self._end - start >= length:
+                self._start = start + length
+                self._push(bytes(self.buffer[start:self._start]))
+                continue
+            if length > len(self.buffer) - header_size:
+                self._large = bytearray(length)
+                self._large_end = self._end - start
+                self._large[:self._large_end] = self.buffer[start:self._end]
+                self._start = self._end = 0
+            return
+
+    def _accept_framing(self, value: int) -> None:
+        try:
+            framing = Framing(value)
+        except ValueError:
+            framing = Framing.LEGACY
+        self.transport.write(bytes((0, 0, framing.value)))
+        self.framing = framing
+        self._negotiable = False
+        log.debug('Framing {} requested, {} agreed.', value, framing.name)
+
+    def _push(self, frame) -> None:
+        self._frames.append(frame)
+        self._wake()
+
+    def _wake(self) -> None:
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    # Connection
+
+    async def receive(self) -> bytes:
+        while not self._frames:
+            if self._closed is not None:
+                raise self._closed
+            self._waiter = asyncio.get_event_loop().create_future()
+            await self._waiter
+            self._waiter = None
+        return self._frames.popleft()
+
+    async def send(self, message: bytes) -> None:
+        if self._closed is not None:
+            raise self._closed
+        self._negotiable = False
+        self.transport.write(self.framing.header(len(message)))
+        self.transport.write(message)
+        # Wait while the transport buffer is above its high watermark
+        await self._can_write.wait()
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class AsyncioServer(object):
+    """
+    Server handing the clients connecting on port to lobby.accept_connection.
+
+    Listens on the Unix domain socket at unix_socket as well, if given, and only there
+    if port is None.
+    """
+
+    def __init__(self, lobby: ILobby, port=30645, host: str = None, io_loop: IOLoop = None, unix_socket: str = None):
+        if port is None and unix_socket is None:
+            raise ValueError('Either a port or a Unix socket is needed.')
+        self.lobby = lobby
+        self.port = port
+        self.host = host
+        self.unix_socket = unix_socket
+        self.io_loop = io_loop if io_loop is not None else IOLoop.current()
+        self.server = None  # type: Optional[asyncio.AbstractServer]
+        self.unix_server = None  # type: Optional[asyncio.AbstractServer]
+
+    async def listen(self) -> None:
+        loop = asyncio.get_event_loop()
+        if self.port is not None:
+            self.server = await loop.create_server(lambda: ProtocolConnection(self._accept), self.host, self.port)
+        if self.unix_socket is not None:
+            remove_socket(self.unix_socket)
+            self.unix_server = await loop.create_unix_server(lambda: ProtocolConnection(self._accept), self.unix_socket)
+
+    def _accept(self, connection: ProtocolConnection) -> None:
+        address = connection.transport.get_extra_info('peername')
+        if isinstance(address, tuple):
+            details = ClientDetails(address=address[0], port=address[1])
+        else:
+            # Unix domain socket clients have no address
+            details = ClientDetails(address=address or self.unix_socket)
+        log.info('Received new connection from {}.', details)
+        self.io_loop.spawn_callback(self.lobby.accept_connection, connection, details)
+
+    def start_listening(self) -> None:
+        self.io_loop.run_sync(self.listen)
+        log.info('Starting asyncio server, waiting for incoming connections.')
+        self.io_loop.start()
+
+    def stop(self) -> None:
+        if self.server is not None:
+            self.server.close()
+        if self.unix_server is not None:
+            self.unix_server.close()
+            remove_socket(self.unix_socket)
@@ -0,0 +1,111 @@
+"""
+Persistent store of the server keys and of the public keys of known users
+
+Keys are kept in a sqlite database. Known users skip sending their public key on
+reconnection, so lookups are frequent, and go through an LRU cache of recent users,
+unknown ones included. Other server secrets, as the key of the resumption tickets
+(see tickets), are kept too.
+"""
+import sqlite3
+from collections import OrderedDict
+from typing import Optional
+
+from nacl.public import PrivateKey, PublicKey
+from nacl.utils import random
+
+from bogascore.log import get_logger
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+log = get_logger(__name__)
+
+# Users whose public key (or absence of) is cached
+CACHE_SIZE = 4096
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS server_key (id INTEGER PRIMARY KEY CHECK (id = 0), private_key BLOB NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS user_keys (username TEXT PRIMARY KEY, public_key BLOB NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS secrets (name TEXT PRIMARY KEY, value BLOB NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS ticket_revocations (username TEXT PRIMARY KEY, revoked REAL NOT NULL)'
+)
+
+
+class KeyStore(object):
+    """Keys stored in the sqlite database at path, in memory by default."""
+
+    def __init__(self, path: str = ':memory:', cache_size: int = CACHE_SIZE) -> None:
+        self.path = path
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._db = sqlite3.connect(path)
+        if path != ':memory:':
+            # Readers are not blocked by writers, as on a reconnection storm of new users
+            self._db.execute('PRAGMA journal_mode=WAL')
+        with self._db:
+            for statement in _SCHEMA:
+                self._db.execute(statement)
+
+    def private_key(self) -> PrivateKey:
+        """Return the server private key, generated and stored the first time."""
+        row = self._db.execute('SELECT private_key FROM server_key').fetchone()
+        if row is not None:
+            return PrivateKey(row[0])
+        key = PrivateKey.generate()
+        with self._db:
+            self._db.execute('INSERT INTO server_key VALUES (0, ?)', (key.encode(),))
+        log.info('Generated a new server key, stored in {}.', self.path)
+        return key
+
+    def secret(self, name: str, size: int) -> bytes:
+        """Return the secret called name, size random bytes generated and stored the first time."""
+        row = self._db.execute('SELECT value FROM secrets WHERE name = ?', (name,)).fetchone()
+        if row is not None:
+            return row[0]
+        value = random(size)
+        with self._db:
+            self._db.execute('INSERT INTO secrets VALUES (?, ?)', (name, value))
+        return value
+
+    def revoke_tickets(self, username: str, revoked: float) -> None:
+        with self._db:
+            self._db.execute('INSERT OR REPLACE INTO ticket_revocations VALUES (?, ?)', (username, revoked))
+
+    def tickets_revoked_before(self, username: str) -> float:
+        """Return the time the tickets of username were last revoked, 0 if never."""
+        row = self._db.execute('SELECT revoked FROM ticket_revocations WHERE username = ?', (username,)).fetchone()
+        return row[0] if row is not None else 0.0
+
+    def public_key(self, username: str) -> Optional[PublicKey]:
+        """Return the public key of a user, or None if the user is unknown."""
+        try:
+            key = self._cache[username]
+            self._cache.move_to_end(username)
+            return key
+        except KeyError:
+            pass
+        row = self._db.execute('SELECT public_key FROM user_keys WHERE username = ?', (username,)).fetchone()
+        key = PublicKey(row[0]) if row is not None else None
+        self._remember(username, key)
+        return key
+
+    def save_public_key(self, username: str, public_key: PublicKey) -> None:
+        if username in self._cache and self._cache[username] == public_key:
+            return
+        with self._db:
+            self._db.execute('INSERT OR REPLACE INTO user_keys VALUES (?, ?)', (username, public_key.encode()))
+        self._remember(username, public_key)
+
+    def _remember(self, username: str, key: Optional[PublicKey]) -> None:
+        self._cache[username] = key
+        self._cache.move_to_end(username)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def close(self) -> None:
+        self._db.close()
@@ -1,5 +1,21 @@
-"""Security tools for bogas server"""
+"""
+Security tools for bogas server
+
+Messages are encrypted with a Box of the two peers' keys, each with a random nonce sent
+along. Once both sides contributed some random bytes (see IntroductionMessage and
+ServerKeysMessage), they can switch to session mode: a key per direction is derived from
+the Box shared key and the random bytes, and messages are encrypted with XSalsa20-Poly1305
+(as a Box does), their nonce being a counter of the messages sent in that direction.
+Nonces are never sent, and replayed, dropped or reordered messages fail authentication.
+"""
+import os
+
+from nacl.bindings import crypto_box_open_easy_afternm, crypto_secretbox, crypto_secretbox_open
+from nacl.encoding import RawEncoder
+from nacl.exceptions import CryptoError
+from nacl.hash import blake2b
 from nacl.public import PrivateKey, Box, PublicKey
+from nacl.utils import random
 
 __author__ = "Marco Capitani"
 __copyright__ = "Copyright 2017, Marco Capitani"
@@ -11,16 +27,83 @@ __status__ = "Pre-Alpha"
 
 
 def load_private_key() -> PrivateKey:
-    return PrivateKey.generate()  # TODO
+    """Key of the processes not using a persistent one (see Crypto.use_private_key and keystore)."""
+    return PrivateKey.generate()
+
+
+def load_key_file(path: str) -> PrivateKey:
+    """Return the private key stored in the file at path, generated and stored the first time."""
+    try:
+        with open(path, 'rb') as f:
+            return PrivateKey(f.read())
+    except FileNotFoundError:
+        pass
+    key = PrivateKey.generate()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Readable by the owner only
+    with open(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'wb') as f:
+        f.write(key.encode())
+    return key
+
+
+# Size of the random bytes each side contributes to the session keys
+SESSION_RANDOM_SIZE = 16
+
+_SESSION_KEY_SIZE = 32
+_CLIENT_TO_SERVER = b'bogas-c2s'
+_SERVER_TO_CLIENT = b'bogas-s2c'
+# Counter nonces: 16 zero bytes, then the 8 bytes little-endian counter
+_NONCE_PADDING = bytes(16)
+_MAX_COUNTER = 2 ** 64
+
+
+def session_random() -> bytes:
+    return random(SESSION_RANDOM_SIZE)
 
 
 class Crypto(object):
     _private_key = load_private_key()
     _public_key = _private_key.public_key
 
-    def __init__(self, other_public_key: PublicKey):
-        self.box = Box(self._private_key, other_public_key)
+    def __init__(self, other_public_key: PublicKey, private_key: PrivateKey = None):
+        """private_key is the key of this end, the process wide one (see use_private_key) by default."""
+        if private_key is None:
+            private_key = self._private_key
+        self.box = Box(private_key, other_public_key)
+        self.public_key = private_key.public_key
         self.other_key = other_public_key
+        self._send_key = None
+        self._receive_key = None
+        self._sent = 0
+        self._received = 0
+
+    def start_session(self, client_random: bytes, server_random: bytes, is_client: bool) -> None:
+        """
+        Switch to session mode, for the messages sent and received from now on.
+
+        Both peers must switch at the same point of the conversation, with the same random bytes.
+        """
+        salt = client_random + server_random
+        shared_key = self.box.shared_key()
+        client_key, server_key = (
+            blake2b(salt, digest_size=_SESSION_KEY_SIZE, key=shared_key, person=person, encoder=RawEncoder)
+            for person in (_CLIENT_TO_SERVER, _SERVER_TO_CLIENT)
+        )
+        self._send_key, self._receive_key = (client_key, server_key) if is_client else (server_key, client_key)
+        self._sent = 0
+        self._received = 0
+
+    @property
+    def in_session(self) -> bool:
+        return self._send_key is not None
+
+    @classmethod
+    def use_private_key(cls, private_key: PrivateKey) -> None:
+        """Use private_key from now on, e.g. a key persisted by a keystore.KeyStore."""
+        cls._private_key = private_key
+        cls._public_key = private_key.public_key
 
     @classmethod
     def get_private_key(cls):
@@ -31,7 +114,30 @@ class Crypto(object):
         return cls._public_key
 
     def encrypt(self, msg: bytes) -> bytes:
-        return self.box.encrypt(msg)
+        """Encrypt a message. In session mode, messages must be sent in the order they are encrypted."""
+        if self._send_key is None:
+            return self.box.encrypt(msg)
+        if self._sent == _MAX_COUNTER:
+            raise CryptoError('Session nonces exhausted.')
+        nonce = _NONCE_PADDING + self._sent.to_bytes(8, 'little')
+        self._sent += 1
+        return crypto_secretbox(msg, nonce, self._send_key)
 
     def decrypt(self, msg: bytes) -> bytes:
-        return self.box.decrypt(msg)
+        """
+        Decrypt a message. In session mode, messages must be decrypted in the order they are received.
+
+        Large messages are received in a bytearray (see FrameReader): any buffer is accepted,
+        and copied once, as nacl needs.
+        """
+        if self._receive_key is None:
+            view = memoryview(msg)
+            # As Box.decrypt, without copying the ciphertext out of the message first
+            return crypto_box_open_easy_afternm(bytes(view[Box.NONCE_SIZE:]), bytes(view[:Box.NONCE_SIZE]),
+                                                self.box.shared_key())
+        nonce = _NONCE_PADDING + self._received.to_bytes(8, 'little')
+        # Raises CryptoError, not counting the message, if it is not the one expected next.
+        # Copied once, behind the zero padding crypto_secretbox_open needs.
+        decrypted = crypto_secretbox_open(msg, nonce, self._receive_key)
+        self._received += 1
+        return decrypted
@@ -6,7 +6,8 @@ from tornado.ioloop import IOLoop
 from tornado.iostream import IOStream
 
 from bogascore.communication.client import Client, ClientDetails, ClientException, ClientBuilder
-from bogascore.communication.connection import SocketConnection
+from bogascore.communication.connection import Connection, DirectConnection, SocketConnection, \
+    direct_connection_pair
 from bogascore.communication.message import InfoMessage, ChoiceMessage, ChoiceResponseMessage
 from bogascore.environment import Player
 from bogascore.examples.testgames import RandomWinsGame
@@ -14,6 +15,10 @@ from bogascore.game import Event, Game
 from bogascore.log import get_logger
 from bogascore.serialization.serialization import Serializable
 from bogasserver import ILobby
+from bogasserver.keystore import KeyStore
+from bogasserver.security import Crypto
+from bogasserver.tickets import Tickets
+from bogasserver.utilsmessages import TicketMessage
 from bogasserver.tornadowrapper import TornadoTCPServer
 
 __author__ = "Marco Capitani"
@@ -53,6 +58,8 @@ class GameInfo(Serializable):
         ('game', str)
     )
 
+    frozen = True
+
     def __init__(self, name: str, game: str):
         self.name = name
         self.game = game
@@ -135,16 +142,30 @@ class WelcomeHandler(object):
 
 class Lobby(ILobby):
 
-    def __init__(self, io_loop: IOLoop = IOLoop.current()):
-        # TODO: Recover dbs (known users, loadable games ecc.)
+    def __init__(self, io_loop: IOLoop = IOLoop.current(), key_store: KeyStore = None, tickets: Tickets = None):
+        """
+        With a key_store, the server key and the public keys of the users are persisted in it,
+        and users log in with the key they first used. Without, users are always unknown.
+
+        tickets issues the resumption tickets of the clients, by default sharing key_store.
+        """
+        # TODO: Recover dbs (loadable games ecc.)
         self.active_clients = {}  # type: Dict[str, Client]
         self.io_loop = io_loop
+        self.key_store = key_store
+        if key_store is not None:
+            Crypto.use_private_key(key_store.private_key())
+        self.tickets = tickets if tickets is not None else Tickets(key_store)
         self.running = False
         self.games = GamesRepo()
         self.open_games = OpenGamesRepo(self.games)
 
-    def run(self):
-        server = TornadoTCPServer(self, io_loop=self.io_loop)
+    def run(self, server_class=TornadoTCPServer, port=30645, unix_socket: str = None):
+        """
+        Serve clients, through either TornadoTCPServer or asyncioserver.AsyncioServer,
+        on port and/or on the Unix domain socket at unix_socket.
+        """
+        server = server_class(self, port=port, io_loop=self.io_loop, unix_socket=unix_socket)
         server.start_listening()
 
     async def welcome_client(self, client: Client):
@@ -155,27 +176,56 @@ class Lobby(ILobby):
 
     async def query_public_key(self, username: str) -> PublicKey:
         """Return either the public key or None if unknown user."""
-        pass  # TODO
+        if self.key_store is None:
+            return None
+        return self.key_store.public_key(username)
 
     async def save_public_key(self, username: str, public_key: PublicKey) -> None:
-        pass
+        if self.key_store is not None:
+            self.key_store.save_public_key(username, public_key)
+
+    async def send_ticket(self, client: Client) -> None:
+        await client.send(TicketMessage(self.tickets.issue(client.username, client.crypto.other_key)))
 
     async def accept_new_client(self, stream: IOStream, client_details):
         log.info('New client connected. Client data is {}.', client_details)
-        new_connection = SocketConnection(stream)
+        await self.accept_connection(
+            SocketConnection(stream),
+            ClientDetails(address=client_details[0], port=client_details[1])
+        )
+
+    def connect_direct(self, carries_objects: bool = True) -> DirectConnection:
+        """
+        Accept an in-process client (e.g. a bot), returning the connection it should use.
+
+        See DirectConnection for carries_objects.
+        """
+        client_end, server_end = direct_connection_pair(carries_objects)
+        log.info('New in-process client connected.')
+        self.io_loop.spawn_callback(self.accept_connection, server_end, ClientDetails())
+        return client_end
+
+    async def accept_connection(self, connection: Connection, client_details: ClientDetails):
         try:
             # TODO should check username for duplication
-            client_builder = ClientBuilder(
-                new_connection,
-                ClientDetails(address=client_details[0], port=client_details[1])
-            )
+            client_builder = ClientBuilder(connection, client_details, self.tickets)
             await client_builder.do_handshake()
-            client_key = await self.query_public_key(client_builder.username)
+            # Clients resuming with a ticket are known
+            client_key = client_builder.client_key
+            if client_key is None:
+                client_key = await self.query_public_key(client_builder.username)
             await client_builder.exchange_keys(client_key)
-            await self.save_public_key(client_builder.username, client_key)
+            if client_key is None:
+                await self.save_public_key(client_builder.username, client_builder.crypto.other_key)
+            previous = self.active_clients.get(client_builder.username)
+            if client_builder.resumed and previous is not None:
+                client_builder.resume(previous)
+                await self.send_ticket(previous)
+                return
             client = client_builder.build()
             self.active_clients[client.username] = client
             log.debug("Client {} added to clients.", client.username)
+            await self.send_ticket(client)
             await self.welcome_client(client)
         except ClientException as e:
             log.warning('Client refused: {}.', e)
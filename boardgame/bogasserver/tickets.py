@@ -0,0 +1,101 @@
+"""
+Resumption tickets, sparing reconnecting clients most of the handshake
+
+Once a client is logged in, the server sends it a ticket (see TicketMessage): its
+username and public key, encrypted with a key only the server knows. A reconnecting
+client presents the ticket in its IntroductionMessage, and the server, trusting the
+ticket, knows the client key at once: the ServerKeysMessage completes the handshake,
+the client not sending its key, and the client gets its place in the lobby back.
+
+Tickets expire after a while, and the tickets of a user can be revoked. Tickets that
+cannot be used are ignored, and the handshake goes on as usual.
+"""
+import time
+from typing import Optional
+
+from nacl.exceptions import CryptoError
+from nacl.public import PublicKey
+from nacl.secret import SecretBox
+from nacl.utils import random
+
+from bogascore.log import get_logger
+from bogascore.serialization.codec import BinaryCodec
+from bogascore.serialization.serialization import Serializable, SerializationException
+from bogasserver.keystore import KeyStore
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+log = get_logger(__name__)
+
+# Seconds a ticket can be used for
+TICKET_LIFETIME = 3600
+
+
+class Ticket(Serializable):
+
+    members = (
+        ('username', str),
+        ('client_key', bytes),
+        ('issued', float)
+    )
+
+    def __init__(self, username: str, client_key: bytes, issued: float) -> None:
+        self.username = username
+        self.client_key = client_key
+        self.issued = issued
+
+
+class Tickets(object):
+    """
+    Issuer of the tickets of a server, checking them when presented.
+
+    With a key_store, the ticket key and the revocations are persisted in it, so that
+    tickets survive restarts. Otherwise they are valid until the server stops.
+    """
+
+    def __init__(self, key_store: KeyStore = None, lifetime: float = TICKET_LIFETIME) -> None:
+        self.key_store = key_store
+        self.lifetime = lifetime
+        key = key_store.secret('tickets', SecretBox.KEY_SIZE) if key_store is not None else random(SecretBox.KEY_SIZE)
+        self.box = SecretBox(key)
+        # Tickets issued up to these times are revoked, by username
+        self.revocations = {}
+
+    def issue(self, username: str, client_key: PublicKey) -> bytes:
+        ticket = Ticket(username, client_key.encode(), time.time())
+        return bytes(self.box.encrypt(BinaryCodec.encode(ticket.serialize())))
+
+    def open(self, data: bytes) -> Optional[Ticket]:
+        """Return the ticket, or None if it is invalid, expired or revoked."""
+        try:
+            ticket = Ticket.deserialize(BinaryCodec.decode(self.box.decrypt(data)))
+        except (CryptoError, ValueError, SerializationException):
+            log.debug('Invalid ticket.')
+            return None
+        if time.time() - ticket.issued > self.lifetime:
+            log.debug('Ticket of {} expired.', ticket.username)
+            return None
+        if ticket.issued <= self.revoked_before(ticket.username):
+            log.debug('Ticket of {} revoked.', ticket.username)
+            return None
+        return ticket
+
+    def revoke(self, username: str) -> None:
+        """Revoke all the tickets issued to username so far."""
+        now = time.time()
+        self.revocations[username] = now
+        if self.key_store is not None:
+            self.key_store.revoke_tickets(username, now)
+
+    def revoked_before(self, username: str) -> float:
+        revoked = self.revocations.get(username)
+        if revoked is None:
+            revoked = self.revocations[username] = \
+                self.key_store.tickets_revoked_before(username) if self.key_store is not None else 0.0
+        return revoked
@@ -2,10 +2,12 @@
 
 from tornado.ioloop import IOLoop
 from tornado.iostream import IOStream
+from tornado.netutil import bind_unix_socket
 from tornado.tcpserver import TCPServer
 
 from bogascore.log import get_logger
 from bogasserver import ILobby
+from bogasserver.asyncioserver import remove_socket
 
 __author__ = "Marco Capitani"
 __copyright__ = "Copyright 2017, Marco Capitani"
@@ -26,10 +28,24 @@ class ClientData(object):
 
 
 class TornadoTCPServer(TCPServer):
+    """
+    Server handing the clients connecting on port to lobby.accept_new_client.
 
-    def __init__(self, lobby: ILobby, port=30645, io_loop=IOLoop.current()):
-        super(TornadoTCPServer, self).__init__(io_loop=io_loop)
-        self.listen(port)
+    Listens on the Unix domain socket at unix_socket as well, if given, and only there
+    if port is None. Local clients (bots, tools) are better served by a Unix socket.
+    """
+
+    def __init__(self, lobby: ILobby, port=30645, io_loop: IOLoop = None, unix_socket: str = None):
+        # Tornado servers use the current IOLoop, they no longer take one.
+        super(TornadoTCPServer, self).__init__()
+        self.io_loop = io_loop if io_loop is not None else IOLoop.current()
+        if port is None and unix_socket is None:
+            raise ValueError('Either a port or a Unix socket is needed.')
+        if port is not None:
+            self.listen(port)
+        self.unix_socket = unix_socket
+        if unix_socket is not None:
+            self.add_socket(bind_unix_socket(unix_socket))
         self.lobby = lobby
 
     def start_listening(self):
@@ -37,6 +53,14 @@ class TornadoTCPServer(TCPServer):
         log.info('Starting TCP server, waiting for incoming connections.')
         self.io_loop.start()
 
+    def stop(self):
+        super(TornadoTCPServer, self).stop()
+        if self.unix_socket is not None:
+            remove_socket(self.unix_socket)
+
     async def handle_stream(self, stream: IOStream, address):
-        log.info('Received new TCP connection from {}.', address)
+        if not address:
+            # Unix domain socket clients have no address
+            address = (self.unix_socket, None)
+        log.info('Received new connection from {}.', address)
         await self.lobby.accept_new_client(stream, address)
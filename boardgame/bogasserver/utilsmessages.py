@@ -15,13 +15,28 @@ class IntroductionMessage(Message):
 
     members = Message.members + (
         ('username', str),
-        ('codec', str)
+        ('codec', str),
+        ('schema', str),
+        ('compression', str),
+        ('session', bytes),
+        ('ticket', bytes)
     )
 
-    def __init__(self, username: str, codec: str, msg_type: type = None) -> None:
+    def __init__(self, username: str, codec: str, schema: str = '', compression: str = '', session: bytes = b'',
+                 ticket: bytes = b'', msg_type: type = None) -> None:
+        """
+        schema is the fingerprint of the schema the client would like to use, if any,
+        compression the ID of the compression dictionary, if any, session the client
+        random bytes of the session keys, if the client would like to use session mode
+        (see security.Crypto), and ticket a resumption ticket, if any (see tickets).
+        """
         super(IntroductionMessage, self).__init__(msg_type)
         self.username = username
         self.codec = codec
+        self.schema = schema
+        self.compression = compression
+        self.session = session
+        self.ticket = ticket
 
     def get_codec(self) -> Codec:
         try:
@@ -34,16 +49,27 @@ class ServerKeysMessage(Message):
 
     members = Message.members + (
         ('server_key',  bytes),
-        ('client_key', bytes)
+        ('client_key', bytes),
+        ('schema', str),
+        ('compression', str),
+        ('session', bytes)
     )
 
-    def __init__(self, server_key: bytes, client_key: bytes, msg_type: type = None) -> None:
+    def __init__(self, server_key: bytes, client_key: bytes, schema: str = '', compression: str = '',
+                 session: bytes = b'', msg_type: type = None) -> None:
+        """
+        schema and compression are the schema fingerprint and dictionary ID agreed upon, empty if none,
+        session the server random bytes of the session keys, empty if session mode is not used.
+        """
         super(ServerKeysMessage, self).__init__(msg_type)
         self.server_key = server_key
         self.client_key = client_key
+        self.schema = schema
+        self.compression = compression
+        self.session = session
 
     def is_client_key_missing(self):
-        return self.client_key == ''
+        return not self.client_key
 
 
 class ClientKeyMessage(Message):
@@ -55,3 +81,15 @@ class ClientKeyMessage(Message):
     def __init__(self, client_key: bytes, msg_type: type = None) -> None:
         super(ClientKeyMessage, self).__init__(msg_type)
         self.client_key = client_key
+
+
+class TicketMessage(Message):
+    """Resumption ticket, to be presented on reconnection (see tickets)."""
+
+    members = Message.members + (
+        ('ticket', bytes),
+    )
+
+    def __init__(self, ticket: bytes, msg_type: type = None) -> None:
+        super(TicketMessage, self).__init__(msg_type)
+        self.ticket = ticket
@@ -0,0 +1,92 @@
+"""Benchmark: sending modifications to every client in turn against broadcasting them, projected per group"""
+import asyncio
+from time import perf_counter
+
+from tornado.ioloop import IOLoop
+
+from bogascore.communication.client import Client, ClientDetails, broadcast
+from bogascore.environment import ChangeElementModification, Environment, NewElementModification, Player
+from bogascore.serialization.codec import BinaryCodec, JsonCodec
+from bogascore.serialization.schema import Schema
+from bogasserver.security import Crypto, session_random
+from bogastest.bogascore.testserialization import Token
+from bogastest.bogascore.testvisibility import SecretHand
+from bogastest.connections import NullConnection
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+
+def audience(size: int, codec, schema) -> list:
+    clients = []
+    for _ in range(size):
+        crypto = Crypto(Crypto.get_public_key())
+        crypto.start_session(session_random(), session_random(), is_client=False)
+        clients.append(Client(NullConnection(), ClientDetails(), codec, 'user', crypto, schema))
+    return clients
+
+
+async def one_by_one(clients: list, modification) -> None:
+    for client in clients:
+        await client.send(modification)
+
+
+async def per_client(env: Environment, modification) -> None:
+    """Project the modification for each client by itself."""
+    await asyncio.gather(*(
+        broadcast([client], modification.project(modification.view_key(env, env.viewer(client))))
+        for client in env.clients
+    ))
+
+
+async def grouped(env: Environment, modification) -> None:
+    await env.accept(modification)
+
+
+def bench_projections(modifications: int = 500) -> None:
+    modification = NewElementModification(SecretHand, [
+        ('identifier', 'hand'), ('owner', 'player0'), ('cards', ['card'] * 13), ('plan', 'bluff')
+    ])
+    io_loop = IOLoop.current()
+    for size in (8, 32, 128):
+        env = Environment(lambda e: None, audience(size, JsonCodec, None))
+        # 8 seats in two teams, and spectators
+        for i, client in enumerate(env.clients[:8]):
+            env.seat(client, Player('player{}'.format(i)), 'team{}'.format(i % 2))
+        for name, send in (('per client', per_client), ('grouped', grouped)):
+            async def run():
+                start = perf_counter()
+                for _ in range(modifications):
+                    await send(env, modification)
+                return perf_counter() - start
+            elapsed = io_loop.run_sync(run)
+            print('hidden {:3} clients {:<10} {:7.1f}us per modification, {:5.2f}us per client'.format(
+                size, name, elapsed / modifications * 1e6, elapsed / modifications / size * 1e6))
+
+
+def bench(modifications: int = 500) -> None:
+    modification = ChangeElementModification(Token, 'token', [('owner', 'pippo' * 8)] * 8)
+    io_loop = IOLoop.current()
+    for name, codec, schema in (('json', JsonCodec, None), ('binary', BinaryCodec, Schema.current())):
+        # 8 seats, and spectators
+        for size in (8, 32, 128):
+            clients = audience(size, codec, schema)
+            for send_name, send in (('one by one', one_by_one), ('broadcast', broadcast)):
+                async def run():
+                    start = perf_counter()
+                    for _ in range(modifications):
+                        await send(clients, modification)
+                    return perf_counter() - start
+                elapsed = io_loop.run_sync(run)
+                print('{:<6} {:3} clients {:<10} {:7.1f}us per modification, {:5.2f}us per client'.format(
+                    name, size, send_name, elapsed / modifications * 1e6, elapsed / modifications / size * 1e6))
+
+
+if __name__ == '__main__':
+    bench()
+    bench_projections()
@@ -0,0 +1,61 @@
+"""Benchmark: payload size and encode/decode time of the available codecs"""
+from timeit import repeat
+
+from bogascore.communication.message import ChoiceMessage, InfoMessage, MultiMessage, ChoiceResponseMessage, Message
+from bogascore.elements import NumberResult
+from bogascore.environment import ChangeElementModification, NewElementModification, PlayerWinsModification, Player
+from bogascore.serialization.codec import AvailableCodecs
+from bogasserver.utilsmessages import ServerKeysMessage, IntroductionMessage, ClientKeyMessage
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+
+def message_mix():
+    """A game session worth of messages, handshake included."""
+    roll = NumberResult('roll', 17, ('die_roll', 'number'), (0, 0))
+    mix = [
+        IntroductionMessage('test_user', 'BINARY'),
+        ServerKeysMessage(bytes(range(32)), b''),
+        ClientKeyMessage(bytes(range(32, 64))),
+        InfoMessage('Welcome!'),
+        ChoiceMessage('What would you like to do?', ('new_game', 'join_game')),
+        ChoiceResponseMessage('new_game'),
+        NewElementModification(NumberResult, tuple((k, getattr(roll, k)) for k, _ in NumberResult.members)),
+        PlayerWinsModification([Player('pippo')]),
+        MultiMessage([InfoMessage('Your turn.'), ChoiceMessage('Odd or even?', ('odd', 'even'))]),
+    ]
+    mix += [ChangeElementModification(NumberResult, 'roll', [('number', i)]) for i in range(20)]
+    return mix
+
+
+def timeit(stmt, number: int) -> float:
+    return min(repeat(stmt, number=number, repeat=5))
+
+
+def bench(number: int = 1000) -> None:
+    messages = message_mix()
+    data = [m.serialize() for m in messages]
+    for available in AvailableCodecs:
+        codec = available.get_codec()
+        encoded = [codec.encode(d) for d in data]
+        size = sum(len(e) for e in encoded)
+        encode_time = timeit(lambda: [codec.encode(d) for d in data], number=number)
+        decode_time = timeit(lambda: [codec.decode(e) for e in encoded], number=number)
+        # Whole path, from Message to bytes and back
+        full_encode_time = timeit(lambda: [codec.encode(m.serialize()) for m in messages], number=number)
+        full_decode_time = timeit(lambda: [Message.parse_message(codec.decode(e)) for e in encoded], number=number)
+        print('{:<8} {:6d} bytes  codec encode: {:5.2f}us/msg  decode: {:5.2f}us/msg  '
+              'with (de)serialization encode: {:5.2f}us/msg  decode: {:5.2f}us/msg'.format(
+                  available.name, size,
+                  encode_time / number / len(data) * 1e6, decode_time / number / len(data) * 1e6,
+                  full_encode_time / number / len(data) * 1e6, full_decode_time / number / len(data) * 1e6))
+
+
+if __name__ == '__main__':
+    bench()
@@ -0,0 +1,56 @@
+"""Benchmark: receiving pipelined frames from a socket"""
+import socket
+from time import perf_counter
+
+from tornado.ioloop import IOLoop
+from tornado.iostream import IOStream
+
+from bogascore.communication.connection import SocketConnection, Framing
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+
+async def read_bytes_receive(stream: IOStream) -> bytes:
+    """How SocketConnection.receive used to read frames: two awaits per frame."""
+    length = int.from_bytes(await stream.read_bytes(2), 'big')
+    return await stream.read_bytes(length)
+
+
+def bench(frames: int = 50000, size: int = 60) -> None:
+    data = (Framing.LEGACY.header(size) + bytes(size)) * frames
+
+    async def run(receive) -> float:
+        a, b = socket.socketpair()
+        sender, receiver = IOStream(a), IOStream(b)
+        connection = SocketConnection(receiver, Framing.LEGACY)
+        sender.write(data)
+        start = perf_counter()
+        for _ in range(frames):
+            await receive(connection)
+        elapsed = perf_counter() - start
+        sender.close()
+        receiver.close()
+        return elapsed
+
+    async def frame_reader(connection: SocketConnection):
+        return await connection.reader.next_frame()
+
+    async def old(connection: SocketConnection):
+        return await read_bytes_receive(connection.stream)
+
+    async def new(connection: SocketConnection):
+        return await connection.receive()
+
+    for name, receive in (('read_bytes', old), ('receive', new), ('next_frame', frame_reader)):
+        elapsed = min(IOLoop.current().run_sync(lambda: run(receive)) for _ in range(3))
+        print('{:<12} {:6.2f}us/frame'.format(name, elapsed / frames * 1e6))
+
+
+if __name__ == '__main__':
+    bench()
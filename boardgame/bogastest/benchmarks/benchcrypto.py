@@ -0,0 +1,45 @@
+"""Benchmark: per message Box encryption against session mode"""
+from time import perf_counter
+
+from bogasserver.security import Crypto, session_random
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+
+def pair(session: bool):
+    sender, receiver = Crypto(Crypto.get_public_key()), Crypto(Crypto.get_public_key())
+    if session:
+        client_random, server_random = session_random(), session_random()
+        sender.start_session(client_random, server_random, is_client=True)
+        receiver.start_session(client_random, server_random, is_client=False)
+    return sender, receiver
+
+
+def bench(messages: int = 20000) -> None:
+    for size in (64, 1024, 16 * 1024):
+        message = bytes(size)
+        for name, session in (('box', False), ('session', True)):
+            best = None
+            for _ in range(3):
+                sender, receiver = pair(session)
+                start = perf_counter()
+                encrypted = [sender.encrypt(message) for _ in range(messages)]
+                encrypt_time = perf_counter() - start
+                start = perf_counter()
+                for m in encrypted:
+                    receiver.decrypt(m)
+                decrypt_time = perf_counter() - start
+                if best is None or encrypt_time + decrypt_time < sum(best):
+                    best = (encrypt_time, decrypt_time)
+            print('{:>6}B {:<8} encrypt {:6.2f}us decrypt {:6.2f}us overhead {:2}B'.format(
+                size, name, best[0] / messages * 1e6, best[1] / messages * 1e6, len(encrypted[0]) - size))
+
+
+if __name__ == '__main__':
+    bench()
@@ -0,0 +1,64 @@
+"""Benchmark: finding elements through the indexes against scanning them, and changing them"""
+from time import perf_counter
+
+from bogascore.elements.die import Die
+from bogascore.environment import ChangeElementModification, Environment, EnvironmentElements
+from bogastest.bogascore.testenvironment import Piece
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+
+def elements(size: int, indexes=()) -> EnvironmentElements:
+    result = EnvironmentElements(indexes)
+    for i in range(size):
+        result.add(Piece('piece{}'.format(i), 'player{}'.format(i % 8), 'square{}'.format(i % 64)))
+    return result
+
+
+def bench(queries: int = 2000) -> None:
+    for size in (1000, 10000, 100000):
+        for name, indexes in (('scan', ()), ('indexed', ('owner', 'location'))):
+            env_elements = elements(size, indexes)
+            start = perf_counter()
+            for i in range(queries):
+                found = env_elements.find(Piece, owner='player{}'.format(i % 8), location='square{}'.format(i % 64))
+            elapsed = perf_counter() - start
+            start = perf_counter()
+            for i in range(100):
+                env_elements.add(Piece('piece{}'.format(i), 'player{}'.format(i % 7), 'square0'))
+            add_time = (perf_counter() - start) / 100
+            print('{:6} elements {:<8} {:9.2f}us per query ({} found), {:5.2f}us per replacement'.format(
+                size, name, elapsed / queries * 1e6, len(found), add_time * 1e6))
+
+
+class RebuiltDie(Die):
+    """Die rebuilt on every change, as all elements used to be."""
+
+    patchable = False
+
+
+def bench_changes(changes: int = 100000) -> None:
+    for name, cls, copy_on_write in (('rebuilt', RebuiltDie, False), ('in place', Die, False),
+                                     ('copy on write', Die, True)):
+        env = Environment(lambda e: None, [], copy_on_write=copy_on_write)
+        for i in range(1000):
+            env.elements.add(cls('die{}'.format(i), 6, 1))
+        modifications = [ChangeElementModification(cls, 'die{}'.format(i % 1000), [('number', i % 6 + 1)])
+                         for i in range(changes)]
+        start = perf_counter()
+        for modification in modifications:
+            modification.apply(env)
+        elapsed = perf_counter() - start
+        print('{} changes {:<13} {:6.3f}s, {:5.2f}us per change'.format(
+            changes, name, elapsed, elapsed / changes * 1e6))
+
+
+if __name__ == '__main__':
+    bench()
+    bench_changes()
@@ -0,0 +1,66 @@
+"""Benchmark: forking environments sharing their elements against copying all of them"""
+from time import perf_counter
+
+from bogascore.elements.die import Die
+from bogascore.environment import ChangeElementModification, Environment, EnvironmentElements
+from bogastest.bogascore.testenvironment import Piece
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+
+def environment(size: int) -> Environment:
+    env = Environment(lambda e: None, [], indexes=('owner',))
+    for i in range(size):
+        env.elements.add(Piece('piece{}'.format(i), 'player{}'.format(i % 4), 'a{}'.format(i % 64)))
+    env.elements.add(Die('die', 6, 3))
+    return env
+
+
+def full_copy(env: Environment) -> EnvironmentElements:
+    """Elements copied one by one, as frozen elements cannot be deep copied."""
+    elements = EnvironmentElements(('owner',))
+    for element in env.elements.get_by_class('Element'):
+        elements.add(element.copy())
+    return elements
+
+
+def timed(function, repetitions: int) -> float:
+    start = perf_counter()
+    for _ in range(repetitions):
+        function()
+    return (perf_counter() - start) / repetitions
+
+
+def changes(env: Environment, count: int) -> float:
+    """Change the indexed owner of count pieces, each once."""
+    modifications = [ChangeElementModification(Piece, 'piece{}'.format(i), [('owner', 'player9')])
+                     for i in range(count)]
+    start = perf_counter()
+    for modification in modifications:
+        modification.apply(env)
+    return (perf_counter() - start) / count
+
+
+def bench(count: int = 1000) -> None:
+    for size in (1000, 10000, 100000):
+        env = environment(size)
+        owned = changes(env, count)
+        copied = timed(lambda: full_copy(env), 1)
+        fork = timed(env.fork, 1000)
+        print('{:6} elements copy {:12.1f}us fork {:6.2f}us'.format(size, copied * 1e6, fork * 1e6))
+        # Changes after a fork copy the elements first
+        forked = changes(env.fork(), count)
+        print('{:6} elements change owned {:6.2f}us forked {:6.2f}us'.format(size, owned * 1e6, forked * 1e6))
+        snapshot = env.snapshot()
+        restore = timed(lambda: env.restore(snapshot), 1000)
+        print('{:6} elements restore {:6.2f}us'.format(size, restore * 1e6))
+
+
+if __name__ == '__main__':
+    bench()
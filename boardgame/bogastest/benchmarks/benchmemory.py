@@ -0,0 +1,53 @@
+"""Memory benchmark: slotted Elements against Elements carrying a __dict__"""
+import sys
+import tracemalloc
+
+from bogascore.elements import Element, NumberResult
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+
+class DictElement(Element):
+    """Element as it was before SerializableMeta built real slots."""
+
+    __slots__ = ('__dict__',)
+
+
+class DictNumberResult(NumberResult):
+    """NumberResult as it was before SerializableMeta built real slots."""
+
+    __slots__ = ('__dict__',)
+
+
+def measure(cls, count: int, *args) -> int:
+    identifiers = ['element_{}'.format(i) for i in range(count)]
+    tracemalloc.start()
+    elements = [cls(identifier, *args) for identifier in identifiers]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del elements
+    return size
+
+
+def bench(count: int = 1000000) -> None:
+    cases = (
+        (DictElement, Element, ()),
+        (DictNumberResult, NumberResult, (3, ('die_roll',), (0,))),
+    )
+    for before, after, args in cases:
+        before_size = measure(before, count, *args)
+        after_size = measure(after, count, *args)
+        print('{} x {:<14} {:8.1f} MiB -> {:8.1f} MiB ({:5.1f} -> {:5.1f} bytes each)'.format(
+            count, after.__name__,
+            before_size / 2 ** 20, after_size / 2 ** 20,
+            before_size / count, after_size / count))
+
+
+if __name__ == '__main__':
+    bench(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,84 @@
+"""Benchmark: reconnection with a full handshake against resumption with a ticket"""
+import asyncio
+from time import perf_counter
+
+from tornado.ioloop import IOLoop
+
+import bogasclient.client
+from bogascore.communication.client import ClientDetails
+from bogascore.communication.connection import Connection
+from bogasserver.keystore import KeyStore
+from bogasserver.server import Lobby
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+
+class DelayedConnection(Connection):
+    """Client end of a connection, its messages reaching the server after latency seconds."""
+
+    def __init__(self, connection: Connection, latency: float) -> None:
+        self.connection = connection
+        self.carries_objects = connection.carries_objects
+        self.latency = latency
+
+    async def send(self, message) -> None:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        await self.connection.send(message)
+
+    async def receive(self):
+        return await self.connection.receive()
+
+
+class TimedLobby(Lobby):
+    """Lobby recording how long accepting each connection took, not welcoming clients."""
+
+    def __init__(self, io_loop: IOLoop, key_store: KeyStore = None) -> None:
+        super(TimedLobby, self).__init__(io_loop, key_store)
+        self.times = []
+
+    async def accept_connection(self, connection: Connection, client_details: ClientDetails):
+        start = perf_counter()
+        await super(TimedLobby, self).accept_connection(connection, client_details)
+        self.times.append(perf_counter() - start)
+
+    async def welcome_client(self, client):
+        pass
+
+
+async def reconnect(lobby: TimedLobby, resume: bool, latency: float, reconnections: int) -> float:
+    """Return the average time the lobby took to accept a reconnecting client."""
+    client = bogasclient.client.Client(lobby.connect_direct(False), session=True)
+    await client.login()
+    # Not welcomed, only the ticket is sent after the login
+    ticket = (await client._receive()).ticket
+    lobby.times.clear()
+    for i in range(reconnections):
+        client.ticket = ticket if resume else b''
+        await client.resume(DelayedConnection(lobby.connect_direct(False), latency))
+        while len(lobby.times) <= i:
+            await asyncio.sleep(0)
+        # Skip the new ticket
+        await client._receive()
+    return sum(lobby.times) / len(lobby.times)
+
+
+def bench(reconnections: int = 500) -> None:
+    io_loop = IOLoop.current()
+    for latency in (0, 0.002):
+        # Unknown users send their key, known ones are looked up in the key store
+        for name, key_store, resume in (('unknown', None, False), ('known', KeyStore(), False),
+                                        ('resumed', None, True)):
+            lobby = TimedLobby(io_loop, key_store)
+            mean = io_loop.run_sync(lambda: reconnect(lobby, resume, latency, reconnections))
+            print('latency {:4.1f}ms {:<8} {:8.1f}us per reconnection'.format(latency * 1e3, name, mean * 1e6))
+
+
+if __name__ == '__main__':
+    bench()
@@ -0,0 +1,42 @@
+"""Microbenchmark: generated (de)serializers against the reference implementation"""
+from timeit import timeit
+
+from bogascore.communication.message import ChoiceMessage
+from bogascore.elements import NumberResult
+from bogascore.environment import ChangeElementModification
+from bogascore.serialization.serialization import Serializable
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+SAMPLES = (
+    ChangeElementModification(NumberResult, 'roll', [('number', 12)]),
+    ChoiceMessage('What would you like to do?', ('new_game', 'join_game')),
+    NumberResult('roll', 12, ('die_roll', 'number'), (0, 0)),
+)
+
+
+def bench(number: int = 100000) -> None:
+    reference_deserialize = Serializable.deserialize.__func__
+    for sample in SAMPLES:
+        cls = type(sample)
+        data = sample.serialize()
+        assert Serializable.serialize(sample) == data
+        reference_s = timeit(lambda: Serializable.serialize(sample), number=number)
+        compiled_s = timeit(sample.serialize, number=number)
+        reference_d = timeit(lambda: reference_deserialize(cls, data), number=number)
+        compiled_d = timeit(lambda: cls.deserialize(data), number=number)
+        print('{:<28} serialize: {:6.3f}us -> {:6.3f}us (x{:.2f})  '
+              'deserialize: {:6.3f}us -> {:6.3f}us (x{:.2f})'.format(
+                  cls.__name__,
+                  reference_s / number * 1e6, compiled_s / number * 1e6, reference_s / compiled_s,
+                  reference_d / number * 1e6, compiled_d / number * 1e6, reference_d / compiled_d))
+
+
+if __name__ == '__main__':
+    bench()
@@ -0,0 +1,98 @@
+"""Benchmark: messages per second and memory per connection of the server backends"""
+import socket
+import tracemalloc
+from asyncio import get_event_loop, sleep
+from time import perf_counter
+
+from tornado.ioloop import IOLoop
+from tornado.iostream import IOStream, StreamClosedError
+
+from bogascore.communication.connection import Framing, Connection, SocketConnection
+from bogasserver.asyncioserver import AsyncioServer
+from bogasserver.server import Lobby
+from bogasserver.tornadowrapper import TornadoTCPServer
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+PORT = 30646
+
+
+class CountingLobby(Lobby):
+    """Receives messages, answering every batch of them with a single one."""
+
+    def __init__(self, batch: int):
+        super().__init__(IOLoop.current())
+        self.batch = batch
+
+    async def accept_new_client(self, stream: IOStream, client_details):
+        await self.accept_connection(SocketConnection(stream), client_details)
+
+    async def accept_connection(self, connection: Connection, client_details):
+        try:
+            while True:
+                for _ in range(self.batch):
+                    await connection.receive()
+                await connection.send(b'ok')
+        except StreamClosedError:
+            pass
+
+
+async def throughput(messages: int, size: int) -> float:
+    """Messages received per second by the server, from a client sending them all at once."""
+    stream = IOStream(socket.socket())
+    await stream.connect(('127.0.0.1', PORT))
+    data = (Framing.LEGACY.header(size) + bytes(size)) * messages
+    start = perf_counter()
+    await stream.write(data)
+    await stream.read_bytes(4)  # The answer
+    elapsed = perf_counter() - start
+    stream.close()
+    return messages / elapsed
+
+
+async def memory(connections: int) -> float:
+    """Server side memory of connections that sent one message."""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    clients = []
+    loop = get_event_loop()
+    for _ in range(connections):
+        client = socket.socket()
+        client.setblocking(False)
+        await loop.sock_connect(client, ('127.0.0.1', PORT))
+        await loop.sock_sendall(client, b'\x00\x05hello')
+        clients.append(client)
+    await sleep(0.5)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    for client in clients:
+        client.close()
+    return sum(stat.size_diff for stat in after.compare_to(before, 'filename')) / connections
+
+
+def bench(messages: int = 50000, size: int = 60, connections: int = 200) -> None:
+    for name, server_class in (('tornado', TornadoTCPServer), ('asyncio', AsyncioServer)):
+        lobby = CountingLobby(messages)
+
+        async def run():
+            server = server_class(lobby, port=PORT)
+            if server_class is AsyncioServer:
+                await server.listen()
+            rate = max([await throughput(messages, size) for _ in range(3)])
+            lobby.batch = 1
+            per_connection = await memory(connections)
+            server.stop()
+            return rate, per_connection
+        rate, per_connection = IOLoop.current().run_sync(run)
+        print('{:<8} {:9.0f} messages/s  {:7.0f} bytes/connection (tracemalloc)'.format(
+            name, rate, per_connection))
+
+
+if __name__ == '__main__':
+    bench()
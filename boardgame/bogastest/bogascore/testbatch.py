@@ -0,0 +1,73 @@
+"""Tests for the columnar serialization of batches"""
+from unittest import TestCase
+
+from bogascore.communication.message import InfoMessage, MultiMessage
+from bogascore.elements import NumberResult
+from bogascore.environment import ChangeElementModification, MultipleModification, NewElementModification
+from bogascore.serialization.codec import BinaryCodec, JsonCodec
+from bogascore.serialization.schema import Schema, RECORD_TAG
+from bogascore.serialization.serialization import COLUMNS_TAG, BATCH_RUN_MIN, TYPE_TAG, LazyBatch, \
+    SerializationException, encode_value
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+
+def turn(n: int) -> MultipleModification:
+    return MultipleModification(
+        [ChangeElementModification(NumberResult, 'roll{}'.format(i), [('number', i)]) for i in range(n)]
+        + [NewElementModification(
+            NumberResult, [('identifier', 'total'), ('number', n), ('classifiers', ('sum',)), ('orders', (0,))])]
+    )
+
+
+class TestBatch(TestCase):
+
+    def test_columns(self):
+        message = turn(10)
+        serialized = message.serialize()
+        block, single = serialized['modifications']
+        self.assertEqual(['ChangeElementModification', 10], block[COLUMNS_TAG][:2])
+        self.assertEqual(['roll{}'.format(i) for i in range(10)], block[COLUMNS_TAG][4])
+        self.assertEqual('NewElementModification', single[TYPE_TAG])
+        decoded = MultipleModification.deserialize(JsonCodec.decode(JsonCodec.encode(serialized)))
+        self.assertIsInstance(decoded.modifications, LazyBatch)
+        self.assertEqual(11, len(decoded.modifications))
+        self.assertIs(NumberResult, decoded.modifications[3].element_class)
+        self.assertEqual(serialized, decoded.serialize())
+        self.assertEqual(message.modifications, decoded.modifications)
+
+    def test_short_runs(self):
+        messages = [InfoMessage(str(i)) for i in range(BATCH_RUN_MIN - 1)]
+        serialized = MultiMessage(messages).serialize()['messages']
+        self.assertTrue(all(x[TYPE_TAG] == 'InfoMessage' for x in serialized))
+        self.assertEqual(messages, MultiMessage.deserialize(MultiMessage(messages).serialize()).messages)
+
+    def test_lazy(self):
+        serialized = turn(6).serialize()
+        serialized['modifications'][0][COLUMNS_TAG][3][4] = 'NoSuchClass'
+        decoded = MultipleModification.deserialize(serialized)
+        self.assertEqual('roll0', decoded.modifications[0].element_id)
+        self.assertEqual('total', decoded.modifications[-1].element.identifier)
+        with self.assertRaises(SerializationException):
+            decoded.modifications[4]
+
+    def test_records(self):
+        schema = Schema.current()
+        message = MultiMessage([InfoMessage('Turn over'), turn(20), InfoMessage('Your turn')])
+        encoded = schema.encode(message)
+        block = encoded[RECORD_TAG][2][1][RECORD_TAG][2][0][COLUMNS_TAG]
+        self.assertEqual([schema.ids[ChangeElementModification], 20], block[:2])
+        self.assertEqual([schema.ids[NumberResult]] * 20, block[3])
+        decoded = schema.decode_message(BinaryCodec.decode(BinaryCodec.encode(encoded)))
+        self.assertEqual(message.serialize(), decoded.serialize())
+
+    def test_smaller(self):
+        message = turn(100)
+        unbatched = [encode_value(m) for m in message.modifications]
+        self.assertLess(len(JsonCodec.encode(message.serialize())), len(JsonCodec.encode(unbatched)) * 0.6)
@@ -0,0 +1,100 @@
+"""Tests for the broadcast of messages to many clients"""
+from unittest import TestCase
+
+from tornado.ioloop import IOLoop
+
+from bogascore.communication.client import Client, ClientDetails, broadcast
+from bogascore.communication.connection import direct_connection_pair
+from bogascore.communication.message import InfoMessage, Message
+from bogascore.environment import Environment, NewElementModification
+from bogascore.serialization.codec import JsonCodec, BinaryCodec
+from bogascore.serialization.schema import Schema
+from bogasserver.security import Crypto
+from bogastest.bogascore.testserialization import Token
+from bogastest.connections import CountingCodec, RecordingConnection
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+
+class TestBroadcast(TestCase):
+
+    def setUp(self):
+        CountingCodec.encoded = 0
+
+    def client(self, codec=CountingCodec, schema=None, fail=False, **kwargs) -> Client:
+        crypto = Crypto(Crypto.get_public_key())
+        return Client(RecordingConnection(fail=fail), ClientDetails(), codec, 'user', crypto, schema, **kwargs)
+
+    def received(self, client: Client) -> list:
+        codec = JsonCodec if client.codec is CountingCodec else client.codec
+        decoded = [codec.decode(client.crypto.decrypt(m)) for m in client.connection.sent]
+        if client.schema is not None:
+            return [client.schema.decode_message(d) for d in decoded]
+        return [Message.parse_message(d) for d in decoded]
+
+    def test_encoded_once(self):
+        clients = [self.client() for _ in range(10)]
+        failures = IOLoop.current().run_sync(lambda: broadcast(clients, InfoMessage('hello')))
+        self.assertEqual([], failures)
+        self.assertEqual(1, CountingCodec.encoded)
+        for client in clients:
+            self.assertEqual(['hello'], [m.text for m in self.received(client)])
+
+    def test_codecs(self):
+        schema = Schema.current()
+        clients = [self.client(), self.client(BinaryCodec), self.client(BinaryCodec, schema),
+                   self.client(JsonCodec, schema), self.client(coalesce_us=1000), self.client(high_watermark=1024)]
+        message = InfoMessage('hello')
+
+        async def run():
+            failures = await broadcast(clients, message)
+            await clients[4].flush_buffer()
+            await clients[5].queue.join()
+            return failures
+        self.assertEqual([], IOLoop.current().run_sync(run))
+        for client in clients:
+            self.assertEqual(['hello'], [m.text for m in self.received(client)])
+
+    def test_objects(self):
+        client_end, server_end = direct_connection_pair(True)
+        client = Client(server_end, ClientDetails(), JsonCodec, 'user', None)
+        message = InfoMessage('hello')
+
+        async def run():
+            await broadcast([client], message)
+            return await client_end.receive()
+        self.assertIs(message, IOLoop.current().run_sync(run))
+
+    def test_failures(self):
+        clients = [self.client(), self.client(fail=True), self.client()]
+        failures = IOLoop.current().run_sync(lambda: broadcast(clients, InfoMessage('hello')))
+        self.assertEqual([clients[1]], [client for client, _ in failures])
+        self.assertIsInstance(failures[0][1], IOError)
+        self.assertEqual(['hello'], [m.text for m in self.received(clients[2])])
+
+
+class TestEnvironmentBroadcast(TestCase):
+
+    def test_accept(self):
+        clients = [Client(RecordingConnection(), ClientDetails(), CountingCodec, 'user', Crypto(Crypto.get_public_key()))
+                   for _ in range(8)]
+        CountingCodec.encoded = 0
+        env = Environment(lambda e: None, clients)
+
+        async def run():
+            return await env.accept(NewElementModification(Token, [('identifier', 'token'), ('owner', 'pippo')]))
+        self.assertEqual([], IOLoop.current().run_sync(run))
+        self.assertEqual('pippo', env.elements['token'].owner)
+        self.assertEqual(1, CountingCodec.encoded)
+        for client in clients:
+            self.assertEqual(1, len(client.connection.sent))
+
+    def test_no_clients(self):
+        env = Environment(lambda e: None, [])
+        self.assertIsNone(env.accept(NewElementModification(Token, [('identifier', 'token'), ('owner', 'pippo')])))
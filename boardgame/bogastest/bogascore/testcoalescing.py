@@ -0,0 +1,125 @@
+"""Tests for the coalescing of the messages sent to clients"""
+from asyncio import sleep
+from unittest import TestCase
+
+from tornado.ioloop import IOLoop
+
+import bogasclient.client
+from bogascore.communication.client import Client, ClientDetails
+from bogascore.communication.message import InfoMessage, Message, MultiMessage, ChoiceResponseMessage
+from bogascore.serialization.codec import JsonCodec
+from bogasserver.security import Crypto
+from bogastest.connections import CountingCodec, RecordingConnection
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+
+class TestCoalescing(TestCase):
+
+    def setUp(self):
+        self.crypto = Crypto(Crypto.get_public_key())
+        self.connection = RecordingConnection()
+
+    def client(self, **kwargs) -> Client:
+        return Client(self.connection, ClientDetails(), JsonCodec, 'test_user', self.crypto, **kwargs)
+
+    def sent(self) -> list:
+        return [Message.parse_message(JsonCodec.decode(self.crypto.decrypt(m))) for m in self.connection.sent]
+
+    def test_disabled(self):
+        client = self.client()
+
+        async def run():
+            for i in range(3):
+                await client.send(InfoMessage(str(i)))
+        IOLoop.current().run_sync(run)
+        self.assertEqual(['0', '1', '2'], [m.text for m in self.sent()])
+
+    def test_timer(self):
+        client = self.client(coalesce_us=2000)
+
+        async def run():
+            for i in range(10):
+                await client.send(InfoMessage(str(i)))
+            self.assertEqual([], self.connection.sent)
+            await sleep(0.05)
+        IOLoop.current().run_sync(run)
+        multi, = self.sent()
+        self.assertIsInstance(multi, MultiMessage)
+        self.assertEqual([str(i) for i in range(10)], [m.text for m in multi.messages])
+
+    def test_encoded_once(self):
+        CountingCodec.encoded = 0
+        client = Client(self.connection, ClientDetails(), CountingCodec, 'test_user', self.crypto, coalesce_us=10 ** 6)
+
+        async def run():
+            for i in range(10):
+                await client.send(InfoMessage(str(i)))
+            await client.flush_buffer()
+            await client.send(InfoMessage('alone'))
+            await client.flush_buffer()
+        IOLoop.current().run_sync(run)
+        self.assertEqual(2, CountingCodec.encoded)
+        multi, alone = self.sent()
+        self.assertEqual([str(i) for i in range(10)], [m.text for m in multi.messages])
+        self.assertEqual('alone', alone.text)
+
+    def test_size(self):
+        client = self.client(coalesce_us=10 ** 6, coalesce_bytes=1000)
+
+        async def run():
+            for i in range(100):
+                await client.send(InfoMessage('message {}'.format(i)))
+        IOLoop.current().run_sync(run)
+        sent = self.sent()
+        self.assertGreater(len(sent), 1)
+        self.assertLess(len(sent), 20)
+        self.assertTrue(all(len(m) <= 1500 for m in self.connection.sent[1:]))
+        self.assertEqual(100 - len(client.buffer), sum(len(m.messages) for m in sent))
+
+    def test_large_burst(self):
+        client = self.client(coalesce_us=10 ** 6, coalesce_bytes=1000)
+
+        async def run():
+            for i in range(20):
+                await client.send(InfoMessage(str(i) * 300))
+            await client.send(InfoMessage('x' * 2000))
+            await client.flush_buffer()
+        IOLoop.current().run_sync(run)
+        # Bounded from the first message on, by their real size
+        self.assertTrue(all(len(m) <= 1100 for m in self.connection.sent[:-1]))
+        texts = []
+        for message in self.sent():
+            if isinstance(message, MultiMessage):
+                texts.extend(m.text for m in message.messages)
+            else:
+                texts.append(message.text)
+        self.assertEqual([str(i) * 300 for i in range(20)] + ['x' * 2000], texts)
+
+    def test_receive_flushes(self):
+        self.connection.responses.append(self.crypto.encrypt(JsonCodec.encode(ChoiceResponseMessage('odd').serialize())))
+        client = self.client(coalesce_us=10 ** 6)
+
+        async def run():
+            await client.send(InfoMessage('Odd or even?'))
+            return await client.receive(ChoiceResponseMessage)
+        self.assertEqual('odd', IOLoop.current().run_sync(run).choice)
+        self.assertEqual(['Odd or even?'], [m.text for m in self.sent()])
+
+    def test_unpacked(self):
+        multi = MultiMessage([InfoMessage('a'), InfoMessage('b')])
+        connection = RecordingConnection(responses=[
+            self.crypto.encrypt(JsonCodec.encode(m.serialize())) for m in (multi, InfoMessage('c'))
+        ])
+        client = bogasclient.client.Client(connection)
+        client.crypto = self.crypto
+
+        async def run():
+            return [(await client.receive()).text for _ in range(3)]
+        self.assertEqual(['a', 'b', 'c'], IOLoop.current().run_sync(run))
@@ -0,0 +1,88 @@
+"""Tests for codecs"""
+from unittest import TestCase
+
+from bogascore.communication.message import Message, MultiMessage, InfoMessage, ChoiceMessage
+from bogascore.elements import NumberResult
+from bogascore.environment import ChangeElementModification
+from bogascore.serialization.codec import BinaryCodec, JsonCodec, AvailableCodecs, estimate_size
+from bogasserver.utilsmessages import ServerKeysMessage, IntroductionMessage
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+
+class TestBinaryCodec(TestCase):
+
+    def test_primitives(self):
+        values = [
+            None, True, False, 0, 127, 128, -1, 2 ** 70, -2 ** 70, 1.5, '', 'héllo', 'x' * 300,
+            b'', bytes(range(256)), [], list(range(20)), {}, {str(i): i for i in range(20)},
+        ]
+        for value in values:
+            self.assertEqual(value, BinaryCodec.decode(BinaryCodec.encode(value)))
+        self.assertEqual([[1, 2], [3]], BinaryCodec.decode(BinaryCodec.encode(((1, 2), {3}))))
+
+    def test_messages(self):
+        messages = [
+            ServerKeysMessage(bytes(range(32)), b''),
+            ChangeElementModification(NumberResult, 'roll', [('number', 300)]),
+            MultiMessage([InfoMessage('Welcome!'), ChoiceMessage('Odd or even?', ('odd', 'even'))]),
+        ]
+        for message in messages:
+            decoded = Message.parse_message(BinaryCodec.decode(BinaryCodec.encode(message.serialize())))
+            self.assertEqual(message.serialize(), decoded.serialize())
+        self.assertEqual(bytes(range(32)), decoded_key(BinaryCodec))
+
+    def test_smaller_than_json(self):
+        data = ServerKeysMessage(bytes(range(32)), b'').serialize()
+        self.assertLess(len(BinaryCodec.encode(data)), len(JsonCodec.encode(data)))
+
+    def test_malformed(self):
+        encoded = BinaryCodec.encode({'text': 'x' * 100})
+        for data in (encoded[:-1], encoded + b'\x00', b'\xff'):
+            with self.assertRaises(ValueError):
+                BinaryCodec.decode(data)
+        with self.assertRaises(TypeError):
+            BinaryCodec.encode({'value': object()})
+
+    def test_negotiated_by_name(self):
+        self.assertIs(BinaryCodec, IntroductionMessage('test_user', 'BINARY').get_codec())
+        self.assertIs(BinaryCodec, AvailableCodecs['BINARY'].get_codec())
+
+
+class TestJsonCodec(TestCase):
+
+    def test_bytes_as_base64(self):
+        encoded = JsonCodec.encode(ServerKeysMessage(b'\x00' * 40, b'').serialize())
+        self.assertEqual(b'{"msg_type": "ServerKeysMessage", '
+                         b'"server_key": "AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA==", '
+                         b'"client_key": "", "schema": "", "compression": "", "session": ""}', encoded)
+        self.assertEqual(bytes(range(32)), decoded_key(JsonCodec))
+
+
+class TestEstimateSize(TestCase):
+
+    def test_bounds_encoded_size(self):
+        messages = [
+            InfoMessage('Welcome!'),
+            InfoMessage('héllo ' * 50),
+            ServerKeysMessage(bytes(range(32)), b''),
+            ChangeElementModification(NumberResult, 'roll', [('number', -2 ** 40), ('ratio', 0.5)]),
+            MultiMessage([InfoMessage('Welcome!'), ChoiceMessage('Odd or even?', ('odd', 'even'))]),
+        ]
+        for message in messages:
+            data = message.serialize()
+            json_size = len(JsonCodec.encode(data))
+            self.assertGreaterEqual(estimate_size(data), json_size)
+            self.assertLessEqual(estimate_size(data), 1.5 * json_size)
+            self.assertGreaterEqual(estimate_size(data), len(BinaryCodec.encode(data)))
+
+
+def decoded_key(codec) -> bytes:
+    encoded = codec.encode(ServerKeysMessage(bytes(range(32)), b'').serialize())
+    return ServerKeysMessage.deserialize(codec.decode(encoded)).server_key
@@ -0,0 +1,119 @@
+"""Tests for compression with preset dictionaries"""
+import zlib
+from io import BytesIO
+from unittest import TestCase
+
+from nacl.public import PrivateKey
+from tornado.ioloop import IOLoop
+
+from bogascore.communication.client import ClientBuilder, ClientDetails
+from bogascore.communication.connection import FakeConnection, MAX_FRAME_SIZE
+from bogascore.communication.message import InfoMessage, Message
+from bogascore.elements import NumberResult
+from bogascore.environment import ChangeElementModification, MultipleModification
+from bogascore.serialization.codec import BinaryCodec, JsonCodec
+from bogascore.serialization.compression import compressed, register_dictionary, CompressedCodec
+from bogascore.serialization.zdict import recording, read_corpus, train
+from bogasserver.utilsmessages import IntroductionMessage, ServerKeysMessage
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+
+def game_messages(seed: int, n: int):
+    for i in range(seed, seed + n):
+        yield MultipleModification([
+            ChangeElementModification(NumberResult, 'player{}_roll'.format(i % 7), [('number', i * 13 % 97)]),
+            ChangeElementModification(NumberResult, 'player{}_total'.format(i % 7), [('number', i)]),
+        ])
+        yield InfoMessage('Player {} rolled a {}.'.format(i % 7, i * 13 % 97))
+
+
+def record(codec, messages) -> list:
+    corpus = BytesIO()
+    recorder = recording(codec, corpus)
+    for message in messages:
+        recorder.encode(message.serialize())
+    corpus.seek(0)
+    return list(read_corpus(corpus))
+
+
+class TestCompression(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.dictionary = register_dictionary(train(record(JsonCodec, game_messages(0, 100))))
+        cls.no_dictionary = register_dictionary(b'')
+
+    def test_round_trip(self):
+        for codec in (JsonCodec, BinaryCodec):
+            wrapper = compressed(codec, self.dictionary)
+            self.assertTrue(issubclass(wrapper, CompressedCodec))
+            self.assertIs(wrapper, compressed(codec, self.dictionary))
+            for message in game_messages(1000, 5):
+                decoded = Message.parse_message(wrapper.decode(wrapper.encode(message.serialize())))
+                self.assertEqual(message.serialize(), decoded.serialize())
+
+    def test_threshold(self):
+        small = InfoMessage('Hi!').serialize()
+        self.assertEqual(b'\x00' + JsonCodec.encode(small), compressed(JsonCodec, self.dictionary).encode(small))
+        large = next(game_messages(1000, 1)).serialize()
+        self.assertEqual(1, compressed(JsonCodec, self.dictionary).encode(large)[0])
+        self.assertEqual(b'\x00' + JsonCodec.encode(large), compressed(JsonCodec, self.dictionary, 10000).encode(large))
+
+    def test_bomb(self):
+        wrapper = compressed(JsonCodec, self.no_dictionary)
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+        bomb = b'\x01' + compressor.compress(b' ' * (MAX_FRAME_SIZE + 1)) + compressor.flush()
+        self.assertLess(len(bomb), MAX_FRAME_SIZE // 100)
+        with self.assertRaises(ValueError):
+            wrapper.decode(bomb)
+        # Up to the limit
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+        data = JsonCodec.encode(InfoMessage('Hi!' * 1000).serialize())
+        self.assertEqual(data, wrapper._decompress(b'\x01' + compressor.compress(data) + compressor.flush()))
+
+    def test_dictionary_helps(self):
+        held_out = [m.serialize() for m in game_messages(1000, 50)]
+        with_dictionary = compressed(JsonCodec, self.dictionary, 0)
+        without_dictionary = compressed(JsonCodec, self.no_dictionary, 0)
+        size = sum(len(with_dictionary.encode(d)) for d in held_out)
+        self.assertLess(size, sum(len(without_dictionary.encode(d)) for d in held_out) * 0.7)
+        self.assertLess(size, sum(len(JsonCodec.encode(d)) for d in held_out) * 0.5)
+
+
+class TestCompressionNegotiation(TestCase):
+
+    def handshake(self, compression: str) -> ClientBuilder:
+        introduction = IntroductionMessage('test_user', 'BINARY', compression=compression)
+        connection = FakeConnection([JsonCodec.encode(introduction.serialize())])
+        sent = []
+
+        async def send(message: bytes):
+            sent.append(message)
+        connection.send = send
+        builder = ClientBuilder(connection, ClientDetails())
+
+        async def run():
+            await builder.do_handshake()
+            await builder.exchange_keys(PrivateKey.generate().public_key)
+        IOLoop.current().run_sync(run)
+        # The keys are exchanged before compressing
+        self.assertEqual(builder.compression, ServerKeysMessage.deserialize(BinaryCodec.decode(sent[0])).compression)
+        return builder
+
+    def test_accepted(self):
+        dictionary = register_dictionary(train(record(BinaryCodec, game_messages(0, 20))))
+        builder = self.handshake(dictionary)
+        self.assertEqual(dictionary, builder.compression)
+        self.assertIs(compressed(BinaryCodec, dictionary), builder.build().codec)
+
+    def test_refused(self):
+        builder = self.handshake('0123456789abcdef')
+        self.assertEqual('', builder.compression)
+        self.assertIs(BinaryCodec, builder.build().codec)
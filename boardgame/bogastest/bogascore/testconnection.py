@@ -0,0 +1,136 @@
+"""Tests for socket connections and their framing"""
+import socket
+from asyncio import Future, ensure_future, gather, sleep, wait_for
+from unittest import TestCase
+
+from tornado.ioloop import IOLoop
+from tornado.iostream import IOStream, StreamClosedError
+
+from bogascore.communication.connection import SocketConnection, Framing, FramingException
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+
+class HeaderFailingStream(object):
+    """Stream failing to write the first data, headers, and writing the rest."""
+
+    def __init__(self):
+        self.writes = 0
+
+    def write(self, data: bytes) -> Future:
+        written = Future()
+        if self.writes == 0:
+            written.set_exception(StreamClosedError())
+        else:
+            written.set_result(None)
+        self.writes += 1
+        return written
+
+
+class TestFraming(TestCase):
+
+    def run_pair(self, test, framing: Framing = Framing.LEGACY) -> None:
+        """Run test(client, server) on the two ends of a socket pair."""
+        async def run():
+            a, b = socket.socketpair()
+            client, server = SocketConnection(IOStream(a), framing), SocketConnection(IOStream(b), framing)
+            try:
+                await test(client, server)
+            finally:
+                client.stream.close()
+                server.stream.close()
+        IOLoop.current().run_sync(run)
+
+    def exchange(self, framing: Framing, messages) -> None:
+        async def test(client: SocketConnection, server: SocketConnection):
+            # The server answers the request for a framing when receiving the first message
+            first = ensure_future(server.receive())
+            self.assertEqual(framing, await client.negotiate_framing(framing))
+            await client.send(messages[0])
+            self.assertEqual(messages[0], await first)
+            self.assertEqual(framing, server.framing)
+            for message in messages:
+                # Large messages do not fit the socket buffers: send and receive at once
+                _, received = await gather(client.send(message), server.receive())
+                self.assertEqual(message, bytes(received))
+                _, received = await gather(server.send(message), client.receive())
+                self.assertEqual(message, bytes(received))
+        self.run_pair(test)
+
+    def test_legacy(self):
+        self.exchange(Framing.LEGACY, [b'hello', b'', bytes(65535)])
+
+    def test_negotiated(self):
+        messages = [b'hello', bytes(range(256)) * 300, bytes(5 * 1024 * 1024)]
+        self.exchange(Framing.VARINT, messages)
+        self.exchange(Framing.LONG, messages)
+
+    def test_header_write_fails(self):
+        async def run():
+            connection = SocketConnection(HeaderFailingStream())
+            with self.assertRaises(StreamClosedError):
+                await connection.send(b'hello')
+        IOLoop.current().run_sync(run)
+
+    def test_headers(self):
+        self.assertEqual(b'\x01\x00', Framing.LEGACY.header(256))
+        self.assertEqual(b'\x80\x02', Framing.VARINT.header(256))
+        self.assertEqual(b'\x00\x00\x01\x00', Framing.LONG.header(256))
+        with self.assertRaises(FramingException):
+            Framing.LEGACY.header(65536)
+
+    def test_unknown_framing(self):
+        async def test(client: SocketConnection, server: SocketConnection):
+            await client.stream.write(b'\x00\x00\x09')
+            await client.stream.write(b'\x00\x05hello')
+            self.assertEqual(b'hello', await server.receive())
+            self.assertEqual(b'\x00\x00\x00', await client.stream.read_bytes(3))
+        self.run_pair(test)
+
+    def test_too_late(self):
+        async def test(client: SocketConnection, server: SocketConnection):
+            await client.send(b'hello')
+            with self.assertRaises(FramingException):
+                await client.negotiate_framing(Framing.VARINT)
+        self.run_pair(test)
+
+    def test_pipelined(self):
+        messages = [str(i).encode() * (i % 50) for i in range(2000)] + [bytes(100000), b'last']
+
+        async def test(client: SocketConnection, server: SocketConnection):
+            async def write():
+                await client.stream.write(b''.join(Framing.LONG.header(len(m)) + m for m in messages))
+                client.stream.close()
+            ensure_future(write())
+            received = [bytes(frame) async for frame in server.frames()]
+            self.assertEqual(messages, received)
+        self.run_pair(test, Framing.LONG)
+
+    def test_chunked(self):
+        message = bytes(range(256)) * 1000
+
+        async def test(client: SocketConnection, server: SocketConnection):
+            data = Framing.VARINT.header(len(message)) + message
+            receiving = ensure_future(server.receive())
+            for i in range(0, len(data), 10000):
+                await client.stream.write(data[i:i + 10000])
+                await sleep(0)
+            self.assertEqual(message, await receiving)
+        self.run_pair(test, Framing.VARINT)
+
+    def test_endless_varint(self):
+        async def test(client: SocketConnection, server: SocketConnection):
+            await client.stream.write(b'\x80' * 20000)
+            with self.assertRaises(FramingException):
+                await wait_for(server.receive(), 2)
+        self.run_pair(test, Framing.VARINT)
+        with self.assertRaises(FramingException):
+            Framing.VARINT.parse_header(b'\x80' * 10, 0, 10)
+        self.assertIsNone(Framing.VARINT.parse_header(b'\x80' * 9, 0, 9))
+        self.assertEqual((2 ** 63, 10), Framing.VARINT.parse_header(Framing.VARINT.header(2 ** 63), 0, 10))
@@ -0,0 +1,66 @@
+"""Tests for in-process connections"""
+from unittest import TestCase
+
+from tornado.ioloop import IOLoop
+
+import bogasclient.client
+from bogascore.communication.client import ClientBuilder, ClientDetails
+from bogascore.communication.connection import direct_connection_pair
+from bogascore.communication.message import InfoMessage, ChoiceMessage
+from bogascore.serialization.codec import AvailableCodecs
+from bogasserver.security import Crypto
+from bogasserver.server import Lobby
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+
+class TestDirectConnection(TestCase):
+
+    def session(self, carries_objects: bool):
+        """Log a client in through a direct connection, and send it a message."""
+        client_end, server_end = direct_connection_pair(carries_objects)
+        message = InfoMessage('Welcome!')
+
+        async def server():
+            builder = ClientBuilder(server_end, ClientDetails())
+            await builder.do_handshake()
+            await builder.exchange_keys(None)
+            client = builder.build()
+            await client.send(message)
+            return client
+
+        async def run():
+            IOLoop.current().spawn_callback(server)
+            client = bogasclient.client.Client(client_end, AvailableCodecs.BINARY)
+            await client.login()
+            return client, await client.receive()
+        client, received = IOLoop.current().run_sync(run)
+        return message, client, received
+
+    def test_full_stack(self):
+        message, client, received = self.session(False)
+        self.assertIsNot(message, received)
+        self.assertEqual(message.serialize(), received.serialize())
+        self.assertIsInstance(client.crypto, Crypto)
+
+    def test_objects(self):
+        message, client, received = self.session(True)
+        self.assertIs(message, received)
+
+    def test_lobby(self):
+        lobby = Lobby(IOLoop.current())
+
+        async def run():
+            client = bogasclient.client.Client(lobby.connect_direct())
+            await client.login()
+            return [await client.receive(), await client.receive()]
+        welcome, choice = IOLoop.current().run_sync(run)
+        self.assertEqual('Welcome!', welcome.text)
+        self.assertIsInstance(choice, ChoiceMessage)
+        self.assertIn('test_user', lobby.active_clients)
@@ -0,0 +1,122 @@
+"""Tests for the message dispatcher"""
+import asyncio
+from unittest import TestCase
+
+from tornado.ioloop import IOLoop
+
+import bogasclient.client
+from bogascore.communication.client import ClientBuilder, ClientDetails
+from bogascore.communication.connection import direct_connection_pair
+from bogascore.communication.dispatcher import Dispatcher, DispatcherException
+from bogascore.communication.message import InfoMessage, ChoiceMessage, ChoiceResponseMessage, ChannelMessage
+from bogascore.serialization.codec import AvailableCodecs
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+
+class TestChannelMessage(TestCase):
+
+    def test_serialization(self):
+        message = ChannelMessage(3, 7, InfoMessage('hello'), True)
+        decoded = ChannelMessage.deserialize(message.serialize())
+        self.assertEqual((3, 7, True), (decoded.channel, decoded.correlation, decoded.response))
+        self.assertIsInstance(decoded.message, InfoMessage)
+        self.assertEqual('hello', decoded.message.text)
+        self.assertEqual(InfoMessage.priority, message.priority)
+
+
+class TestDispatcher(TestCase):
+
+    def run_session(self, test, carries_objects: bool = False) -> None:
+        """Run test(server_dispatcher, client_dispatcher) over a logged in direct connection."""
+        client_end, server_end = direct_connection_pair(carries_objects)
+
+        async def server():
+            builder = ClientBuilder(server_end, ClientDetails())
+            await builder.do_handshake()
+            await builder.exchange_keys(None)
+            return builder.build()
+
+        async def run():
+            server_client = asyncio.ensure_future(server())
+            client = bogasclient.client.Client(client_end, AvailableCodecs.BINARY)
+            await client.login()
+            server_dispatcher = Dispatcher(await server_client)
+            client_dispatcher = Dispatcher(client)
+            server_dispatcher.start()
+            client_dispatcher.start()
+            try:
+                await test(server_dispatcher, client_dispatcher)
+            finally:
+                server_dispatcher.stop()
+                client_dispatcher.stop()
+        IOLoop.current().run_sync(run, timeout=10)
+
+    def test_channels(self):
+        async def test(server: Dispatcher, client: Dispatcher):
+            await server.send(InfoMessage('lobby'))
+            await server.channel(1).send(InfoMessage('game 1'))
+            await server.channel(2).send(InfoMessage('game 2'))
+            await server.channel(1).send(ChoiceMessage('move?', ['a', 'b']))
+            # Received out of order, each from its channel
+            self.assertEqual('move?', (await client.channel(1).receive(ChoiceMessage)).description)
+            self.assertEqual('game 2', (await client.channel(2).receive()).text)
+            self.assertEqual('game 1', (await client.channel(1).receive()).text)
+            self.assertEqual('lobby', (await client.receive(InfoMessage)).text)
+        self.run_session(test)
+
+    def test_pipelined_requests(self):
+        async def serve(server: Dispatcher):
+            async for request in server.channel(5).subscribe(ChoiceMessage):
+                await server.respond(request, ChoiceResponseMessage(request.message.choices[-1]))
+
+        async def test(server: Dispatcher, client: Dispatcher):
+            asyncio.ensure_future(serve(server))
+            responses = await asyncio.gather(*(
+                client.channel(5).request(ChoiceMessage(str(i), [str(i)] * 2), ChoiceResponseMessage)
+                for i in range(20)
+            ))
+            self.assertEqual([str(i) for i in range(20)], [r.choice for r in responses])
+            self.assertFalse(client.requests)
+        self.run_session(test)
+
+    def test_objects(self):
+        async def test(server: Dispatcher, client: Dispatcher):
+            message = InfoMessage('hello')
+            await server.channel(1).send(message)
+            self.assertIs(message, await client.channel(1).receive())
+        self.run_session(test, True)
+
+    def test_subscription_backlog(self):
+        async def test(server: Dispatcher, client: Dispatcher):
+            for i in range(3):
+                await server.channel(1).send(InfoMessage(str(i)))
+            await server.channel(1).send(ChoiceMessage('stop', []))
+            await client.channel(1).receive(ChoiceMessage)
+            subscription = client.channel(1).subscribe(InfoMessage)
+            received = []
+            async for envelope in subscription:
+                received.append(envelope.message.text)
+                if len(received) == 3:
+                    subscription.close()
+            self.assertEqual(['0', '1', '2'], received)
+        self.run_session(test)
+
+    def test_read_error(self):
+        async def test(server: Dispatcher, client: Dispatcher):
+            pending = asyncio.ensure_future(client.request(InfoMessage('ping')))
+            await asyncio.sleep(0)
+            # Not encrypted: the client fails to decrypt it
+            await client.client.connection.inbox.put(b'garbage')
+            with self.assertRaises(DispatcherException) as raised:
+                await pending
+            self.assertIsNotNone(raised.exception.__cause__)
+            with self.assertRaises(DispatcherException):
+                await client.receive()
+        self.run_session(test)
@@ -0,0 +1,339 @@
+"""Tests for the indexes of the environment elements"""
+from threading import Thread
+from unittest import TestCase
+
+from tornado.ioloop import IOLoop
+
+from bogascore.elements import Element, NumberResult
+from bogascore.elements.die import Die
+from bogascore.communication.client import Client, ClientDetails
+from bogascore.environment import EnvironmentElements, Environment, Player, NewElementModification, \
+    ChangeElementModification, RemoveElementModification, PlayerWinsModification, PlayerLosesModification
+from bogasserver.security import Crypto
+from bogastest.connections import CountingCodec, RecordingConnection
+from bogastest.bogascore.testserialization import Token
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+
+class Piece(Token):
+
+    members = Token.members + (
+        ('location', str),
+    )
+
+    def __init__(self, identifier: str, owner: str, location: str):
+        super(Piece, self).__init__(identifier, owner)
+        self.location = location
+
+
+class Counter(Element):
+    """Element changed in place, not frozen."""
+
+    members = Element.members + (
+        ('owner', str),
+    )
+
+    patchable = True
+
+    def __init__(self, identifier: str, owner: str):
+        super(Counter, self).__init__(identifier)
+        self.owner = owner
+
+
+class Tally(Element):
+    """Element with state derived from its members, so not patchable."""
+
+    members = Element.members + (
+        ('owner', str),
+    )
+
+    private_members = (
+        'label',
+    )
+
+    def __init__(self, identifier: str, owner: str):
+        super(Tally, self).__init__(identifier)
+        self.owner = owner
+        self.label = '{} of {}'.format(identifier, owner)
+
+
+class TestClassIndex(TestCase):
+
+    def setUp(self):
+        self.elements = EnvironmentElements()
+        self.token = Token('token', 'alice')
+        self.piece = Piece('piece', 'bob', 'a1')
+        self.player = Player('alice')
+        for element in (self.token, self.piece, self.player):
+            self.elements.add(element)
+
+    def test_subclasses(self):
+        self.assertCountEqual([self.token, self.piece], self.elements.get_by_class(Token))
+        self.assertCountEqual([self.token, self.piece], self.elements.get_by_class('Token'))
+        self.assertEqual([self.piece], self.elements.get_by_class(Piece))
+        self.assertCountEqual([self.token, self.piece, self.player], self.elements.get_by_class(Element))
+        self.assertEqual([], self.elements.get_by_class('Unknown'))
+
+    def test_remove(self):
+        self.elements.remove('piece')
+        self.assertNotIn('piece', self.elements)
+        self.assertEqual([self.token], self.elements.get_by_class(Token))
+        self.assertEqual([], self.elements.get_by_class(Piece))
+        self.assertEqual(2, len(self.elements))
+
+    def test_replace(self):
+        token = Token('piece', 'carol')
+        self.elements.add(token)
+        self.assertEqual([], self.elements.get_by_class(Piece))
+        self.assertCountEqual([self.token, token], self.elements.get_by_class(Token))
+
+
+class TestMemberIndexes(TestCase):
+
+    def setUp(self):
+        self.elements = EnvironmentElements(('owner',))
+        for i in range(10):
+            self.elements.add(Piece('piece{}'.format(i), 'alice' if i % 2 else 'bob', 'a{}'.format(i % 3)))
+        self.elements.add(Player('alice'))
+
+    def identifiers(self, elements) -> set:
+        return {element.identifier for element in elements}
+
+    def test_find(self):
+        self.assertEqual({'piece1', 'piece3', 'piece5', 'piece7', 'piece9'},
+                         self.identifiers(self.elements.find(owner='alice')))
+        self.assertEqual({'piece3', 'piece9'}, self.identifiers(self.elements.find(Piece, owner='alice', location='a0')))
+        # Not indexed members are filtered
+        self.assertEqual({'piece0', 'piece3', 'piece6', 'piece9'}, self.identifiers(self.elements.find(location='a0')))
+        self.assertEqual({'alice'}, self.identifiers(self.elements.find(Player)))
+        self.assertEqual([], self.elements.find(owner='carol'))
+
+    def test_maintenance(self):
+        self.elements.add(Piece('piece1', 'carol', 'a1'))
+        self.elements.remove('piece3')
+        self.assertEqual({'piece5', 'piece7', 'piece9'}, self.identifiers(self.elements.find(owner='alice')))
+        self.assertEqual({'piece1'}, self.identifiers(self.elements.find(owner='carol')))
+        self.elements.remove('piece1')
+        self.assertNotIn('carol', self.elements._indexes['owner'])
+
+    def test_index_added_later(self):
+        self.elements.add_index('location')
+        self.assertEqual({'piece1', 'piece4', 'piece7'}, self.identifiers(self.elements.find(location='a1')))
+        self.elements.remove('piece4')
+        self.assertEqual({'piece1', 'piece7'}, self.identifiers(self.elements.find(location='a1')))
+
+    def test_changed_in_place(self):
+        counter = Counter('counter', 'alice')
+        self.elements.add(counter)
+        counter.owner = 'carol'
+        # Added again, indexed by the new value
+        self.elements.add(counter)
+        self.assertEqual([counter], self.elements.find(owner='carol'))
+        self.assertNotIn(counter, self.elements.find(owner='alice'))
+
+
+class TestEnvironmentIndexes(TestCase):
+
+    def test_modifications(self):
+        env = Environment(lambda e: None, [], indexes=('owner',))
+        env.accept(NewElementModification(Token, [('identifier', 'token'), ('owner', 'pippo')]))
+        env.accept(ChangeElementModification(Token, 'token', [('owner', 'pluto')]))
+        self.assertEqual([], env.elements.find(owner='pippo'))
+        self.assertEqual(['token'], [e.identifier for e in env.elements.find(Token, owner='pluto')])
+        env.accept(RemoveElementModification(env.elements['token']))
+        self.assertEqual([], env.elements.find(owner='pluto'))
+        self.assertEqual([], env.elements.get_by_class(Token))
+
+
+class TestChanges(TestCase):
+
+    def env(self, **kwargs) -> Environment:
+        env = Environment(lambda e: None, [], indexes=('owner',), **kwargs)
+        env.elements.add(Die('die', 6, 3))
+        env.elements.add(Piece('piece', 'alice', 'a1'))
+        return env
+
+    def test_in_place(self):
+        env = self.env()
+        die = env.elements['die']
+        env.accept(ChangeElementModification(Die, 'die', [('faces', 20)]))
+        self.assertIs(die, env.elements['die'])
+        # Not rolled again
+        self.assertEqual((20, 3), (die.faces, die.number))
+        env.accept(ChangeElementModification(Die, 'die', [('number', -1)]))
+        self.assertEqual(-1, die.number)
+
+    def test_indexes(self):
+        env = self.env()
+        piece = env.elements['piece']
+        env.accept(ChangeElementModification(Piece, 'piece', [('location', 'b2')]))
+        self.assertEqual([env.elements['piece']], env.elements.find(owner='alice'))
+        env.accept(ChangeElementModification(Piece, 'piece', [('owner', 'bob')]))
+        self.assertEqual([], env.elements.find(owner='alice'))
+        self.assertEqual([env.elements['piece']], env.elements.find(Token, owner='bob'))
+        # Frozen, the piece was copied rather than changed
+        self.assertEqual(('alice', 'a1'), (piece.owner, piece.location))
+
+    def test_copy_on_write(self):
+        env = self.env(copy_on_write=True)
+        piece = env.elements['piece']
+        env.accept(ChangeElementModification(Piece, 'piece', [('owner', 'bob')]))
+        changed = env.elements['piece']
+        self.assertIsNot(piece, changed)
+        self.assertEqual(('alice', 0), (piece.owner, piece.version))
+        self.assertEqual(('bob', 'a1', 1), (changed.owner, changed.location, changed.version))
+        self.assertEqual([changed], env.elements.find(owner='bob'))
+        self.assertEqual([changed], env.elements.get_by_class(Piece))
+
+    def test_not_patchable(self):
+        env = self.env()
+        result = NumberResult('result', 3, ('a', 'b'), (1, 2))
+        env.elements.add(result)
+        env.accept(ChangeElementModification(NumberResult, 'result', [('orders', (2, 1))]))
+        rebuilt = env.elements['result']
+        self.assertIsNot(result, rebuilt)
+        self.assertEqual({'a': 2, 'b': 1}, rebuilt.classifiers_dict)
+
+    def test_rebuilt_by_default(self):
+        env = self.env()
+        tally = Tally('tally', 'alice')
+        env.elements.add(tally)
+        env.accept(ChangeElementModification(Tally, 'tally', [('owner', 'bob')]))
+        rebuilt = env.elements['tally']
+        self.assertIsNot(tally, rebuilt)
+        self.assertEqual('tally of bob', rebuilt.label)
+        self.assertEqual('alice', tally.owner)
+
+    def test_copy(self):
+        counter = Counter('counter', 'alice')
+        copy = counter.copy()
+        self.assertIsNot(counter, copy)
+        self.assertEqual(('counter', 'alice'), (copy.identifier, copy.owner))
+        piece = Piece('piece', 'alice', 'a1')
+        copy = piece.copy()
+        copy.patch([('owner', 'bob')])
+        self.assertEqual(('alice', 'bob'), (piece.owner, copy.owner))
+        with self.assertRaises(AttributeError):
+            copy.owner = 'carol'
+
+
+class TestFork(TestCase):
+
+    def setUp(self):
+        crypto = Crypto(Crypto.get_public_key())
+        self.client = Client(RecordingConnection(), ClientDetails(), CountingCodec, 'user', crypto)
+        self.env = Environment(lambda e: None, [self.client], indexes=('owner',))
+        self.env.elements.add(Die('die', 6, 3))
+        for i in range(20):
+            self.env.elements.add(Piece('piece{}'.format(i), 'alice', 'a1'))
+
+    def tearDown(self):
+        # The modifications accepted out of the event loop are sent, rather than in later tests
+        if self.env._sending is not None:
+            IOLoop.current().run_sync(lambda: self.env._sending)
+
+    def test_isolation(self):
+        die = self.env.elements['die']
+        fork = self.env.fork()
+        fork.accept(ChangeElementModification(Die, 'die', [('number', 5)]))
+        fork.accept(ChangeElementModification(Piece, 'piece0', [('owner', 'bob')]))
+        fork.accept(RemoveElementModification(fork.elements['piece1']))
+        fork.accept(NewElementModification(Token, [('identifier', 'token'), ('owner', 'bob')]))
+        # The parent is left as it was
+        self.assertIs(die, self.env.elements['die'])
+        self.assertEqual(3, die.number)
+        self.assertEqual(21, len(self.env.elements))
+        self.assertEqual(20, len(self.env.elements.find(owner='alice')))
+        self.assertEqual([], self.env.elements.find(owner='bob'))
+        self.assertEqual(5, fork.elements['die'].number)
+        self.assertEqual({'piece0', 'token'}, {e.identifier for e in fork.elements.find(owner='bob')})
+        self.assertEqual(18, len(fork.elements.find(Piece, owner='alice')))
+        # Nor are forks changed by the parent
+        self.env.accept(ChangeElementModification(Die, 'die', [('number', 1)]))
+        self.assertEqual(5, fork.elements['die'].number)
+        self.assertEqual(3, die.number)
+
+    def test_in_place_after_fork(self):
+        self.env.fork()
+        self.env.accept(ChangeElementModification(Die, 'die', [('number', 1)]))
+        copied = self.env.elements['die']
+        self.env.accept(ChangeElementModification(Die, 'die', [('number', 2)]))
+        self.assertIs(copied, self.env.elements['die'])
+
+    def test_detached(self):
+        called = []
+        self.env.add_post_hook(called.append)
+        self.env.seat(self.client, Player('alice'), 'red')
+        fork = self.env.fork()
+        IOLoop.current().run_sync(lambda: fork.accept(ChangeElementModification(Die, 'die', [('number', 1)])))
+        self.assertEqual(([], []), (called, self.client.connection.sent))
+        self.assertEqual(([], {}), (fork.clients, fork.viewers))
+        self.assertEqual('red', fork.teams['alice'])
+        attached = self.env.fork(clients=True, hooks=True)
+        IOLoop.current().run_sync(lambda: attached.accept(ChangeElementModification(Die, 'die', [('number', 2)])))
+        self.assertEqual(1, len(called))
+        self.assertEqual(1, len(self.client.connection.sent))
+        self.assertEqual([self.client], self.env.clients)
+
+    def test_game_over_isolation(self):
+        for name in ('alice', 'bob', 'carol'):
+            self.env.make_player(Player(name))
+        alice, bob, carol = (self.env.elements[name] for name in ('alice', 'bob', 'carol'))
+        fork = self.env.fork()
+        fork.accept(PlayerWinsModification([alice]))
+        fork.accept(PlayerLosesModification([bob]))
+        fork.accept(PlayerLosesModification([carol]))
+        self.assertEqual([True, True, True], [fork.elements['alice'].is_winner, fork.elements['bob'].is_loser,
+                                              fork.elements['carol'].is_loser])
+        self.assertEqual((['alice'], ['bob', 'carol']), ([p.identifier for p in fork.winning_player],
+                                                         [p.identifier for p in fork.losing_players]))
+        # The parent, and the players the modifications were made with, are left as they were
+        self.assertEqual([False, False, False], [alice.is_winner, bob.is_loser, carol.is_loser])
+        self.assertIs(alice, self.env.elements['alice'])
+        self.assertFalse(hasattr(self.env, 'winning_player'))
+
+    def test_thread(self):
+        called = []
+        fork = self.env.fork()
+        fork.add_post_hook(called.append)
+        # No event loop in the thread
+        thread = Thread(target=lambda: called.append(
+            fork.accept(ChangeElementModification(Die, 'die', [('number', 1)]))))
+        thread.start()
+        thread.join()
+        self.assertEqual(2, len(called))
+        self.assertIsNone(called[1])
+        self.assertEqual(1, fork.elements['die'].number)
+
+    def test_restore(self):
+        called = []
+        self.env.add_post_hook(called.append)
+        snapshot = self.env.snapshot()
+        for _ in range(2):
+            self.env.accept(ChangeElementModification(Die, 'die', [('number', 1)]))
+            self.env.accept(RemoveElementModification(self.env.elements['piece0']))
+            self.env.restore(snapshot)
+            self.assertEqual(3, self.env.elements['die'].number)
+            self.assertEqual(20, len(self.env.elements.find(Piece, owner='alice')))
+        self.assertEqual([self.client], self.env.clients)
+        self.env.accept(ChangeElementModification(Die, 'die', [('number', 4)]))
+        self.assertEqual(5, len(called))
+        self.assertEqual(3, snapshot.elements['die'].number)
+
+    def test_copy_on_write(self):
+        env = Environment(lambda e: None, [], copy_on_write=True)
+        env.elements.add(Die('die', 6, 3))
+        die = env.elements['die']
+        fork = env.fork()
+        fork.accept(ChangeElementModification(Die, 'die', [('number', 1)]))
+        changed = fork.elements['die']
+        fork.accept(ChangeElementModification(Die, 'die', [('number', 2)]))
+        self.assertIsNot(changed, fork.elements['die'])
+        self.assertEqual((3, 1), (die.number, changed.number))
@@ -0,0 +1,130 @@
+"""Tests for lazily decoded messages"""
+from unittest import TestCase
+
+from tornado.ioloop import IOLoop
+
+from bogascore.communication.client import Client, ClientDetails
+from bogascore.communication.connection import direct_connection_pair
+from bogascore.communication.lazy import LazyMessage
+from bogascore.communication.message import ChoiceMessage, InfoMessage, MultiMessage
+from bogascore.serialization.codec import BinaryCodec, JsonCodec, LazyDict, LazyList
+from bogascore.serialization.compression import compressed, register_dictionary
+from bogascore.serialization.schema import Schema
+from bogascore.serialization.serialization import SerializationException
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+
+class PlainCrypto(object):
+    """Crypto stand-in leaving messages as they are."""
+
+    def encrypt(self, message: bytes) -> bytes:
+        return message
+
+    def decrypt(self, message: bytes) -> bytes:
+        return bytes(message)
+
+
+def encode(message, codec, schema=None) -> bytes:
+    return codec.encode(schema.encode(message) if schema is not None else message.serialize())
+
+
+class TestBinaryLazyDecoding(TestCase):
+
+    def test_same_values(self):
+        value = {'a': [1, -5, 'x' * 40, None, True, 1.5, b'\x00' * 300, {'b': list(range(20))}], 'c': 'short'}
+        data = BinaryCodec.encode(value)
+        lazy = BinaryCodec.decode_lazy(data)
+        self.assertIsInstance(lazy, LazyDict)
+        self.assertEqual(BinaryCodec.decode(data), dict(lazy))
+        items = lazy.view('a')
+        self.assertIsInstance(items, LazyList)
+        self.assertEqual(BinaryCodec.decode(data)['a'], list(items))
+
+    def test_malformed(self):
+        data = BinaryCodec.encode({'a': [1, 2, 3]})
+        with self.assertRaises(ValueError):
+            BinaryCodec.decode_lazy(data[:-1])
+        with self.assertRaises(ValueError):
+            BinaryCodec.decode_lazy(data + b'\x00')
+
+
+class TestLazyMessage(TestCase):
+
+    def check(self, codec, schema=None):
+        message = ChoiceMessage('Which one?', ['a', 'b', 'c'])
+        lazy = LazyMessage(encode(message, codec, schema), codec, schema)
+        self.assertIs(ChoiceMessage, lazy.msg_type)
+        self.assertEqual(message.priority, lazy.priority)
+        self.assertEqual('Which one?', lazy.description)
+        self.assertEqual(['a', 'b', 'c'], lazy.choices)
+        self.assertEqual(message, lazy.materialize())
+        with self.assertRaises(AttributeError):
+            lazy.text
+
+    def test_codecs(self):
+        self.check(JsonCodec)
+        self.check(BinaryCodec)
+        identifier = register_dictionary(b'Which one?ChoiceMessage')
+        self.check(compressed(BinaryCodec, identifier, threshold=0))
+
+    def test_records(self):
+        self.check(JsonCodec, Schema.current())
+        self.check(BinaryCodec, Schema.current())
+
+    def test_members_decoded_on_access(self):
+        schema = Schema.current()
+        message = MultiMessage([InfoMessage(str(i)) for i in range(10)])
+        lazy = LazyMessage(encode(message, BinaryCodec, schema), BinaryCodec, schema)
+        self.assertIs(MultiMessage, lazy.msg_type)
+        # Only the class ID was decoded
+        self.assertEqual([0], list(lazy._fields._items))
+        self.assertNotIn('messages', vars(lazy))
+        self.assertEqual([str(i) for i in range(10)], [m.text for m in lazy.messages])
+        self.assertIn('messages', vars(lazy))
+
+    def test_unknown_class(self):
+        with self.assertRaises(SerializationException):
+            LazyMessage(JsonCodec.encode({'msg_type': 'NotAMessage'}), JsonCodec)
+
+
+class TestRelay(TestCase):
+
+    def relay(self, codec, schema=None, target_codec=None):
+        """Relay a message through a client, returning what was written and the lazy message."""
+        message = InfoMessage('hello')
+        lazy = LazyMessage(encode(message, codec, schema), codec, schema)
+        connection, other_end = direct_connection_pair()
+        client = Client(connection, ClientDetails(), target_codec or codec, 'user', PlainCrypto(), schema)
+
+        async def run():
+            await client.send(lazy)
+            return await other_end.receive()
+        return IOLoop.current().run_sync(run), lazy
+
+    def test_same_codec(self):
+        sent, lazy = self.relay(BinaryCodec, Schema.current())
+        self.assertIs(lazy.data, sent)
+        # Nothing was deserialized
+        self.assertNotIn('text', vars(lazy))
+
+    def test_other_codec(self):
+        sent, lazy = self.relay(BinaryCodec, None, JsonCodec)
+        self.assertEqual(InfoMessage('hello').serialize(), JsonCodec.decode(sent))
+
+    def test_receive_lazy(self):
+        connection, other_end = direct_connection_pair()
+        client = Client(connection, ClientDetails(), BinaryCodec, 'user', PlainCrypto(), None)
+
+        async def run():
+            await other_end.send(encode(InfoMessage('hi'), BinaryCodec))
+            return await client.receive_lazy()
+        lazy = IOLoop.current().run_sync(run)
+        self.assertIs(InfoMessage, lazy.msg_type)
+        self.assertEqual('hi', lazy.text)
@@ -0,0 +1,141 @@
+"""Tests for outbound queues"""
+from asyncio import ensure_future, sleep
+from unittest import TestCase
+
+from tornado.ioloop import IOLoop
+from tornado.locks import Event
+
+from bogascore.communication.client import Client, ClientDetails, ClientException
+from bogascore.communication.message import InfoMessage, Message, ChoiceMessage
+from bogascore.communication.outbound import OutboundQueue, OutboundQueueException, drop_low_priority, merge, \
+    disconnect
+from bogascore.elements import NumberResult
+from bogascore.environment import ChangeElementModification
+from bogascore.serialization.codec import JsonCodec
+from bogasserver.security import Crypto
+from bogastest.connections import RecordingConnection
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+
+def encode(message: Message) -> bytes:
+    return JsonCodec.encode(message.serialize())
+
+
+class LoggedChange(ChangeElementModification):
+    """A change carrying a log line, lost if merged into a plain change."""
+
+    members = ChangeElementModification.members + (
+        ('log', str),
+    )
+
+    def __init__(self, element_class, element_id, args, log: str = None, msg_type: type = None):
+        super(LoggedChange, self).__init__(element_class, element_id, args, msg_type)
+        self.log = log
+
+
+class TestOutboundQueue(TestCase):
+
+    def setUp(self):
+        self.written = []
+        self.gate = Event()
+
+    async def write(self, data: bytes) -> None:
+        """A stalled client: nothing is written until the gate opens."""
+        await self.gate.wait()
+        self.written.append(Message.parse_message(JsonCodec.decode(data)))
+
+    def queue(self, **kwargs) -> OutboundQueue:
+        return OutboundQueue(encode, self.write, **kwargs)
+
+    def test_priorities(self):
+        queue = self.queue()
+
+        async def run():
+            for i in range(3):
+                await queue.put(InfoMessage(str(i)))
+            await queue.put(ChoiceMessage('Odd or even?', ('odd', 'even')))
+            await sleep(0)
+            self.gate.set()
+            await queue.join()
+        IOLoop.current().run_sync(run)
+        self.assertEqual(['Odd or even?', '0', '1', '2'],
+                         [getattr(m, 'text', getattr(m, 'description', None)) for m in self.written])
+
+    def test_backpressure(self):
+        queue = self.queue(high_watermark=500, low_watermark=100)
+
+        async def run():
+            blocked = None
+            for i in range(20):
+                put = ensure_future(queue.put(InfoMessage('message {}'.format(i))))
+                await sleep(0)
+                if not put.done():
+                    blocked = i
+                    break
+            self.assertIsNotNone(blocked)
+            self.assertGreater(queue.size, 500)
+            self.gate.set()
+            await put
+            self.assertLessEqual(queue.size, 100)
+            await queue.join()
+            return blocked
+        blocked = IOLoop.current().run_sync(run)
+        self.assertEqual(blocked + 1, len(self.written))
+
+    def test_drop_low_priority(self):
+        queue = self.queue(high_watermark=300, policy=drop_low_priority)
+
+        async def run():
+            for i in range(10):
+                await queue.put(InfoMessage('message {}'.format(i)))
+            await queue.put(ChoiceMessage('Odd or even?', ('odd', 'even')))
+            self.gate.set()
+            await queue.join()
+        IOLoop.current().run_sync(run)
+        self.assertLess(len(self.written), 11)
+        self.assertEqual(1, sum(isinstance(m, ChoiceMessage) for m in self.written))
+
+    def test_merge(self):
+        queue = self.queue(high_watermark=600, policy=merge)
+
+        async def run():
+            for i in range(10):
+                await queue.put(ChangeElementModification(NumberResult, 'roll', [('number', i)]))
+                await queue.put(ChangeElementModification(NumberResult, 'total', [('number', i)]))
+            self.gate.set()
+            await queue.join()
+        IOLoop.current().run_sync(run)
+        self.assertLess(len(self.written), 20)
+        self.assertEqual({'number': 9}, dict([m for m in self.written if m.element_id == 'roll'][-1].args))
+        self.assertEqual({'number': 9}, dict([m for m in self.written if m.element_id == 'total'][-1].args))
+
+    def test_merged_keeps_class(self):
+        first = LoggedChange(NumberResult, 'roll', [('number', 1), ('rolls', 1)], 'first roll')
+        merged = first.merged(LoggedChange(NumberResult, 'roll', [('number', 6)]))
+        self.assertIs(LoggedChange, type(merged))
+        self.assertEqual('first roll', merged.log)
+        self.assertEqual({'number': 6, 'rolls': 1}, dict(merged.args))
+        self.assertEqual({'number': 1, 'rolls': 1}, dict(first.args))
+        self.assertNotEqual(first.merge_key(), ChangeElementModification(NumberResult, 'roll', []).merge_key())
+
+    def test_disconnect(self):
+        crypto = Crypto(Crypto.get_public_key())
+        client = Client(RecordingConnection(), ClientDetails(), JsonCodec, 'test_user', crypto,
+                        high_watermark=300, overflow_policy=disconnect)
+        client.connection.send = self.write
+
+        async def run():
+            for i in range(10):
+                await client.send(InfoMessage('message {}'.format(i)))
+        with self.assertRaises(ClientException):
+            IOLoop.current().run_sync(run)
+        self.assertTrue(client.queue.closed)
+        with self.assertRaises(OutboundQueueException):
+            IOLoop.current().run_sync(lambda: client.queue.put(InfoMessage('Bye')))
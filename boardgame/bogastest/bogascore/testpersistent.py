@@ -0,0 +1,86 @@
+"""Tests for the persistent maps"""
+import random
+from unittest import TestCase
+
+from bogascore.persistent import EMPTY, PMap
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+
+class Key(object):
+    """Key with a chosen hash, to make collisions."""
+
+    def __init__(self, value: int, h: int):
+        self.value = value
+        self.h = h
+
+    def __hash__(self):
+        return self.h
+
+    def __eq__(self, other):
+        return isinstance(other, Key) and self.value == other.value
+
+    def __repr__(self):
+        return 'Key({})'.format(self.value)
+
+
+class TestPMap(TestCase):
+
+    def check(self, expected: dict, pmap: PMap):
+        self.assertEqual(len(expected), len(pmap))
+        self.assertEqual(expected, dict(pmap.items()))
+        self.assertEqual(set(expected), set(pmap))
+        for key, value in expected.items():
+            self.assertIn(key, pmap)
+            self.assertIs(value, pmap[key])
+
+    def random_keys(self, keys: list, operations: int = 3000):
+        rng = random.Random(42)
+        expected = {}
+        pmap = EMPTY
+        for i in range(operations):
+            key = rng.choice(keys)
+            if key in expected and rng.random() < 0.4:
+                del expected[key]
+                pmap = pmap.delete(key)
+            else:
+                expected[key] = object()
+                pmap = pmap.set(key, expected[key])
+            if i % 100 == 0:
+                self.check(expected, pmap)
+        self.check(expected, pmap)
+        for key in list(expected):
+            pmap = pmap.delete(key)
+        self.assertEqual(0, len(pmap))
+        self.assertEqual([], list(pmap))
+
+    def test_against_dict(self):
+        self.random_keys(['key{}'.format(i) for i in range(500)] + list(range(500)))
+
+    def test_collisions(self):
+        # Full collisions, and hashes sharing their lowest bits
+        self.random_keys([Key(i, i % 7) for i in range(100)] + [Key(i, i % 3 * 32) for i in range(100, 200)])
+
+    def test_persistence(self):
+        first = PMap({'a': 1, 'b': 2})
+        second = first.set('c', 3).delete('a')
+        self.assertEqual({'a': 1, 'b': 2}, dict(first))
+        self.assertEqual({'b': 2, 'c': 3}, dict(second))
+        self.assertIs(first, first.set('a', first['a']))
+        self.assertEqual({}, dict(EMPTY))
+
+    def test_missing(self):
+        pmap = PMap([(Key(1, 0), 'one')])
+        self.assertIsNone(pmap.get(Key(2, 0)))
+        self.assertNotIn(Key(2, 0), pmap)
+        with self.assertRaises(KeyError):
+            pmap[Key(2, 0)]
+        with self.assertRaises(KeyError):
+            pmap.delete('missing')
+        self.assertEqual(PMap({'a': 1}), {'a': 1})
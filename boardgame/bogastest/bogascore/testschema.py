@@ -0,0 +1,98 @@
+"""Tests for schema negotiation and records"""
+from unittest import TestCase
+
+from nacl.public import PrivateKey
+from tornado.ioloop import IOLoop
+
+from bogascore.communication.client import ClientBuilder, ClientDetails
+from bogascore.communication.connection import FakeConnection
+from bogascore.communication.message import InfoMessage, MultiMessage, ChoiceMessage, Message
+from bogascore.elements import NumberResult
+from bogascore.environment import ChangeElementModification, PlayerWinsModification, Player, \
+    RemoveElementModification
+from bogascore.serialization.codec import BinaryCodec, JsonCodec
+from bogascore.serialization.schema import Schema, RECORD_TAG
+from bogascore.serialization.serialization import TYPE_TAG
+from bogastest.bogascore.testserialization import Token
+from bogasserver.utilsmessages import IntroductionMessage, ServerKeysMessage
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+
+class TestSchema(TestCase):
+
+    def setUp(self):
+        self.schema = Schema.current()
+
+    def round_trip(self, message: Message) -> Message:
+        data = JsonCodec.decode(JsonCodec.encode(self.schema.encode(message)))
+        decoded = self.schema.decode_message(data)
+        self.assertIs(type(message), type(decoded))
+        self.assertEqual(message.serialize(), decoded.serialize())
+        return decoded
+
+    def test_stable(self):
+        self.assertIs(self.schema, Schema.current())
+        self.assertEqual(self.schema.fingerprint, Schema(list(reversed(self.schema.classes))).fingerprint)
+
+    def test_records(self):
+        message = ChangeElementModification(NumberResult, 'roll', [('number', 12)])
+        record = self.schema.encode(message)[RECORD_TAG]
+        self.assertEqual(self.schema.ids[ChangeElementModification], record[0])
+        self.assertEqual(self.schema.ids[NumberResult], record[2])
+        self.round_trip(message)
+        self.round_trip(ChoiceMessage('Odd or even?', ('odd', 'even')))
+
+    def test_nested(self):
+        decoded = self.round_trip(MultiMessage([
+            InfoMessage('Welcome!'),
+            PlayerWinsModification([Player('pippo')]),
+            RemoveElementModification(NumberResult('roll', 3, ('die_roll',), (0,))),
+        ]))
+        self.assertIsInstance(decoded.messages[1].player[0], Player)
+
+    def test_classes_outside_schema(self):
+        self.assertNotIn(Token, self.schema.ids)
+        message = RemoveElementModification(Token('token', 'pippo'))
+        self.assertEqual('Token', self.schema.encode(message)[RECORD_TAG][2][TYPE_TAG])
+        self.round_trip(message)
+        message = ChangeElementModification(Token, 'token', [('owner', 'pluto')])
+        self.assertNotIn(RECORD_TAG, self.schema.encode(message))
+        self.round_trip(message)
+
+    def test_smaller(self):
+        message = ChangeElementModification(NumberResult, 'roll', [('number', 12)])
+        self.assertLess(len(BinaryCodec.encode(self.schema.encode(message))),
+                        len(BinaryCodec.encode(message.serialize())) / 2)
+
+
+class TestSchemaNegotiation(TestCase):
+
+    def handshake(self, fingerprint: str) -> ServerKeysMessage:
+        connection = FakeConnection([JsonCodec.encode(IntroductionMessage('test_user', 'JSON', fingerprint).serialize())])
+        sent = []
+
+        async def send(message: bytes):
+            sent.append(message)
+        connection.send = send
+        builder = ClientBuilder(connection, ClientDetails())
+
+        async def run():
+            await builder.do_handshake()
+            await builder.exchange_keys(PrivateKey.generate().public_key)
+        IOLoop.current().run_sync(run)
+        self.assertEqual(fingerprint == Schema.current().fingerprint, builder.schema is not None)
+        return ServerKeysMessage.deserialize(JsonCodec.decode(sent[0]))
+
+    def test_accepted(self):
+        self.assertEqual(Schema.current().fingerprint, self.handshake(Schema.current().fingerprint).schema)
+
+    def test_refused(self):
+        self.assertEqual('', self.handshake('0123456789abcdef').schema)
+        self.assertEqual('', self.handshake('').schema)
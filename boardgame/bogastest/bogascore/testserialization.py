@@ -0,0 +1,216 @@
+"""Tests for serialization machinery"""
+import json
+from unittest import TestCase
+
+from bogascore.communication.message import ChoiceMessage, InfoMessage, MultiMessage, Message
+from bogascore.elements import NumberResult, Element
+from bogascore.elements.die import Die
+from bogascore.environment import ChangeElementModification, RemoveElementModification, PlayerWinsModification, \
+    Player, MultipleModification, NewElementModification, Environment
+from bogascore.serialization.codec import JsonCodec
+from bogascore.serialization.serialization import Serializable, SerializationException, TYPE_TAG
+from bogasserver.server import GameInfo
+from bogasserver.utilsmessages import ServerKeysMessage
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+
+def samples():
+    return [
+        ChangeElementModification(NumberResult, 'roll', [('number', 12)]),
+        ChoiceMessage('What would you like to do?', ('new_game', 'join_game')),
+        NumberResult('roll', 12, ('die_roll', 'number'), (0, 0)),
+        InfoMessage('Welcome!'),
+        ServerKeysMessage(bytes(range(40)), b''),
+    ]
+
+
+class TestCompiledSerializers(TestCase):
+
+    def test_same_output_as_reference(self):
+        for sample in samples():
+            expected = JsonCodec.encode(Serializable.serialize(sample))
+            self.assertEqual(expected, JsonCodec.encode(sample.serialize()))
+
+    def test_same_result_as_reference(self):
+        reference_deserialize = Serializable.deserialize.__func__
+        for sample in samples():
+            cls = type(sample)
+            data = sample.serialize()
+            self.assertEqual(reference_deserialize(cls, data).serialize(), cls.deserialize(data).serialize())
+
+    def test_missing_member_defaults_to_none(self):
+        message = InfoMessage('text')
+        del message.text
+        self.assertIsNone(message.serialize()['text'])
+
+    def test_errors_are_wrapped(self):
+        with self.assertRaises(SerializationException):
+            ChoiceMessage.deserialize({'msg_type': 'ChoiceMessage'})
+        message = ChoiceMessage('description', ())
+        message.choices = 3
+        with self.assertRaises(SerializationException):
+            message.serialize()
+
+    def test_hand_written_methods_are_kept(self):
+
+        class Custom(Serializable):
+
+            members = (
+                ('value', int),
+            )
+
+            def serialize(self):
+                return {'value': 0}
+
+        self.assertEqual({'value': 0}, Custom().serialize())
+        self.assertTrue(getattr(Custom.deserialize, 'compilable', False))
+
+
+class TestNestedSerializables(TestCase):
+
+    def round_trip(self, message: Message) -> Message:
+        data = json.loads(json.dumps(message.serialize()))
+        decoded = Message.parse_message(data)
+        self.assertIs(type(message), type(decoded))
+        self.assertEqual(message.serialize(), decoded.serialize())
+        return decoded
+
+    def test_element_field(self):
+        decoded = self.round_trip(RemoveElementModification(NumberResult('roll', 3, ('die_roll',), (0,))))
+        self.assertIsInstance(decoded.element, NumberResult)
+        self.assertEqual({'die_roll': 0}, decoded.element.classifiers_dict)
+
+    def test_list_of_elements(self):
+        decoded = self.round_trip(PlayerWinsModification([Player('pippo'), Player('pluto')]))
+        self.assertEqual(['pippo', 'pluto'], [p.identifier for p in decoded.player])
+        self.assertTrue(all(isinstance(p, Player) for p in decoded.player))
+
+    def test_multi_message(self):
+        messages = [
+            InfoMessage('Welcome!'),
+            ChangeElementModification(NumberResult, 'roll', [('number', 12)]),
+            MultipleModification([
+                NewElementModification(Player, [('identifier', 'pippo')]),
+                RemoveElementModification(Player('pluto')),
+            ]),
+        ]
+        decoded = self.round_trip(MultiMessage(messages))
+        self.assertEqual([type(m) for m in messages], [type(m) for m in decoded.messages])
+        self.assertIsInstance(decoded.messages[2].modifications[1].element, Player)
+
+    def test_tags_only_nested_values(self):
+        data = MultiMessage([InfoMessage('Welcome!')]).serialize()
+        self.assertNotIn(TYPE_TAG, data)
+        self.assertEqual('InfoMessage', data['messages'][0][TYPE_TAG])
+
+    def test_unknown_tag(self):
+        data = MultiMessage([InfoMessage('Welcome!')]).serialize()
+        data['messages'][0][TYPE_TAG] = 'NotAClass'
+        with self.assertRaises(SerializationException):
+            MultiMessage.deserialize(data)
+
+
+class TestSlots(TestCase):
+
+    def test_no_instance_dict(self):
+        for element in (Element('e'), NumberResult('roll', 3, ('die_roll',), (0,)), Player('pippo'), Die('d6', 6),
+                        NewElementModification(Player, [('identifier', 'pippo')]), InfoMessage('Welcome!')):
+            self.assertFalse(hasattr(element, '__dict__'), type(element).__name__)
+
+    def test_slots_not_repeated_along_inheritance(self):
+        self.assertEqual(('identifier',), Element.__slots__)
+        self.assertEqual(('number', 'classifiers', 'orders', 'classifiers_dict'), NumberResult.__slots__)
+
+    def test_undeclared_attributes_rejected(self):
+        with self.assertRaises(AttributeError):
+            Element('e').undeclared = 1
+
+    def test_dict_opt_out(self):
+
+        class Loose(Element):
+            __slots__ = ('__dict__',)
+
+        loose = Loose('loose')
+        loose.undeclared = 1
+        self.assertEqual({'identifier': 'loose'}, loose.serialize())
+
+    def test_string_private_members_rejected(self):
+        with self.assertRaises(TypeError):
+
+            class Broken(Element):
+                private_members = ('cache')
+
+
+class Token(Element):
+
+    members = Element.members + (
+        ('owner', str),
+    )
+
+    frozen = True
+
+    patchable = True
+
+    def __init__(self, identifier: str, owner: str):
+        super(Token, self).__init__(identifier)
+        self.owner = owner
+
+
+class TestFrozen(TestCase):
+
+    def test_members_read_only(self):
+        token = Token('token', 'pippo')
+        with self.assertRaises(AttributeError):
+            token.owner = 'pluto'
+
+    def test_serialized_form_cached(self):
+        token = Token('token', 'pippo')
+        self.assertIs(token.serialize(), token.serialize())
+        self.assertEqual(Serializable.serialize(token), token.serialize())
+
+    def test_hash_and_eq(self):
+        self.assertEqual(hash(Token('token', 'pippo')), hash(Token('token', 'pippo')))
+        self.assertEqual(Token('token', 'pippo'), Token('token', 'pippo'))
+        self.assertNotEqual(Token('token', 'pippo'), Token('token', 'pluto'))
+        self.assertEqual(hash(Player('pippo')), hash(Player('pippo')))
+
+    def test_game_info_dict_key(self):
+        repo = {GameInfo('test_game', 'RandomWinsGame'): 'lobby'}
+        self.assertEqual('lobby', repo[GameInfo('test_game', 'RandomWinsGame')])
+
+    def test_replacement_bumps_version(self):
+        env = Environment(lambda e: None, [], copy_on_write=True)
+        env.accept(NewElementModification(Token, [('identifier', 'token'), ('owner', 'pippo')]))
+        first = env.elements['token']
+        first_serialized = first.serialize()
+        env.accept(ChangeElementModification(Token, 'token', [('owner', 'pluto')]))
+        second = env.elements['token']
+        self.assertEqual((0, 1), (first.version, second.version))
+        self.assertIs(first_serialized, first.serialize())
+        self.assertEqual('pluto', second.serialize()['owner'])
+
+    def test_patch_bumps_version(self):
+        env = Environment(lambda e: None, [])
+        env.accept(NewElementModification(Token, [('identifier', 'token'), ('owner', 'pippo')]))
+        self.assertEqual('pippo', env.elements['token'].serialize()['owner'])
+        env.accept(ChangeElementModification(Token, 'token', [('owner', 'pluto')]))
+        token = env.elements['token']
+        held = {token: 'pluto'}
+        env.accept(ChangeElementModification(Token, 'token', [('owner', 'paperino')]))
+        # Frozen elements are patched as copies, even when owned: those held keep their hash
+        patched = env.elements['token']
+        self.assertIsNot(token, patched)
+        self.assertEqual((1, 'pluto'), (token.version, token.owner))
+        self.assertEqual('pluto', held[Token('token', 'pluto')])
+        self.assertEqual(2, patched.version)
+        self.assertEqual('paperino', patched.serialize()['owner'])
+        self.assertEqual(hash(Token('token', 'paperino')), hash(patched))
+        with self.assertRaises(AttributeError):
+            patched.patch([('missing', 1)])
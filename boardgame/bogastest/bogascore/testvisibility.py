@@ -0,0 +1,212 @@
+"""Tests for the projections of modifications on what each client can see"""
+import asyncio
+from unittest import TestCase
+
+from tornado.ioloop import IOLoop
+
+from bogascore.communication.client import Client, ClientDetails
+from bogascore.communication.message import Message
+from bogascore.elements import Element, Visibility
+from bogascore.environment import Environment, Player, Viewer, SPECTATOR, NewElementModification, \
+    ChangeElementModification, RemoveElementModification, MultipleModification
+from bogascore.serialization.codec import JsonCodec
+from bogasserver.security import Crypto
+from bogastest.connections import CountingCodec, RecordingConnection
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+
+class SecretHand(Element):
+
+    members = Element.members + (
+        ('owner', str),
+        ('cards', list),
+        ('plan', str)
+    )
+
+    hidden_members = (
+        ('cards', Visibility.OWNER),
+        ('plan', Visibility.TEAM)
+    )
+
+    def __init__(self, identifier: str, owner: str, cards: list, plan: str):
+        super(SecretHand, self).__init__(identifier)
+        self.owner = owner
+        self.cards = cards
+        self.plan = plan
+
+
+class NamedHand(SecretHand):
+    """Element with a constructor of its own."""
+
+    def __init__(self, owner: str, cards: list):
+        super(NamedHand, self).__init__(owner + '-hand', owner, cards, 'bluff')
+
+
+class DealHand(NewElementModification):
+    """Modification with a constructor of its own."""
+
+    def __init__(self, owner: str, cards: list):
+        super(DealHand, self).__init__(SecretHand, [('identifier', 'hand'), ('owner', owner), ('cards', cards),
+                                                    ('plan', 'bluff')])
+
+
+class Discard(ChangeElementModification):
+
+    def __init__(self, cards: list):
+        super(Discard, self).__init__(SecretHand, 'hand', [('cards', cards)])
+
+
+HAND = [('identifier', 'hand'), ('owner', 'alice'), ('cards', ['ace', 'king']), ('plan', 'bluff')]
+
+
+class TestHiddenMembers(TestCase):
+
+    def test_hidden_from(self):
+        self.assertEqual((), SecretHand.hidden_from(Viewer('alice', 'red'), 'alice', 'red'))
+        self.assertEqual(('cards',), SecretHand.hidden_from(Viewer('bob', 'red'), 'alice', 'red'))
+        self.assertEqual(('cards', 'plan'), SecretHand.hidden_from(Viewer('carol', 'blue'), 'alice', 'red'))
+        self.assertEqual(('cards', 'plan'), SecretHand.hidden_from(SPECTATOR, 'alice', None))
+        # No team is not a team
+        self.assertEqual(('cards', 'plan'), SecretHand.hidden_from(Viewer('bob', None), 'alice', None))
+        self.assertEqual((), Element.hidden_from(SPECTATOR, 'alice', None))
+
+    def test_redacted(self):
+        hand = SecretHand('hand', 'alice', ['ace'], 'bluff')
+        redacted = hand.redacted(('cards',))
+        self.assertEqual(('hand', 'alice', [], 'bluff'),
+                         (redacted.identifier, redacted.owner, redacted.cards, redacted.plan))
+        hand = NamedHand('alice', ['ace'])
+        redacted = hand.redacted(('cards', 'plan'))
+        self.assertIsInstance(redacted, NamedHand)
+        self.assertEqual(('alice-hand', 'alice', [], ''),
+                         (redacted.identifier, redacted.owner, redacted.cards, redacted.plan))
+        self.assertEqual((['ace'], 'bluff'), (hand.cards, hand.plan))
+
+
+class TestProjections(TestCase):
+
+    def setUp(self):
+        self.clients = {
+            name: Client(RecordingConnection(), ClientDetails(), CountingCodec, name, Crypto(Crypto.get_public_key()))
+            for name in ('alice', 'bob', 'carol', 'dave', 'spectator')
+        }
+        self.env = Environment(lambda e: None, list(self.clients.values()))
+        for name, team in (('alice', 'red'), ('bob', 'red'), ('carol', 'blue'), ('dave', 'blue')):
+            player = Player(name)
+            self.env.make_player(player)
+            self.env.seat(self.clients[name], player, team)
+        CountingCodec.encoded = 0
+
+    def accept(self, modification):
+        self.assertEqual([], IOLoop.current().run_sync(lambda: self.env.accept(modification)))
+
+    def received(self, name: str) -> Message:
+        return self.all_received(name)[-1]
+
+    def all_received(self, name: str) -> list:
+        client = self.clients[name]
+        return [Message.parse_message(JsonCodec.decode(client.crypto.decrypt(m))) for m in client.connection.sent]
+
+    def hand(self, name: str) -> tuple:
+        args = dict(self.received(name).args)
+        return args['cards'], args['plan']
+
+    def test_new_element(self):
+        self.accept(NewElementModification(SecretHand, HAND))
+        self.assertEqual((['ace', 'king'], 'bluff'), self.hand('alice'))
+        self.assertEqual(([], 'bluff'), self.hand('bob'))
+        for name in ('carol', 'dave', 'spectator'):
+            self.assertEqual(([], ''), self.hand(name))
+        # One encoding for each projection: owner, team, everyone else
+        self.assertEqual(3, CountingCodec.encoded)
+        # Applied as it is
+        self.assertEqual(['ace', 'king'], self.env.elements['hand'].cards)
+        self.assertIs(self.clients['alice'], self.env.fetch_client_for_player(Player('alice')))
+
+    def test_public_change(self):
+        self.accept(NewElementModification(SecretHand, HAND))
+        CountingCodec.encoded = 0
+        self.accept(ChangeElementModification(SecretHand, 'hand', [('owner', 'bob')]))
+        self.assertEqual(1, CountingCodec.encoded)
+        self.assertEqual([('owner', 'bob')], [tuple(a) for a in self.received('spectator').args])
+
+    def test_hidden_change(self):
+        self.accept(NewElementModification(SecretHand, HAND))
+        self.accept(ChangeElementModification(SecretHand, 'hand', [('cards', ['queen'])]))
+        self.assertEqual([('cards', ['queen'])], [tuple(a) for a in self.received('alice').args])
+        self.assertEqual([('cards', [])], [tuple(a) for a in self.received('bob').args])
+
+    def test_multiple(self):
+        self.accept(MultipleModification([
+            NewElementModification(SecretHand, HAND),
+            NewElementModification(SecretHand, [('identifier', 'other'), ('owner', 'carol'), ('cards', ['two']),
+                                                ('plan', 'fold')])
+        ]))
+        alice = [dict(m.args) for m in self.received('alice').modifications]
+        self.assertEqual([['ace', 'king'], []], [m['cards'] for m in alice])
+        dave = [dict(m.args) for m in self.received('dave').modifications]
+        self.assertEqual(['', 'fold'], [m['plan'] for m in dave])
+        # Projections: alice, bob, carol, dave, spectator
+        self.assertEqual(5, CountingCodec.encoded)
+
+    def test_remove(self):
+        self.accept(NewElementModification(SecretHand, HAND))
+        hand = self.env.elements['hand']
+        self.accept(RemoveElementModification(hand))
+        self.assertEqual(['ace', 'king'], self.received('alice').element.cards)
+        self.assertEqual([], self.received('spectator').element.cards)
+        self.assertEqual('hand', self.received('spectator').element.identifier)
+
+    def test_subclasses(self):
+        deal = DealHand('alice', ['ace', 'king'])
+        # Sent to every group
+        self.accept(deal)
+        self.assertEqual(3, CountingCodec.encoded)
+        projected = deal.project(('cards', 'plan'))
+        self.assertIsInstance(projected, DealHand)
+        self.assertEqual(([], ''), (projected.element.cards, projected.element.plan))
+        self.assertEqual([], dict(projected.args)['cards'])
+        self.assertEqual(['ace', 'king'], deal.element.cards)
+        discard = Discard(['ace'])
+        self.accept(discard)
+        projected = discard.project(('cards',))
+        self.assertIsInstance(projected, Discard)
+        self.assertEqual([('cards', [])], projected.args)
+        self.assertEqual([('cards', ['ace'])], discard.args)
+
+    def test_projected_when_accepted(self):
+        self.accept(NewElementModification(SecretHand, HAND))
+
+        async def run():
+            # Both accepted before either is sent: bob owns the hand only after the first one
+            sent = [self.env.accept(ChangeElementModification(SecretHand, 'hand', [('cards', ['queen'])])),
+                    self.env.accept(ChangeElementModification(SecretHand, 'hand', [('owner', 'bob')]))]
+            return await asyncio.gather(*sent)
+        self.assertEqual([[], []], IOLoop.current().run_sync(run))
+        for name, cards in (('alice', ['queen']), ('bob', [])):
+            self.assertEqual([{'cards': cards}, {'owner': 'bob'}], [dict(m.args) for m in self.all_received(name)[-2:]])
+
+    def test_sent_in_order(self):
+        self.accept(NewElementModification(SecretHand, HAND))
+
+        async def run():
+            # The change has a projection per group, the removal is the same for everyone
+            sent = [self.env.accept(ChangeElementModification(SecretHand, 'hand', [('cards', ['queen'])])),
+                    self.env.accept(RemoveElementModification(self.env.elements['hand']))]
+            sent += [self.env.accept(ChangeElementModification(Player, name, [('identifier', name)]))
+                     for name in ('alice', 'bob')]
+            return await asyncio.gather(*sent)
+        self.assertEqual([[]] * 4, IOLoop.current().run_sync(run))
+        for name in self.clients:
+            received = self.all_received(name)[-4:]
+            self.assertEqual([ChangeElementModification, RemoveElementModification, ChangeElementModification,
+                              ChangeElementModification], [type(m) for m in received])
+            self.assertEqual(['hand', 'alice', 'bob'], [received[1].element.identifier] +
+                             [m.element_id for m in received[2:]])
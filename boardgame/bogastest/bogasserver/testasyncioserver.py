@@ -0,0 +1,107 @@
+"""Tests for the asyncio server"""
+import os
+import socket
+import tempfile
+from unittest import TestCase
+
+from tornado.ioloop import IOLoop
+from tornado.iostream import IOStream, StreamClosedError
+
+import bogasclient.client
+from bogascore.communication.connection import SelfOpeningSocketConnection, Framing, Connection
+from bogasserver.asyncioserver import AsyncioServer
+from bogasserver.server import Lobby
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+
+class EchoLobby(Lobby):
+    """Sends every message back."""
+
+    async def accept_connection(self, connection: Connection, client_details):
+        try:
+            while True:
+                await connection.send(await connection.receive())
+        except StreamClosedError:
+            pass
+
+
+class TestAsyncioServer(TestCase):
+
+    def serve(self, lobby: Lobby, test) -> None:
+        """Run test(port) with lobby served on port."""
+        async def run():
+            server = AsyncioServer(lobby, port=0, host='127.0.0.1')
+            await server.listen()
+            try:
+                await test(server.server.sockets[0].getsockname()[1])
+            finally:
+                server.stop()
+        IOLoop.current().run_sync(run)
+
+    def echo(self, framing: Framing, messages) -> None:
+        async def test(port: int):
+            connection = SelfOpeningSocketConnection(IOStream(socket.socket()), port=port, framing=framing)
+            for message in messages:
+                await connection.send(message)
+            for message in messages:
+                self.assertEqual(message, bytes(await connection.receive()))
+            self.assertEqual(framing, connection.framing)
+            connection.stream.close()
+        self.serve(EchoLobby(), test)
+
+    def test_legacy(self):
+        self.echo(Framing.LEGACY, [b'hello', b''] + [str(i).encode() * i for i in range(500)])
+
+    def test_negotiated(self):
+        self.echo(Framing.VARINT, [b'hello', bytes(range(256)) * 100, bytes(3 * 1024 * 1024), b'bye'])
+        self.echo(Framing.LONG, [bytes(100000), b'hello'])
+
+    def test_lobby(self):
+        lobby = Lobby(IOLoop.current())
+
+        async def test(port: int):
+            connection = SelfOpeningSocketConnection(IOStream(socket.socket()), port=port, framing=Framing.VARINT)
+            client = bogasclient.client.Client(connection)
+            await client.login()
+            self.assertEqual('Welcome!', (await client.receive()).text)
+            connection.stream.close()
+        self.serve(lobby, test)
+        self.assertIn('test_user', lobby.active_clients)
+
+    def test_unix_socket(self):
+        lobby = Lobby(IOLoop.current())
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bogas.sock')
+
+            async def run():
+                server = AsyncioServer(lobby, port=None, unix_socket=path)
+                await server.listen()
+                try:
+                    connection = SelfOpeningSocketConnection(unix_socket=path, framing=Framing.VARINT)
+                    client = bogasclient.client.Client(connection)
+                    await client.login()
+                    self.assertEqual('Welcome!', (await client.receive()).text)
+                    connection.stream.close()
+                finally:
+                    server.stop()
+            IOLoop.current().run_sync(run)
+            self.assertFalse(os.path.exists(path))
+        self.assertIn('test_user', lobby.active_clients)
+
+    def test_not_a_socket(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bogas.sock')
+            with open(path, 'w') as f:
+                f.write('not a socket')
+            server = AsyncioServer(Lobby(IOLoop.current()), port=None, unix_socket=path)
+            with self.assertRaises(ValueError):
+                IOLoop.current().run_sync(server.listen)
+            with open(path) as f:
+                self.assertEqual('not a socket', f.read())
@@ -0,0 +1,114 @@
+"""Tests for the key store"""
+import os
+import tempfile
+from unittest import TestCase
+
+from nacl.public import PrivateKey
+from tornado.ioloop import IOLoop
+
+import bogasclient.client
+from bogascore.communication.client import ClientException
+from bogasserver.keystore import KeyStore
+from bogasserver.security import Crypto, load_key_file
+from bogasserver.server import Lobby
+from bogasserver.utilsmessages import ClientKeyMessage
+from bogastest.connections import RecordingConnection
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+
+class TestKeyStore(TestCase):
+
+    def test_persistence(self):
+        key = PrivateKey.generate().public_key
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'keys.db')
+            store = KeyStore(path)
+            private_key = store.private_key()
+            self.assertEqual(private_key.encode(), store.private_key().encode())
+            store.save_public_key('alice', key)
+            store.close()
+            store = KeyStore(path)
+            self.assertEqual(private_key.encode(), store.private_key().encode())
+            self.assertEqual(key, store.public_key('alice'))
+            self.assertIsNone(store.public_key('bob'))
+            store.close()
+
+    def test_cache(self):
+        store = KeyStore(cache_size=2)
+        keys = [PrivateKey.generate().public_key for _ in range(3)]
+        self.assertIsNone(store.public_key('user0'))
+        for i, key in enumerate(keys):
+            store.save_public_key('user{}'.format(i), key)
+        self.assertEqual(['user1', 'user2'], list(store._cache))
+        # Evicted users are read back from the database
+        self.assertEqual(keys[0], store.public_key('user0'))
+        self.assertEqual(['user2', 'user0'], list(store._cache))
+
+
+class TestKnownClients(TestCase):
+
+    def setUp(self):
+        self.private_key = Crypto.get_private_key()
+
+    def tearDown(self):
+        Crypto.use_private_key(self.private_key)
+
+    def login(self, lobby: Lobby, carries_objects: bool = False, key_file: str = None) -> RecordingConnection:
+        connection = RecordingConnection(lobby.connect_direct(carries_objects))
+
+        async def run():
+            client = bogasclient.client.Client(connection, key_file=key_file)
+            await client.login()
+            self.assertEqual('Welcome!', (await client.receive()).text)
+        IOLoop.current().run_sync(run)
+        return connection
+
+    def test_one_round_trip(self):
+        store = KeyStore()
+        lobby = Lobby(IOLoop.current(), store)
+        self.assertEqual(store.private_key().encode(), Crypto.get_private_key().encode())
+        first = self.login(lobby)
+        self.assertEqual(Crypto.get_public_key(), store.public_key('test_user'))
+        second = self.login(lobby)
+        # Only the introduction was sent, where the first login sent the client key too
+        self.assertEqual(len(first.sent) - 1, len(second.sent))
+        self.assertEqual(1, len(second.sent))
+
+    def test_objects(self):
+        lobby = Lobby(IOLoop.current(), KeyStore())
+        self.login(lobby, True)
+        second = self.login(lobby, True)
+        self.assertNotIn(ClientKeyMessage, [type(m) for m in second.sent])
+
+    def test_unknown_without_store(self):
+        lobby = Lobby(IOLoop.current())
+        self.login(lobby)
+        self.assertEqual(2, len(self.login(lobby).sent))
+
+    def test_other_key(self):
+        store = KeyStore()
+        lobby = Lobby(IOLoop.current(), store)
+        store.save_public_key('test_user', PrivateKey.generate().public_key)
+        with self.assertRaises(ClientException):
+            self.login(lobby)
+
+    def test_key_file(self):
+        store = KeyStore()
+        lobby = Lobby(IOLoop.current(), store)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'client', 'key')
+            self.login(lobby, key_file=path)
+            self.assertEqual(0o600, os.stat(path).st_mode & 0o777)
+            # The key of the client is its own, the server in the same process keeps its key
+            self.assertEqual(store.private_key().encode(), Crypto.get_private_key().encode())
+            self.assertNotEqual(Crypto.get_public_key(), store.public_key('test_user'))
+            # Restarted, the client uses the same key again
+            self.assertEqual(1, len(self.login(lobby, key_file=path).sent))
+            self.assertEqual(load_key_file(path).public_key, store.public_key('test_user'))
@@ -1,4 +1,5 @@
 """Tests for Lobby"""
+from asyncio import Future
 from typing import List
 from unittest.case import TestCase
 
@@ -7,6 +8,7 @@ from tornado.gen import sleep
 from tornado.ioloop import IOLoop
 
 from bogascore.communication.client import Client
+from bogascore.communication.connection import Framing
 from bogascore.communication.message import Message
 from bogascore.serialization.codec import JsonCodec
 from bogasserver.server import Lobby
@@ -25,18 +27,27 @@ log = get_logger(__name__)
 
 
 class FakeStream(object):
+    """Stream reading the responses, LEGACY framed, then waiting for ever."""
 
     def __init__(self, responses: List[Message], codec=JsonCodec):
         self.read_count = 0
         self.responses = responses
         self.codec = codec
+        self.pending = b''
 
-    async def read_until(self, *a, **ka):
-        response = self.responses[self.read_count]
-        log.debug('Read count: {}. Sending: {}.', self.read_count, response)
-        bytes_response = self.codec.encode(response.serialize())
-        self.read_count += 1
-        return bytes_response
+    async def read_into(self, buffer: memoryview, partial: bool = False) -> int:
+        if not self.pending:
+            if self.read_count == len(self.responses):
+                await Future()
+            response = self.responses[self.read_count]
+            log.debug('Read count: {}. Sending: {}.', self.read_count, response)
+            bytes_response = self.codec.encode(response.serialize())
+            self.pending = Framing.LEGACY.header(len(bytes_response)) + bytes_response
+            self.read_count += 1
+        n = min(len(buffer), len(self.pending))
+        buffer[:n] = self.pending[:n]
+        self.pending = self.pending[n:]
+        return n
 
     async def write(self, msg: bytes):
         log.info('Fake stream got message {}.', msg)
@@ -55,11 +66,8 @@ class TestLobby(TestCase):
         ])
         async def cb():
             data = ('127.0.0.1', 8888)
-            try:
-                await lobby.accept_new_client(stream, data)
-                await sleep(0.5)
-            finally:
-                loop.stop()
+            await lobby.accept_new_client(stream, data)
+            await sleep(0.5)
         loop.run_sync(cb)
         user_in_lobby = lobby.active_clients['test_user']  # type: Client
-        assert user_in_lobby.crypto.client_key == public_client
+        assert user_in_lobby.crypto.other_key == public_client
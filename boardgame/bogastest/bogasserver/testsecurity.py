@@ -0,0 +1,113 @@
+"""Tests for the encryption of messages"""
+from unittest import TestCase
+
+from nacl.exceptions import CryptoError
+from tornado.ioloop import IOLoop
+
+import bogasclient.client
+from bogascore.communication.client import ClientBuilder, ClientDetails
+from bogascore.communication.connection import direct_connection_pair
+from bogascore.communication.message import InfoMessage
+from bogasserver.security import Crypto, session_random
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+
+def session_pair():
+    client, server = Crypto(Crypto.get_public_key()), Crypto(Crypto.get_public_key())
+    client_random, server_random = session_random(), session_random()
+    client.start_session(client_random, server_random, is_client=True)
+    server.start_session(client_random, server_random, is_client=False)
+    return client, server
+
+
+class TestSession(TestCase):
+
+    def test_both_directions(self):
+        client, server = session_pair()
+        for i in range(3):
+            self.assertEqual(b'up' * i, server.decrypt(client.encrypt(b'up' * i)))
+            self.assertEqual(b'down' * i, client.decrypt(server.encrypt(b'down' * i)))
+
+    def test_no_nonce_sent(self):
+        client, server = session_pair()
+        self.assertEqual(16, len(client.encrypt(b'hello')) - len(b'hello'))
+        # Same message, next nonce
+        self.assertNotEqual(client.encrypt(b'hello'), client.encrypt(b'hello'))
+
+    def test_directional_keys(self):
+        client, server = session_pair()
+        # A message sent back to its sender does not authenticate
+        with self.assertRaises(CryptoError):
+            client.decrypt(client.encrypt(b'hello'))
+
+    def test_replay(self):
+        client, server = session_pair()
+        message = client.encrypt(b'hello')
+        server.decrypt(message)
+        with self.assertRaises(CryptoError):
+            server.decrypt(message)
+        # The failed message did not count
+        self.assertEqual(b'next', server.decrypt(client.encrypt(b'next')))
+
+    def test_reordering(self):
+        client, server = session_pair()
+        first, second = client.encrypt(b'first'), client.encrypt(b'second')
+        with self.assertRaises(CryptoError):
+            server.decrypt(second)
+        self.assertEqual(b'first', server.decrypt(first))
+        self.assertEqual(b'second', server.decrypt(second))
+
+    def test_buffers(self):
+        # Large frames are received in bytearrays
+        client, server = session_pair()
+        box_client, box_server = Crypto(Crypto.get_public_key()), Crypto(Crypto.get_public_key())
+        for sender, receiver in ((client, server), (box_client, box_server)):
+            self.assertEqual(b'array', receiver.decrypt(bytearray(sender.encrypt(b'array'))))
+            self.assertEqual(b'view', receiver.decrypt(memoryview(bytearray(sender.encrypt(b'view')))))
+            self.assertEqual(b'bytes', receiver.decrypt(sender.encrypt(b'bytes')))
+
+    def test_fresh_keys(self):
+        client, _ = session_pair()
+        other_client, _ = session_pair()
+        _, server = session_pair()
+        with self.assertRaises(CryptoError):
+            server.decrypt(client.encrypt(b'hello'))
+        self.assertNotEqual(client.encrypt(b'hello'), other_client.encrypt(b'hello'))
+
+
+class TestNegotiation(TestCase):
+
+    def login(self, session: bool):
+        client_end, server_end = direct_connection_pair()
+
+        async def server():
+            builder = ClientBuilder(server_end, ClientDetails())
+            await builder.do_handshake()
+            await builder.exchange_keys(None)
+            client = builder.build()
+            await client.send(InfoMessage('Welcome!'))
+            return client
+
+        async def run():
+            IOLoop.current().spawn_callback(server)
+            client = bogasclient.client.Client(client_end, session=session)
+            await client.login()
+            return client, await client.receive()
+        return IOLoop.current().run_sync(run)
+
+    def test_session(self):
+        client, message = self.login(True)
+        self.assertTrue(client.crypto.in_session)
+        self.assertEqual('Welcome!', message.text)
+
+    def test_box(self):
+        client, message = self.login(False)
+        self.assertFalse(client.crypto.in_session)
+        self.assertEqual('Welcome!', message.text)
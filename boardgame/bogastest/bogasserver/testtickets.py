@@ -0,0 +1,117 @@
+"""Tests for the resumption tickets"""
+import os
+import tempfile
+from unittest import TestCase
+
+from nacl.public import PrivateKey
+from tornado.ioloop import IOLoop
+
+import bogasclient.client
+from bogascore.communication.message import ChoiceMessage, ChoiceResponseMessage
+from bogasserver.keystore import KeyStore
+from bogasserver.security import Crypto
+from bogasserver.server import Lobby
+from bogasserver.tickets import Tickets
+from bogastest.connections import RecordingConnection
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+
+class TestTickets(TestCase):
+
+    def setUp(self):
+        self.key = PrivateKey.generate().public_key
+
+    def test_round_trip(self):
+        tickets = Tickets()
+        ticket = tickets.open(tickets.issue('alice', self.key))
+        self.assertEqual('alice', ticket.username)
+        self.assertEqual(self.key.encode(), ticket.client_key)
+
+    def test_invalid(self):
+        tickets = Tickets()
+        data = tickets.issue('alice', self.key)
+        self.assertIsNone(tickets.open(data[:-1] + bytes([data[-1] ^ 1])))
+        self.assertIsNone(tickets.open(b'garbage'))
+        # Issued by another server
+        self.assertIsNone(Tickets().open(data))
+
+    def test_expired(self):
+        tickets = Tickets(lifetime=-1)
+        self.assertIsNone(tickets.open(tickets.issue('alice', self.key)))
+
+    def test_revoked(self):
+        tickets = Tickets()
+        data = tickets.issue('alice', self.key)
+        other = tickets.issue('bob', self.key)
+        tickets.revoke('alice')
+        self.assertIsNone(tickets.open(data))
+        self.assertIsNotNone(tickets.open(other))
+
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'keys.db')
+            store = KeyStore(path)
+            tickets = Tickets(store)
+            data = tickets.issue('alice', self.key)
+            revoked = tickets.issue('bob', self.key)
+            tickets.revoke('bob')
+            store.close()
+            store = KeyStore(path)
+            tickets = Tickets(store)
+            self.assertEqual('alice', tickets.open(data).username)
+            self.assertIsNone(tickets.open(revoked))
+            store.close()
+
+
+class TestResumption(TestCase):
+
+    def setUp(self):
+        self.private_key = Crypto.get_private_key()
+
+    def tearDown(self):
+        Crypto.use_private_key(self.private_key)
+
+    def test_resume(self):
+        lobby = Lobby(IOLoop.current())
+        first = RecordingConnection(lobby.connect_direct(False))
+        client = bogasclient.client.Client(first)
+
+        async def run():
+            await client.login()
+            self.assertEqual('Welcome!', (await client.receive()).text)
+            await client.receive(ChoiceMessage)
+            self.assertTrue(client.ticket)
+            server_client = lobby.active_clients['test_user']
+            second = RecordingConnection(lobby.connect_direct(False))
+            await client.resume(second)
+            # The key of the client is in the ticket: only the introduction was sent
+            self.assertEqual(2, len(first.sent))
+            self.assertEqual(1, len(second.sent))
+            self.assertIs(server_client, lobby.active_clients['test_user'])
+            # The server goes on where it was, over the new connection
+            await client.send(ChoiceResponseMessage('join_game'))
+            choice = await client.receive(ChoiceMessage)
+            self.assertEqual('Which game do you want to join?', choice.description)
+            self.assertIs(server_client.connection.inbox, second.connection.outbox)
+        IOLoop.current().run_sync(run, timeout=10)
+
+    def test_invalid_ticket(self):
+        lobby = Lobby(IOLoop.current())
+        client = bogasclient.client.Client(lobby.connect_direct(False))
+        client.ticket = Tickets().issue('test_user', Crypto.get_public_key())
+        connection = RecordingConnection(client.connection)
+        client.connection = connection
+
+        async def run():
+            await client.login()
+            self.assertEqual('Welcome!', (await client.receive()).text)
+        IOLoop.current().run_sync(run, timeout=10)
+        # Full handshake
+        self.assertEqual(2, len(connection.sent))
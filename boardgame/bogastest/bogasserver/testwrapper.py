@@ -1,12 +1,16 @@
 """Tests for tornado wrappers"""
 
+import os
 import socket
+import tempfile
 from unittest.case import TestCase
 
 from tornado.gen import sleep
 from tornado.ioloop import IOLoop
 from tornado.iostream import IOStream
 
+import bogasclient.client
+from bogascore.communication.connection import SelfOpeningSocketConnection
 from bogascore.log import get_logger
 from bogasserver.server import Lobby
 from bogasserver.tornadowrapper import TornadoTCPServer
@@ -68,3 +72,38 @@ class TCPTest(TestCase):
         loop.spawn_callback(connect_and_send)
         server.start_listening()
         assert lobby.message == b'Testing\n', 'Expected b\'Testing\n\', got {}.'.format(repr(lobby.message))
+
+
+class UnixSocketTest(TestCase):
+
+    def test_login(self):
+        lobby = Lobby(IOLoop.current())
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bogas.sock')
+            server = TornadoTCPServer(lobby, port=None, unix_socket=path)
+
+            async def test():
+                connection = SelfOpeningSocketConnection(unix_socket=path)
+                client = bogasclient.client.Client(connection)
+                await client.login()
+                self.assertEqual('Welcome!', (await client.receive()).text)
+                connection.stream.close()
+            try:
+                IOLoop.current().run_sync(test)
+            finally:
+                server.stop()
+            self.assertFalse(os.path.exists(path))
+        self.assertIn('test_user', lobby.active_clients)
+        self.assertEqual(path, lobby.active_clients['test_user'].details.address)
+
+    def test_not_a_socket(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bogas.sock')
+            server = TornadoTCPServer(Lobby(IOLoop.current()), port=None, unix_socket=path)
+            os.remove(path)
+            with open(path, 'w') as f:
+                f.write('not a socket')
+            with self.assertRaises(ValueError):
+                server.stop()
+            with open(path) as f:
+                self.assertEqual('not a socket', f.read())
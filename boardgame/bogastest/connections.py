@@ -0,0 +1,61 @@
+"""Connections and codecs shared by the tests and benchmarks"""
+from bogascore.communication.connection import Connection
+from bogascore.serialization.codec import JsonCodec
+
+__author__ = "Marco Capitani"
+__copyright__ = "Copyright 2017, Marco Capitani"
+__credits__ = []
+__license__ = "GPLv2"
+__version__ = "0.1"
+__maintainer__ = "Marco Capitani"
+__status__ = "Pre-Alpha"
+
+
+class RecordingConnection(Connection):
+    """
+    Connection recording the messages sent.
+
+    Wrapping a connection, messages go on through it; otherwise, received messages are
+    taken from responses. With fail set, sending raises IOError.
+    """
+
+    def __init__(self, connection: Connection = None, responses=(), fail: bool = False) -> None:
+        self.connection = connection
+        if connection is not None:
+            self.carries_objects = connection.carries_objects
+        self.responses = list(responses)
+        self.fail = fail
+        self.sent = []
+
+    async def send(self, message) -> None:
+        if self.fail:
+            raise IOError('Connection lost')
+        self.sent.append(message)
+        if self.connection is not None:
+            await self.connection.send(message)
+
+    async def receive(self):
+        if self.connection is not None:
+            return await self.connection.receive()
+        return self.responses.pop(0)
+
+
+class NullConnection(Connection):
+    """Connection dropping the messages sent."""
+
+    async def send(self, message: bytes) -> None:
+        pass
+
+    async def receive(self) -> bytes:
+        raise NotImplementedError
+
+
+class CountingCodec(JsonCodec):
+    """JsonCodec counting the messages encoded."""
+
+    encoded = 0
+
+    @classmethod
+    def encode(cls, data_dict) -> bytes:
+        cls.encoded += 1
+        return super(CountingCodec, cls).encode(data_dict)